@@ -0,0 +1,294 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+
+An end-to-end benchmark that scrapes a local mock of the Discord API and media CDN, run it from anywhere with:
+    python benchmarks/endtoend.py --channels 4 --messages 5000
+"""
+
+"""
+sys.path:     Used to import the scraper from the folder above this one.
+sys.platform: Used to read the peak memory use in the right unit.
+"""
+from sys import path as syspath, platform
+
+"""
+os.path:    Used to find the folders of the scraper and the benchmark.
+os.chdir:   Used to run the scraper in a scratch folder, it keeps its configuration and output in the working directory.
+os.getcwd:  Used to move back out of the scratch folder.
+os.walk:    Used to measure what the scraper wrote.
+os.devnull: Used to throw away the progress output of the scraper.
+"""
+from os import path, chdir, getcwd, walk, devnull
+
+"""
+argparse: Used to read the benchmark settings from the command line.
+"""
+import argparse
+
+"""
+json.dumps: Used to write the configuration file and the JSON report.
+json.loads: Used to read the configuration template.
+"""
+from json import dumps, loads
+
+"""
+tempfile.mkdtemp: Used to create the scratch folder.
+shutil.rmtree:    Used to clean the scratch folder up afterwards.
+"""
+from tempfile import mkdtemp
+from shutil import rmtree
+
+"""
+time.perf_counter: Used to measure the wall time.
+time.time:         Used to give the mock channels IDs from before their first message.
+"""
+from time import perf_counter, time
+
+"""
+contextlib.redirect_stdout: Used to keep the progress output of the scraper out of the report.
+"""
+from contextlib import redirect_stdout
+
+"""
+multiprocessing.get_context: Used to run the mock server in a process of its own so that it doesn't skew the timings or the memory use of the scraper.
+"""
+from multiprocessing import get_context
+
+"""
+resource.getrusage: Used to measure the peak memory use, this doesn't exist on Windows.
+"""
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    getrusage = None
+
+"""
+The folder that holds the scraper.
+"""
+rootdir = path.dirname(path.dirname(path.abspath(__file__)))
+syspath.insert(0, rootdir)
+
+from mockdiscord import MockChannel, MockDiscord, discordepoch
+
+def serveMock(connection, settings):
+    """
+    Run the mock server until we're told to stop, then send back its counters.
+    :param connection: The end of the pipe that talks to the benchmark.
+    :param settings: The benchmark settings.
+    """
+
+    # Generate the mock channels.
+    channels = [MockChannel(channel, settings['messages'], settings['days'], settings['attachmentevery'], settings['attachmentsize']) for channel in settings['channelids']]
+
+    # Start the mock server and tell the benchmark which port it's on.
+    mock = MockDiscord(channels, settings['ratelimit'], settings['ratewindow'])
+    connection.send(mock.start())
+
+    # Wait for the benchmark to finish, then send back the counters.
+    connection.recv()
+    connection.send(mock.counters)
+    mock.stop()
+
+def getChannelIds(count, days):
+    """
+    Return the IDs for the mock channels, the snowflakes from a day before their first message since the scraper walks back to the creation of each channel.
+    :param count: The number of channels.
+    :param days: The number of days that the messages are spread over.
+    """
+
+    # Grab the snowflake from a day before the first message.
+    created = (int(time() * 1000) - discordepoch - (days + 1) * 86400 * 1000) << 22
+
+    return [str(created + index) for index in range(count)]
+
+def writeConfig(workdir, settings):
+    """
+    Write the configuration and token files for the scraper, starting from the configuration template of the repository.
+    :param workdir: The scratch folder.
+    :param settings: The benchmark settings.
+    """
+
+    # Read the configuration template.
+    with open(path.join(rootdir, 'config.unmodified.json'), 'r') as configstream:
+        config = loads(configstream.read())
+
+    # Point the scraper at the mock channels.
+    config['tokenfile'] = 'benchmark.token'
+    config['guilds'] = {'1': settings['channelids']}
+    config['concurrency'] = settings['concurrency']
+
+    # Turn on the options that were asked for.
+    for option in settings['options']:
+        config['options'][option] = True
+
+    with open(path.join(workdir, 'config.json'), 'w') as configstream:
+        configstream.write(dumps(config, indent=4))
+
+    with open(path.join(workdir, 'benchmark.token'), 'w') as tokenstream:
+        tokenstream.write('benchmark-token\n')
+
+def runScraper(settings):
+    """
+    Scrape every mock channel with the chosen engine and return the wall time in seconds.
+    :param settings: The benchmark settings.
+    """
+
+    # Tell the scraper to connect directly, the connection pool sends everything to the mock server anyway.
+    from globalVars import GlobalVars
+    GlobalVars.args = argparse.Namespace(direct=True, port=None, asynchronous=settings['engine'] == 'async', concurrency=settings['concurrency'], history=settings['engine'] == 'history', incremental=False)
+
+    # Import the scraper.
+    import discord as entrypoint
+    from module.DiscordScraper import DiscordScraper
+
+    with open(devnull, 'w') as nullstream, redirect_stdout(nullstream):
+        scraper = DiscordScraper()
+
+        # Start the clock.
+        start = perf_counter()
+
+        # Hand every channel over to the asyncio engine.
+        if settings['engine'] == 'async':
+            from asyncio import run
+            from module.AsyncScraper import startAll
+            run(startAll(scraper, settings['concurrency']))
+
+        # Otherwise walk the channels one after another, just like discord.py does.
+        else:
+            for guild, channels in scraper.guilds.items():
+                for channel in channels:
+                    lastmessage = entrypoint.getLastMessageId(scraper, guild, channel)
+                    entrypoint.start(scraper, guild, channel, lastmessage, settings['engine'] == 'history')
+
+            scraper.downloads.join()
+
+        # Stop the clock.
+        wall = perf_counter() - start
+
+        # Stop the image compression worker processes.
+        if scraper.compressor is not None:
+            scraper.compressor.close()
+
+    return wall
+
+def measureOutput(workdir):
+    """
+    Return the number of files and bytes that the scraper wrote.
+    :param workdir: The scratch folder.
+    """
+
+    # Create variables to store the totals.
+    files, size = 0, 0
+
+    for folder, folders, names in walk(workdir):
+        for name in names:
+            files += 1
+            size += path.getsize(path.join(folder, name))
+
+    return files, size
+
+def getPeakMemory():
+    """
+    Return the peak resident set size of this process in megabytes, or None if it can't be measured.
+    """
+
+    if getrusage is None:
+        return None
+
+    # Linux reports kilobytes while macOS reports bytes.
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+
+    return round(peak / 1048576.0 if platform == 'darwin' else peak / 1024.0, 1)
+
+def argsParser():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against a local mock of the Discord API and CDN')
+    parser.add_argument('--engine', choices=['search', 'history', 'async'], default='search', help='The engine to benchmark')
+    parser.add_argument('--channels', type=int, default=2, help='Number of mock channels')
+    parser.add_argument('--messages', type=int, default=2000, help='Number of messages in each mock channel')
+    parser.add_argument('--days', type=int, default=60, help='Number of days that the messages of a channel are spread over')
+    parser.add_argument('--attachment-every', type=int, default=10, help='Every this many messages has an attachment (0 for none)')
+    parser.add_argument('--attachment-size', type=int, default=262144, help='Size of every attachment in bytes')
+    parser.add_argument('--ratelimit', type=int, default=50, help='Requests allowed by each rate limit bucket per window')
+    parser.add_argument('--ratewindow', type=float, default=1.0, help='Length of a rate limit window in seconds')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight for the asyncio engine')
+    parser.add_argument('--option', action='append', default=[], help='Turn on a config option, for example --option compressTextData (repeatable)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch folder instead of removing it')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argsParser()
+
+    # Gather the benchmark settings.
+    settings = {
+        'engine': args.engine,
+        'messages': args.messages,
+        'days': args.days,
+        'attachmentevery': args.attachment_every,
+        'attachmentsize': args.attachment_size,
+        'ratelimit': args.ratelimit,
+        'ratewindow': args.ratewindow,
+        'concurrency': args.concurrency,
+        'options': args.option,
+        'channelids': getChannelIds(args.channels, args.days)
+    }
+
+    # Start the mock server in a process of its own.
+    context = get_context('spawn')
+    connection, childconnection = context.Pipe()
+    server = context.Process(target=serveMock, args=(childconnection, settings), daemon=True)
+    server.start()
+    port = connection.recv()
+
+    # Create the scratch folder and move into it.
+    workdir = mkdtemp(prefix='discord-benchmark-')
+    olddir = getcwd()
+    writeConfig(workdir, settings)
+    chdir(workdir)
+
+    try:
+        # Send every connection of the scraper to the mock server.
+        from module.ConnectionPool import pool
+        pool.setOverride('127.0.0.1', port)
+
+        # Run the benchmark.
+        wall = runScraper(settings)
+
+    finally:
+        # Collect the counters from the mock server.
+        connection.send('stop')
+        counters = connection.recv()
+        server.join()
+        chdir(olddir)
+
+    # Measure what the scraper wrote.
+    files, size = measureOutput(workdir)
+
+    # Throw the scratch folder away unless we were asked to keep it.
+    if not args.keep:
+        rmtree(workdir)
+
+    # Build the report.
+    report = {
+        'engine': args.engine,
+        'wall_seconds': round(wall, 3),
+        'api_requests': counters['api'],
+        'cdn_requests': counters['cdn'],
+        'rate_limited': counters['ratelimited'],
+        'requests_per_second': round((counters['api'] + counters['cdn']) / wall, 1),
+        'megabytes_served': round(counters['bytes'] / 1048576.0, 2),
+        'megabytes_per_second': round(counters['bytes'] / 1048576.0 / wall, 2),
+        'files_written': files,
+        'megabytes_written': round(size / 1048576.0, 2),
+        'peak_rss_megabytes': getPeakMemory(),
+        'workdir': workdir if args.keep else None
+    }
+
+    # Print the report.
+    if args.json:
+        print(dumps(report, indent=4))
+    else:
+        for name, value in report.items():
+            print('{0:<22} {1}'.format(name, value))
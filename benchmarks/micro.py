@@ -0,0 +1,354 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+
+Micro-benchmarks for the hot functions of the scraper with a stored baseline, run it from anywhere with:
+    python benchmarks/micro.py --save          (record a baseline on this machine)
+    python benchmarks/micro.py --tolerance 0.2 (compare against it, exit code 1 on a regression)
+"""
+
+"""
+sys.path: Used to import the scraper from the folder above this one.
+sys.exit: Used to fail the run when a benchmark regresses.
+"""
+from sys import path as syspath, exit
+
+"""
+os.path:   Used to find the folders of the scraper and the baseline file.
+os.chdir:  Used to write the cache files of the downloadJSON benchmark into a scratch folder.
+os.getcwd: Used to move back out of the scratch folder.
+"""
+from os import path, chdir, getcwd
+
+"""
+argparse: Used to read the benchmark settings from the command line.
+"""
+import argparse
+
+"""
+json.dumps: Used to generate the search pages and to write the baseline and the JSON report.
+json.loads: Used to read the baseline and as the benchmarked JSON decoder.
+"""
+from json import dumps, loads
+
+"""
+tempfile.mkdtemp: Used to create the scratch folder.
+shutil.rmtree:    Used to clean the scratch folder up afterwards.
+"""
+from tempfile import mkdtemp
+from shutil import rmtree
+
+"""
+timeit.Timer: Used to time the benchmarks.
+"""
+from timeit import Timer
+
+"""
+itertools.count: Used to give every downloadJSON call a cache file of its own, the scraper skips cache files that already exist.
+"""
+from itertools import count
+
+"""
+random.Random: Used to generate the same synthetic payloads on every run.
+"""
+from random import Random
+
+"""
+platform: Used to record the machine and Python version alongside the baseline.
+"""
+import platform
+
+"""
+threading.Lock: Used to give the benchmark scrapers the lock that guards their message logs.
+"""
+from threading import Lock
+
+"""
+The folder that holds the scraper and the default baseline file.
+"""
+rootdir = path.dirname(path.dirname(path.abspath(__file__)))
+syspath.insert(0, rootdir)
+
+defaultbaseline = path.join(path.dirname(path.abspath(__file__)), 'micro.baseline.json')
+
+from module.DiscordScraper import DiscordScraper
+
+"""
+The first second of the Discord epoch (January 1, 2015) as a UNIX timestamp.
+"""
+discordepoch = 1420070400
+
+"""
+File names like the ones that the scraper sanitizes and classifies, a mix of attachments, embeds and reserved device names.
+"""
+filenames = [
+    'unknown.png', 'IMG_20210210_141516.jpg', 'screenshot 2021-02-10 at 14.15.16.png', 'clip.mp4', 'video0.mov',
+    'reaction.gif', 'a_3f6d1c2e9b8a7f60.webp', 'Spoiler_SPOILER_thing.jpeg', 'notes.txt', 'archive.tar.gz',
+    'track01.flac', 'image.heic', 'what?.png', 'a<b>c:"d"|e*.jpg', 'CON', 'LPT1', 'no_extension',
+    '1234567890123456789_9876543210987654321_a_very_long_file_name_that_someone_uploaded_from_their_phone.jpg',
+]
+
+def generateMessage(generator, channel, snowflake):
+    """
+    Generate a message object in the shape that the search endpoint returns, with an attachment, embed or reply some of the time.
+    :param generator: The random number generator.
+    :param channel: The ID for the channel that the message was sent in.
+    :param snowflake: The ID for the message.
+    """
+
+    # Generate the author of the message.
+    author = generator.randrange(10 ** 17, 10 ** 18)
+
+    message = {
+        'id': str(snowflake),
+        'type': 0,
+        'content': ' '.join(generator.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'https://example.com/a', '<@{0}>'.format(author), ':emoji:']) for _ in range(generator.randrange(1, 40))),
+        'channel_id': str(channel),
+        'author': {'id': str(author), 'username': 'user{0}'.format(author % 1000), 'avatar': '{0:032x}'.format(author), 'discriminator': '0', 'public_flags': 0, 'global_name': None},
+        'attachments': [],
+        'embeds': [],
+        'mentions': [],
+        'mention_roles': [],
+        'pinned': False,
+        'mention_everyone': False,
+        'tts': False,
+        'timestamp': '2021-02-10T14:15:16.171000+00:00',
+        'edited_timestamp': None,
+        'flags': 0,
+        'components': []
+    }
+
+    # Give some of the messages an attachment.
+    if generator.random() < 0.3:
+        name = generator.choice(filenames)
+        message['attachments'].append({
+            'id': str(snowflake + 1),
+            'filename': name,
+            'size': generator.randrange(1024, 8388608),
+            'url': 'https://cdn.discordapp.com/attachments/{0}/{1}/{2}'.format(channel, snowflake + 1, name),
+            'proxy_url': 'https://media.discordapp.net/attachments/{0}/{1}/{2}'.format(channel, snowflake + 1, name),
+            'width': 1920,
+            'height': 1080,
+            'content_type': 'image/png'
+        })
+
+    # Give some of the messages an embed.
+    if generator.random() < 0.15:
+        message['embeds'].append({
+            'type': 'image',
+            'url': 'https://example.com/image.jpg',
+            'thumbnail': {'url': 'https://example.com/image.jpg', 'proxy_url': 'https://images-ext-1.discordapp.net/external/abc/https/example.com/image.jpg', 'width': 640, 'height': 480}
+        })
+
+    # Make some of the messages a reply.
+    if generator.random() < 0.1:
+        message['message_reference'] = {'channel_id': str(channel), 'message_id': str(snowflake - 4194304)}
+
+    return message
+
+def generateSearchPage(generator, hits=25, context=2):
+    """
+    Generate a search page, every hit is nested in a list with the context messages from either side of it.
+    :param generator: The random number generator.
+    :param hits: The number of hits on the page.
+    :param context: The number of context messages on either side of every hit.
+    """
+
+    # Pick a channel and a starting snowflake.
+    channel = generator.randrange(10 ** 17, 10 ** 18)
+    snowflake = DiscordScraper.timestampToSnowflake(discordepoch + 200000000)
+
+    # Create an array to store the hits.
+    messages = []
+
+    for hit in range(hits):
+        group = []
+
+        for position in range(-context, context + 1):
+            message = generateMessage(generator, channel, snowflake + position * 4194304)
+
+            # Discord marks the message that matched the search.
+            if position == 0:
+                message['hit'] = True
+
+            group.append(message)
+
+        messages.append(group)
+        snowflake -= 1000 * 4194304
+
+    return {'total_results': 5000, 'messages': messages, 'analytics_id': '0' * 32}
+
+def createScraper(compress):
+    """
+    Create a scraper that only writes cache files and picks download URLs, skipping the configuration file and the checkpoint database.
+    :param compress: Whether the messages go to the compressed message log instead of JSON files.
+    """
+
+    scraper = DiscordScraper.__new__(DiscordScraper)
+    scraper.gatherJSONData = True
+    scraper.compressTextData = compress
+    scraper.messagedatabase = None
+    scraper.guildname = '1_benchmark'
+    scraper.channelname = '{0}_{1}'.format(2 if compress else 1, 'compressed' if compress else 'plain')
+    scraper.types = {'images': True, 'videos': True, 'files': True}
+
+    # The compressed message log keeps its state on the scraper.
+    scraper.messagelogs = {}
+    scraper.manifestlock = Lock()
+
+    return scraper
+
+def getBenchmarks():
+    """
+    Return the benchmarks as a dictionary of names to functions that take no arguments, the cache files are written to the working directory.
+    """
+
+    # Use the same payloads every run.
+    generator = Random(20210210)
+
+    # Generate a search page and encode it the way it comes off the wire.
+    page = generateSearchPage(generator)
+    pagebytes = dumps(page).encode('utf-8')
+
+    # Generate the arguments for the timestamp and snowflake conversions.
+    timestamps = [discordepoch + generator.randrange(0, 200000000) for _ in range(100)]
+    snowflakes = [DiscordScraper.timestampToSnowflake(timestamp) for timestamp in timestamps]
+    days = [(generator.randrange(1, 29), generator.randrange(1, 13), generator.randrange(2015, 2022)) for _ in range(100)]
+
+    # Create the scrapers and the counter that names their cache files.
+    plain = createScraper(False)
+    compressed = createScraper(True)
+    counter = count()
+
+    def downloadJSON(scraper):
+        index = next(counter)
+        scraper.downloadJSON(page, index // 372 + 1, index // 31 % 12 + 1, index % 31 + 1)
+
+    return {
+        'getSafeName': lambda: [DiscordScraper.getSafeName(name) for name in filenames],
+        'getFileMimetype': lambda: [DiscordScraper.getFileMimetype(name) for name in filenames],
+        'getFileCategory': lambda: [DiscordScraper.getFileCategory(name) for name in filenames],
+        'timestampToSnowflake': lambda: [DiscordScraper.timestampToSnowflake(timestamp) for timestamp in timestamps],
+        'snowflakeToTimestamp': lambda: [DiscordScraper.snowflakeToTimestamp(snowflake) for snowflake in snowflakes],
+        'getDayBounds': lambda: [DiscordScraper.getDayBounds(day, month, year) for day, month, year in days],
+        'generateQueryBody': lambda: DiscordScraper.generateQueryBody(images=True, files=True, embeds=True, links=False, videos=True, nsfw=True),
+        'decodeSearchPage': lambda: loads(pagebytes),
+        'getDownloadUrls': lambda: plain.getDownloadUrls(page),
+        'downloadJSON': lambda: downloadJSON(plain),
+        'downloadJSON (compressTextData)': lambda: downloadJSON(compressed),
+    }
+
+def timeBenchmark(function, repeat):
+    """
+    Return the fastest time of a single call in seconds, the fastest run is the one least disturbed by the rest of the machine.
+    :param function: The function to time.
+    :param repeat: The number of runs to take the fastest one from.
+    """
+
+    timer = Timer(function)
+
+    # Pick a number of calls that takes at least 0.2 seconds.
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def loadBaseline(filename):
+    """
+    Return the stored baseline timings, or None if there is no baseline yet.
+    :param filename: The baseline file.
+    """
+
+    if not path.isfile(filename):
+        return None
+
+    with open(filename, 'r') as baselinestream:
+        return loads(baselinestream.read())
+
+def saveBaseline(filename, results):
+    """
+    Store the timings as the baseline, along with the machine they were taken on.
+    :param filename: The baseline file.
+    :param results: The dictionary of benchmark names to seconds per call.
+    """
+
+    baseline = {
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'seconds': results
+    }
+
+    with open(filename, 'w') as baselinestream:
+        baselinestream.write(dumps(baseline, indent=4))
+
+def argsParser():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the hot functions of the scraper')
+    parser.add_argument('--baseline', default=defaultbaseline, help='The baseline file to compare against or save to')
+    parser.add_argument('--save', action='store_true', help='Store these timings as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Fail if a benchmark is slower than its baseline by more than this fraction')
+    parser.add_argument('--repeat', type=int, default=7, help='Number of timed runs of every benchmark')
+    parser.add_argument('--filter', default=None, help='Only run the benchmarks whose name contains this text')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argsParser()
+
+    # Create the scratch folder and move into it, the downloadJSON benchmarks write their cache files there.
+    workdir = mkdtemp(prefix='discord-micro-')
+    olddir = getcwd()
+    chdir(workdir)
+
+    try:
+        benchmarks = getBenchmarks()
+
+        # Create a dictionary to store the seconds per call of every benchmark.
+        results = {}
+
+        for name, function in benchmarks.items():
+            if args.filter is None or args.filter in name:
+                results[name] = timeBenchmark(function, args.repeat)
+
+    finally:
+        chdir(olddir)
+        rmtree(workdir)
+
+    # Compare the timings against the baseline.
+    baseline = loadBaseline(args.baseline)
+    report = {}
+    regressions = []
+
+    for name, seconds in results.items():
+        previous = baseline['seconds'].get(name) if baseline is not None else None
+        change = seconds / previous - 1.0 if previous else None
+
+        report[name] = {
+            'microseconds': round(seconds * 1e6, 3),
+            'baseline_microseconds': round(previous * 1e6, 3) if previous else None,
+            'change': round(change, 3) if change is not None else None
+        }
+
+        if change is not None and change > args.tolerance:
+            regressions.append(name)
+
+    # Print the report.
+    if args.json:
+        print(dumps({'benchmarks': report, 'regressions': regressions, 'tolerance': args.tolerance}, indent=4))
+    else:
+        for name, entry in report.items():
+            change = '' if entry['change'] is None else '{0:+.1%}'.format(entry['change'])
+            print('{0:<32} {1:>12.3f} us  {2:>8}{3}'.format(name, entry['microseconds'], change, '  REGRESSION' if name in regressions else ''))
+
+    # Store the new baseline, keeping the timings of the benchmarks that were filtered out.
+    if args.save:
+        merged = dict(baseline['seconds']) if baseline is not None else {}
+        merged.update(results)
+        saveBaseline(args.baseline, merged)
+        print('Saved the baseline to {0}.'.format(args.baseline))
+
+    elif baseline is None and not args.json:
+        print('There is no baseline at {0} yet, run with --save to store one.'.format(args.baseline))
+
+    # Fail the run if anything regressed beyond the tolerance.
+    if regressions and not args.save:
+        exit(1)
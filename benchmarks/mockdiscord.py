@@ -0,0 +1,409 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+http.server.ThreadingHTTPServer:     Used to serve the mock API and CDN with a thread for every connection.
+http.server.BaseHTTPRequestHandler: Used to answer the requests.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""
+urllib.parse.urlsplit: Used to split the request path from its query string.
+urllib.parse.parse_qs: Used to read the query string.
+"""
+from urllib.parse import urlsplit, parse_qs
+
+"""
+threading.Lock:   Used to guard the counters and the rate limit buckets.
+threading.Thread: Used to run the server in the background.
+"""
+from threading import Lock, Thread
+
+"""
+json.dumps: Used to convert the responses into serialized strings.
+"""
+from json import dumps
+
+"""
+zlib.crc32: Used to give every route an opaque bucket hash, the way that Discord does.
+"""
+from zlib import crc32
+
+"""
+time.monotonic: Used to time the rate limit buckets.
+time.time:      Used to place the mock messages in the recent past.
+"""
+from time import monotonic, time
+
+"""
+The number of milliseconds between the UNIX epoch and January 1, 2015 (the Discord epoch).
+"""
+discordepoch = 1420070400000
+
+class MockChannel(object):
+    """
+    The messages of a mock channel, generated on the fly from their position so that a large channel costs no memory.
+    """
+
+    def __init__(self, id, messages, days, attachmentevery, attachmentsize):
+        """
+        :param id: The ID for the channel.
+        :param messages: The number of messages in the channel.
+        :param days: The number of days that the messages are spread over, ending now.
+        :param attachmentevery: Every this many messages has an attachment (0 for no attachments).
+        :param attachmentsize: The size of every attachment in bytes.
+        """
+
+        # Store the settings.
+        self.id = str(id)
+        self.count = messages
+        self.attachmentevery = attachmentevery
+        self.attachmentsize = attachmentsize
+
+        # Spread the snowflakes evenly from the newest message back over the days, the low bits keep the snowflakes unique.
+        self.newest = (int(time() * 1000) - discordepoch) << 22
+        self.step = max(((days * 86400 * 1000) << 22) // max(messages, 1), 1 << 22)
+
+    def getSnowflake(self, position):
+        """
+        Return the snowflake of a message, position 0 is the newest message.
+        :param position: The position of the message.
+        """
+        return self.newest - position * self.step
+
+    def getPosition(self, snowflake):
+        """
+        Return the position of the newest message that is at or below a snowflake.
+        :param snowflake: The snowflake that we're looking for.
+        """
+        return max(0, -((snowflake - self.newest) // self.step))
+
+    def select(self, minsnow, maxsnow):
+        """
+        Return the [first, last) positions of the messages strictly between two snowflakes, newest first.
+        :param minsnow: The exclusive lower bound.
+        :param maxsnow: The exclusive upper bound.
+        """
+
+        # Find the first position below the upper bound.
+        first = self.getPosition(maxsnow)
+
+        if first < self.count and self.getSnowflake(first) >= maxsnow:
+            first += 1
+
+        # Find the first position at or below the lower bound.
+        last = self.getPosition(minsnow)
+
+        if last < self.count and self.getSnowflake(last) > minsnow:
+            last += 1
+
+        return min(first, self.count), min(max(last, first), self.count)
+
+    def getMessage(self, position):
+        """
+        Return the message object at a position.
+        :param position: The position of the message.
+        """
+
+        # Grab the snowflake of the message.
+        snowflake = self.getSnowflake(position)
+
+        # Create the attachment if this message has one.
+        attachments = []
+
+        if self.attachmentevery > 0 and position % self.attachmentevery == 0:
+            attachments.append({
+                'id': str(snowflake),
+                'filename': 'file{0}.png'.format(position),
+                'size': self.attachmentsize,
+                'content_type': 'image/png',
+                'url': 'https://cdn.discordapp.com/attachments/{0}/{1}/file{2}.png'.format(self.id, snowflake, position),
+                'proxy_url': 'https://media.discordapp.net/attachments/{0}/{1}/file{2}.png'.format(self.id, snowflake, position)
+            })
+
+        return {
+            'id': str(snowflake),
+            'type': 0,
+            'channel_id': self.id,
+            'content': 'benchmark message {0} in channel {1}'.format(position, self.id),
+            'author': {'id': '1', 'username': 'benchmark', 'discriminator': '0000'},
+            'timestamp': '',
+            'edited_timestamp': None,
+            'pinned': False,
+            'attachments': attachments,
+            'embeds': []
+        }
+
+class MockDiscord(object):
+    """
+    A local stand-in for the Discord API and its media CDN, with rate limit headers, 429 responses, and byte ranges.
+    """
+
+    # The largest search offset that Discord accepts.
+    maxoffset = 5000
+
+    def __init__(self, channels, ratelimit=50, ratewindow=1.0):
+        """
+        :param channels: The list of MockChannel objects to serve, every channel belongs to guild 1.
+        :param ratelimit: The number of requests that each rate limit bucket allows in every window.
+        :param ratewindow: The length of a rate limit window in seconds.
+        """
+
+        # Map the channel IDs to the channels.
+        self.channels = dict((channel.id, channel) for channel in channels)
+
+        # Store the rate limit settings.
+        self.ratelimit = ratelimit
+        self.ratewindow = ratewindow
+
+        # Create a dictionary that maps a bucket to its [remaining requests, reset time] list.
+        self.buckets = {}
+
+        # Create the counters.
+        self.counters = {'api': 0, 'cdn': 0, 'ratelimited': 0, 'bytes': 0}
+
+        # Create a lock to guard the counters and the buckets.
+        self.lock = Lock()
+
+        # Create a block of bytes that every attachment is cut from.
+        self.block = memoryview(bytes(range(256)) * 4096)
+
+        # Create a variable to store the HTTP server.
+        self.server = None
+
+    def start(self):
+        """
+        Start serving on a free local port in the background and return the port.
+        """
+
+        # Give the request handler a reference to this object.
+        mock = self
+
+        class Handler(MockHandler):
+            discord = mock
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter.
+        :param name: The name of the counter.
+        :param amount: The amount to add.
+        """
+
+        with self.lock:
+            self.counters[name] += amount
+
+    def takeToken(self, bucket):
+        """
+        Use up a request from a rate limit bucket, returning the [remaining requests, seconds until reset] pair (remaining is negative if the request went over the limit).
+        :param bucket: The name of the bucket.
+        """
+
+        with self.lock:
+            now = monotonic()
+            state = self.buckets.get(bucket)
+
+            # Refill the bucket once its window is over.
+            if state is None or state[1] <= now:
+                state = self.buckets[bucket] = [self.ratelimit, now + self.ratewindow]
+
+            state[0] -= 1
+            return state[0], state[1] - now
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Answer the requests for the mock API and CDN.
+    """
+
+    # Keep the connections alive the way that Discord does.
+    protocol_version = 'HTTP/1.1'
+
+    # The MockDiscord object that we're serving, this is set by MockDiscord.start.
+    discord = None
+
+    def log_message(self, format, *args):
+        """
+        Keep the benchmark output clean.
+        """
+
+    def do_GET(self):
+        """
+        Answer a GET request.
+        """
+
+        # Split the path and the query string.
+        url = urlsplit(self.path)
+        query = dict((key, value[0]) for key, value in parse_qs(url.query).items())
+        parts = url.path.strip('/').split('/')
+
+        # Serve the files from the CDN.
+        if parts[0] == 'attachments':
+            return self.sendAttachment()
+
+        # Everything else belongs to the API.
+        self.discord.count('api')
+
+        # Drop the "api" and the version portions of the path.
+        parts = parts[2:]
+
+        # Apply the rate limit of the route, just like Discord the bucket hash is the same for every channel while its requests are counted separately for every major parameter (the guild or channel ID).
+        bucket = '{0:08x}'.format(crc32('/'.join('{id}' if part.isdigit() else part for part in parts).encode('utf-8')))
+        remaining, resetafter = self.discord.takeToken('{0}:{1}'.format(bucket, parts[1] if len(parts) > 1 else ''))
+        headers = {'X-RateLimit-Bucket': bucket, 'X-RateLimit-Limit': str(self.discord.ratelimit), 'X-RateLimit-Remaining': str(max(remaining, 0)), 'X-RateLimit-Reset-After': '{0:.3f}'.format(resetafter)}
+
+        if remaining < 0:
+            self.discord.count('ratelimited')
+            return self.sendJSON({'message': 'You are being rate limited.', 'retry_after': resetafter, 'global': False}, 429, headers)
+
+        # Answer the guild and channel lookups.
+        if parts[0] == 'guilds' and len(parts) == 2:
+            return self.sendJSON({'id': parts[1], 'name': 'Benchmark Guild {0}'.format(parts[1])}, 200, headers)
+
+        # Grab the channel.
+        channel = self.discord.channels.get(parts[1]) if parts[0] == 'channels' else None
+
+        if channel is None:
+            return self.sendJSON({'message': 'Unknown Channel'}, 404, headers)
+
+        if len(parts) == 2:
+            return self.sendJSON({'id': channel.id, 'name': 'channel-{0}'.format(channel.id)}, 200, headers)
+
+        # Answer the search endpoint.
+        if parts[2:] == ['messages', 'search']:
+            return self.sendSearch(channel, query, headers)
+
+        # Answer the messages endpoint.
+        if parts[2:] == ['messages']:
+            return self.sendHistory(channel, query, headers)
+
+        self.sendJSON({'message': 'Not Found'}, 404, headers)
+
+    def sendSearch(self, channel, query, headers):
+        """
+        Answer a search request for the messages between two snowflakes.
+        :param channel: The MockChannel that is being searched.
+        :param query: The query string dictionary.
+        :param headers: The rate limit headers.
+        """
+
+        # Refuse offsets past the cap just like Discord does.
+        offset = int(query.get('offset', 0))
+
+        if offset > MockDiscord.maxoffset:
+            return self.sendJSON({'message': 'Invalid Form Body'}, 400, headers)
+
+        # Find the messages in the window.
+        first, last = channel.select(int(query.get('min_id', 0)), int(query.get('max_id', 1 << 63)))
+
+        # Grab the page of messages.
+        messages = [[channel.getMessage(position)] for position in range(first + offset, min(first + offset + 25, last))]
+
+        self.sendJSON({'total_results': last - first, 'messages': messages}, 200, headers)
+
+    def sendHistory(self, channel, query, headers):
+        """
+        Answer a request for a page of messages before or after a snowflake.
+        :param channel: The MockChannel that is being read.
+        :param query: The query string dictionary.
+        :param headers: The rate limit headers.
+        """
+
+        # Grab the page size.
+        limit = min(int(query.get('limit', 50)), 100)
+
+        # Grab the oldest messages after the cursor, newest first.
+        if 'after' in query:
+            first, last = channel.select(int(query['after']), 1 << 63)
+            positions = range(max(first, last - limit), last)
+
+        # Otherwise grab the newest messages before the cursor.
+        else:
+            first, last = channel.select(0, int(query.get('before', 1 << 63)))
+            positions = range(first, min(first + limit, last))
+
+        self.sendJSON([channel.getMessage(position) for position in positions], 200, headers)
+
+    def sendAttachment(self):
+        """
+        Serve an attachment from the CDN, honoring byte ranges.
+        """
+
+        self.discord.count('cdn')
+
+        # Grab the channel and position of the attachment from its path.
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        channel = self.discord.channels.get(parts[1])
+
+        if channel is None:
+            return self.sendJSON({'message': 'Not Found'}, 404)
+
+        # Grab the byte range that we're sending.
+        size = channel.attachmentsize
+        start, end = 0, size - 1
+        status = 200
+
+        if self.headers.get('Range', '').startswith('bytes='):
+            first, _, last = self.headers['Range'][6:].partition('-')
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+            status = 206
+
+        # Send the headers.
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, size))
+
+        self.end_headers()
+
+        # Send the body in pieces cut from the shared block.
+        position = start
+
+        while position <= end:
+            offset = position % len(self.discord.block)
+            length = min(end + 1 - position, len(self.discord.block) - offset)
+            self.wfile.write(self.discord.block[offset:offset + length])
+            position += length
+
+        self.discord.count('bytes', end - start + 1)
+
+    def sendJSON(self, data, status=200, headers=None):
+        """
+        Send a JSON response.
+        :param data: The object to serialize.
+        :param status: The HTTP status code.
+        :param headers: The extra headers to send.
+        """
+        if headers is None: headers = {}
+
+        # Serialize the body.
+        body = dumps(data).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.discord.count('bytes', len(body))
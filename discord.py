@@ -5,11 +5,10 @@
 """
 
 """
-datetime.timedelta: Used to subtract an entire day from the current one.
-datetime.datetime:  Used to retrieve the current day.
+datetime.datetime:  Used to convert the snowflake of the last message into a date.
 """
 from ast import parse
-from datetime import timedelta, datetime
+from datetime import datetime
 
 """
 module.DiscordScraper: Used to access the Discord Scraper class functions.
@@ -17,18 +16,78 @@ module.DiscordScraper: Used to access the Discord Scraper class functions.
 from module import DiscordScraper
 
 """
-os._exit: Used to exit the script.
+module.Checkpoint.Checkpoint: Used to step over the history pages that a previous run already finished.
+"""
+from module.Checkpoint import Checkpoint
+
+"""
+concurrent.futures.ThreadPoolExecutor: Used to fetch the search pages of a window at the same time.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+module.SearchPlanner.SearchPlanner: Used to plan the snowflake windows of the search walk.
+"""
+from module.SearchPlanner import SearchPlanner
+
+"""
+os._exit:  Used to exit the script.
+os.getcwd: Used to find the cache directory when exporting the message logs.
+os.path:   Used to combine file paths.
 """
 from os import _exit as exit
+from os import getcwd, path
 
 """
 module.DiscordScraper.loads: Used to access the json.loads function documented in the DiscordScraper class file.
+module.DiscordScraper.warn:  Used to report a failed search page without halting the script.
 """
-from module.DiscordScraper import loads
+from module.DiscordScraper import loads, warn
 
-def getLastMessageGuild(scraper, guild, channel):
+"""
+module.Metrics.metrics: Used to write the final snapshot of the metrics.
+"""
+from module.Metrics import metrics
+
+"""
+module.Profiler.profiler: Used to time the search stage of every channel and to write the profile in --profile mode.
+"""
+from module.Profiler import profiler
+
+"""
+module.RateLimiter.limiter:            Used to hand the rate limiting of a shard process over to the shared rate limiter.
+module.RateLimiter.startSharedLimiter: Used to start the rate limiter that every shard process shares.
+"""
+from module.RateLimiter import limiter, startSharedLimiter
+
+"""
+multiprocessing.get_context: Used to start the shard processes from scratch instead of forking a process full of threads.
+queue.Empty:                 Used to check on the shard processes while waiting for their progress reports.
+"""
+from multiprocessing import get_context
+from queue import Empty
+
+"""
+contextlib.redirect_stdout: Used to send the progress output of every shard process to a log file of its own.
+time.time:                  Used to measure how long each channel took in a shard process.
+"""
+from contextlib import redirect_stdout
+from time import time
+
+"""
+module.WorkQueue.WorkQueue: Used to split the channels into snowflake ranges that workers on several hosts lease from a shared queue.
+socket.gethostname:         Used to name a worker after the host that it runs on.
+os.getpid:                  Used to tell the workers on one host apart.
+time.sleep:                 Used to wait on the units that other workers are still holding.
+"""
+from module.WorkQueue import WorkQueue
+from socket import gethostname
+from os import getpid
+from time import sleep
+
+def getLastMessageId(scraper, guild, channel):
     """
-    Use the official Discord API to retrieve the last publicly viewable message in a channel.
+    Use the official Discord API to retrieve the snowflake of the last publicly viewable message in a channel.
     :param scraper: The DiscordScraper class reference that we will be using.
     :param guild: The ID for the guild that we're wanting to scrape from.
     :param channel: The ID for the channel that we're wanting to scrape from.
@@ -48,15 +107,29 @@ def getLastMessageGuild(scraper, guild, channel):
         # Read the response data and convert it into a dictionary object.
         data = loads(response.read())
 
-        # Retrieve the snowflake of the post and convert it into a timestamp.
-        timestamp = DiscordScraper.snowflakeToTimestamp(int(data[0]['id']))
-
-        # Return the datetime object from the given timestamp above.
-        return datetime.fromtimestamp(timestamp)
+        # Return the snowflake of the post.
+        return int(data[0]['id'])
 
     except Exception as ex:
         print(ex)
 
+def getLastMessageGuild(scraper, guild, channel):
+    """
+    Use the official Discord API to retrieve the last publicly viewable message in a channel.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    """
+
+    # Retrieve the snowflake of the post.
+    snowflake = getLastMessageId(scraper, guild, channel)
+
+    # If we returned nothing then return nothing.
+    if snowflake is None: return None
+
+    # Return the datetime object from the timestamp of the snowflake.
+    return datetime.fromtimestamp(DiscordScraper.snowflakeToTimestamp(snowflake))
+
 def startDM(scraper, alias, channel, day=None):
     """
     The initialization function for the scraper script to grab direct message contents.
@@ -69,128 +142,703 @@ def startDM(scraper, alias, channel, day=None):
     # TODO: I still need to get around to implementing DM scraping, hopefully I can figure out a method of getting the true DM url from a user ID/Snowflake value to make things easier to configure.
     pass
 
-def startGuild(scraper, guild, channel, day=None):
+def grabNames(scraper, guild, channel):
     """
-    The initialization function for the scraper script.
+    Retrieve the guild and channel names and create the scrape folders.
     :param scraper: The DiscordScraper class reference that we will be using.
     :param guild: The ID for the guild that we're wanting to scrape from.
     :param channel: The ID for the channel that we're wanting to scrape from.
     """
 
-    # Get the snowflakes for the current day.
-    snowflakes = DiscordScraper.getDayBounds(day.day, day.month, day.year)
+    # Generate the guild name.
+    if scraper.guildname == None:
+        scraper.grabGuildName(guild)
 
-    # Generate a valid URL to the undocumented API function for the search feature.
-    search = 'https://discord.com/api/{0}/channels/{1}/messages/search?min_id={2}&max_id={3}&{4}'.format(scraper.apiversion, channel, snowflakes[0], snowflakes[1], scraper.query)
+    # Generate the channel name.
+    if scraper.channelname == None:
+        scraper.grabChannelName(channel)
 
-    # Update the HTTP request headers to set the referer to the current guild channel URL.
-    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+    # Generate the scrape folders. TODO: Re-enable this before pushing to the public.
+    scraper.createFolders()
 
-    try:
-        # Generate the guild name.
-        if scraper.guildname == None:
-            scraper.grabGuildName(guild)
+def searchWindow(scraper, channel, window, offset=0):
+    """
+    Request a single page of search results for a snowflake window.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param window: The [oldest, newest] snowflakes of the window, both ends are included.
+    :param offset: The number of results to skip, this picks the page.
+    """
+
+    # Generate a valid URL to the undocumented API function for the search feature (min_id and max_id are exclusive).
+    search = 'https://discord.com/api/{0}/channels/{1}/messages/search?min_id={2}&max_id={3}&{4}'.format(scraper.apiversion, channel, window[0] - 1, window[1] + 1, scraper.query)
 
-        # Generate the channel name.
-        if scraper.channelname == None:
-            scraper.grabChannelName(channel)
+    # Append the offset for every page after the first one.
+    if offset > 0:
+        search = '{0}&offset={1}'.format(search, offset)
 
-        # Generate the scrape folders. TODO: Re-enable this before pushing to the public.
-        scraper.createFolders()
+    with profiler.span('search', channel):
 
         # Grab the API response for the search query URL.
         response = DiscordScraper.requestData(search, scraper.headers)
 
-        # If we returned nothing then continue on to the previous day.
+        # If we returned nothing then return nothing.
         if response is None:
+            return None
 
-            # Set the day to yesterday.
-            day += timedelta(days=-1)
-
-            # Recursively call this function with the new day.
-            startGuild(scraper, guild, channel, day)
-        
         # Read the response data.
-        data = loads(response.read().decode('iso-8859-1'))
+        return loads(response.read().decode('iso-8859-1'))
+
+def searchPage(scraper, channel, window, offset, retries=3):
+    """
+    Request a single page of search results for a snowflake window, retrying the page with a growing pause between attempts if it fails.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param window: The [oldest, newest] snowflakes of the window, both ends are included.
+    :param offset: The number of results to skip, this picks the page.
+    :param retries: The number of times that we retry the page before giving up on it.
+    """
+
+    # Create a variable to store how long Discord asked us to wait before the next attempt.
+    wait = 0.0
+
+    for attempt in range(retries + 1):
+
+        # Back off for 1, 2, 4... seconds before every retry, or for as long as Discord asked if that's longer.
+        if attempt > 0:
+            sleep(max(wait, 2 ** (attempt - 1)))
+            wait = 0.0
+
+        try:
+            # Grab the search results for the page.
+            data = searchWindow(scraper, channel, window, offset)
+
+            # Wait for the search index if Discord is still building it for the channel (a 202 response with a retry_after value instead of results).
+            if data is not None and 'messages' not in data and 'retry_after' in data:
+                wait = float(data['retry_after'] or 0.0)
+                warn('The search index for {0} isn\'t ready yet.'.format(channel))
+                continue
+
+            # Return the page if it came back.
+            if data is not None:
+                return data
+
+        except Exception as ex:
+            warn('Search page at offset {0} failed: {1}'.format(offset, ex))
+
+    # Return nothing to signify a failed page.
+    return None
+
+def fetchPages(scraper, channel, window, posts):
+    """
+    Fetch every search page after the first one for a snowflake window at the same time and return them in order.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param window: The [oldest, newest] snowflakes of the window, both ends are included.
+    :param posts: The total_results value that the first page returned.
+    """
+
+    # Generate the offsets for every page after the first one.
+    offsets = [SearchPlanner.pagesize * (page - 1) for page in range(2, SearchPlanner.getPageCount(posts) + 1)]
+
+    # Don't bother with a thread pool if there's nothing to fetch.
+    if len(offsets) == 0:
+        return []
+
+    # Fetch the pages at the same time, the rate limit scheduler paces them and map hands them back in order.
+    with ThreadPoolExecutor(max_workers=min(scraper.concurrency, len(offsets))) as executor:
+        return list(executor.map(lambda offset: searchPage(scraper, channel, window, offset), offsets))
+
+def startGuild(scraper, guild, channel, planner):
+    """
+    Scrape the next snowflake window that the search planner hands us.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param planner: The SearchPlanner object that keeps track of the search walk for this channel.
+    """
+
+    # Get the snowflakes for the next window.
+    window = planner.nextWindow()
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Generate the guild name, channel name, and scrape folders.
+        grabNames(scraper, guild, channel)
+
+        # Grab the first page of search results for the window.
+        data = searchPage(scraper, channel, window, 0)
+
+        # If we returned nothing then continue on to the previous window.
+        if data is None:
+            planner.skip(window)
+            return planner
         
         # Get the number of posts.
         posts = data['total_results']
+
+        # Let the planner split the window if it holds too many posts, we'll search the smaller window next time around.
+        if not planner.report(window, posts):
+            return planner
         
-        # Determine if we have multiple offsets.
-        if (posts > 25):
-            pages = int(posts / 25) + 1
-            
-            for page in range(2, pages + 1):
-                # Generate a valid URL to the undocumented API function for the search feature.
-                search = 'https://discord.com/api/{0}/channels/{1}/messages/search?min_id={2}&max_id={3}&{4}&offset={5}'.format(scraper.apiversion, channel, snowflakes[0], snowflakes[1], scraper.query, 25 * (page - 1))
-
-                # Update the HTTP request headers to set the referer to the current guild channel URL.
-                scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
-
-                try:
-
-                    # Grab the API response for the search query URL.
-                    response = DiscordScraper.requestData(search, scraper.headers)
-                    
-                    # Read the response data.
-                    data2 = loads(response.read().decode('iso-8859-1'))
-                    
-                    # Append the messages from data2 into data.
-                    for message in data2['messages']:
-                        data['messages'].append(message)
-                        
-                except:
-                    pass
-            
+        # Fetch every page after the first one at the same time.
+        # Keep track of whether every page came back so that we only checkpoint complete windows.
+        complete = True
+
+        for data2 in fetchPages(scraper, channel, window, posts):
+
+            # Warn about the page if it failed even after retrying.
+            if data2 is None:
+                warn('Unable to fetch a search page for {0}/{1} between {2} and {3}!'.format(guild, channel, window[0], window[1]))
+                complete = False
+                continue
+
+            # Append the messages from data2 into data.
+            data['messages'].extend(data2['messages'])
 
         # Cache the JSON data if there's anything to cache (don't fill the cache directory with useless API response junk).
         if posts > 0:
-            scraper.downloadJSON(data, day.year, day.month, day.day)
+            scraper.downloadWindowJSON(data, window[0], window[1])
 
-        # Check the mimetypes of the embedded and attached files.
-        scraper.checkMimetypes(data)
+        # Check the mimetypes of the embedded and attached files, and record the window as finished once they're downloaded so that we never search it again.
+        scraper.checkMimetypes(data, (lambda: scraper.checkpoint.addRange(scraper.getRangeKey(channel), window[0], window[1])) if complete else None)
         
-    except:
-        pass
+    except Exception as ex:
+        warn('Failed to scrape {0}/{1} between {2} and {3}: {4}'.format(guild, channel, window[0], window[1], ex))
 
-    # Set the day to yesterday.
-    day += timedelta(days=-1)
-    
-    # Return the new day
-    return day
+        # Make sure that we move on from the window even if it failed.
+        if planner.nextWindow() == window:
+            planner.skip(window)
+
+    # Return the planner.
+    return planner
         
-def start(scraper, guild, channel, day=None):
+def historyPage(scraper, channel, before, limit=100, direction=None):
+    """
+    Use the official Discord API to retrieve a page of messages posted before (or after) a snowflake.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param before: The snowflake cursor, only messages older than this are returned.
+    :param limit: The number of messages to return, Discord allows up to 100.
+    :param direction: Set this to "after" to retrieve the messages posted right after the snowflake instead.
+    """
+    if direction is None: direction = 'before'
+
+    # Docs: https://discord.com/developers/docs/resources/channel#get-channel-messages
+    history = 'https://discord.com/api/{0}/channels/{1}/messages?{2}={3}&limit={4}'.format(scraper.apiversion, channel, direction, before, limit)
+
+    with profiler.span('search', channel):
+
+        # Grab the API response for the history URL.
+        response = DiscordScraper.requestData(history, scraper.headers)
+
+        # If we returned nothing then return nothing.
+        if response is None:
+            return None
+
+        # Read the response data.
+        return loads(response.read().decode('iso-8859-1'))
+
+def fetchHistoryPage(scraper, channel, cursor, direction=None, retries=3):
+    """
+    Request a page of the channel history, retrying the page with a growing pause between attempts if it fails.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param cursor: The snowflake cursor of the page.
+    :param direction: Set this to "after" to retrieve the messages posted right after the snowflake instead.
+    :param retries: The number of times that we retry the page before giving up on it.
+    """
+
+    for attempt in range(retries + 1):
+
+        # Back off for 1, 2, 4... seconds before every retry.
+        if attempt > 0:
+            sleep(2 ** (attempt - 1))
+
+        try:
+            # Grab the page of messages.
+            messages = historyPage(scraper, channel, cursor, direction=direction)
+
+            # Return the page if it came back.
+            if messages is not None:
+                return messages
+
+        except Exception as ex:
+            warn('History page at {0} failed: {1}'.format(cursor, ex))
+
+    # Return nothing to signify a failed page.
+    return None
+
+def startHistory(scraper, guild, channel, before):
+    """
+    Scrape a page of the channel history with the documented messages endpoint and return the cursor for the next page, None once we've reached the start of the channel, or False if the page failed even after retrying.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param before: The snowflake cursor, only messages older than this are scraped.
+    """
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Generate the guild name, channel name, and scrape folders.
+        grabNames(scraper, guild, channel)
+
+        # Grab the page of messages.
+        messages = fetchHistoryPage(scraper, channel, before)
+
+    except Exception as ex:
+        warn('Failed to scrape {0}/{1} before {2}: {3}'.format(guild, channel, before, ex))
+        return False
+
+    # Let the caller know that the page failed, the pages below it can't be reached without it.
+    if messages is None:
+        return False
+
+    # We've reached the start of the channel once there are no more messages, so record everything down to its creation as finished.
+    if not messages:
+        scraper.checkpoint.addRange(channel, int(channel), before - 1)
+        return None
+
+    # Wrap the messages up like a search response so that they go through the same cache and media pipeline.
+    data = DiscordScraper.wrapMessages(messages)
+
+    # Grab the snowflake bounds of the page, the messages come back newest first.
+    window = [int(messages[-1]['id']), int(messages[0]['id'])]
+
+    try:
+        # Cache the JSON data.
+        scraper.downloadWindowJSON(data, window[0], window[1])
+
+        # Check the mimetypes of the embedded and attached files, and record the page as finished once they're downloaded (a page that isn't full means that everything down to the creation of the channel is finished too).
+        scraper.checkMimetypes(data, lambda: scraper.checkpoint.addRange(channel, window[0] if len(messages) == 100 else int(channel), before - 1))
+
+    except Exception as ex:
+        warn('Failed to cache or download the page of {0}/{1} before {2}, it will be fetched again on the next run: {3}'.format(guild, channel, before, ex))
+
+    # Continue from the oldest message of the page, a page that isn't full means that we've reached the start of the channel.
+    return window[0] if len(messages) == 100 else None
+
+def startDelta(scraper, guild, channel, after):
+    """
+    Scrape the messages posted right after a snowflake and return the cursor for the next page.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param after: The snowflake cursor, only messages newer than this are scraped.
+    """
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Generate the guild name, channel name, and scrape folders.
+        grabNames(scraper, guild, channel)
+
+        # Grab the page of messages posted right after the cursor.
+        messages = fetchHistoryPage(scraper, channel, after, direction='after')
+
+        # We've caught up once there are no more messages.
+        if not messages:
+            return None
+
+        # Wrap the messages up like a search response so that they go through the same cache and media pipeline.
+        data = DiscordScraper.wrapMessages(messages)
+
+        # Grab the snowflake bounds of the page.
+        snowflakes = [int(message['id']) for message in messages]
+        window = [min(snowflakes), max(snowflakes)]
+
+        # Cache the JSON data.
+        scraper.downloadWindowJSON(data, window[0], window[1])
+
+        # Check the mimetypes of the embedded and attached files, and record the page as finished once they're downloaded (this raises the high-water mark past the page).
+        scraper.checkMimetypes(data, lambda: scraper.checkpoint.addRange(channel, after + 1, window[1]))
+
+    except Exception as ex:
+        print(ex)
+        return None
+
+    # Continue from the newest message of the page, a page that isn't full means that we've caught up.
+    return window[1] if len(messages) == 100 else None
+
+def start(scraper, guild, channel, lastmessage=None, history=False, incremental=False):
     """
     The initialization function for the scraper script.
     :param scraper: The DiscordScraper class reference that we will be using.
     :param guild: The ID for the guild that we're wanting to scrape from.
     :param channel: The ID for the channel that we're wanting to scrape from.
+    :param lastmessage: The snowflake of the last message in the channel.
+    :param history: A true or false (boolean) value that walks the channel with the messages endpoint instead of the search endpoint.
+    :param incremental: A true or false (boolean) value that only scrapes the messages posted since the last full run of the channel.
     """
     
-    # Determine if we've already initialized the DiscordScraper class, if so then clean it out and re-initialize a new one.
+    # Determine if we've already initialized the DiscordScraper class, if so then give the channel a clean copy of it (sharing the checkpoint database and download queue).
     if scraper is not None:
-        del scraper
+        scraper = scraper.clone()
+
+    # Grab the high-water mark of the channel if we only want what's new, the checkpoint raises it once the finished ranges reach from the creation of the channel up to a snowflake (a window that failed or whose files never finished downloading holds it back).
+    highwater = scraper.checkpoint.getHighWater(channel) if incremental else None
+
+    # Walk forward from the high-water mark 100 messages at a time and stop once we've caught up.
+    if highwater is not None:
+        cursor = highwater
+
+        while cursor is not None:
+            cursor = startDelta(scraper, guild, channel, cursor)
+
+        return None
+
+    # Determine if the last message is empty, retrieve it if so.
+    if lastmessage is None:
+        lastmessage = getLastMessageId(scraper, guild, channel)
+
+    # Skip the channel if we can't see any posts in it.
+    if lastmessage is None:
+        return None
+
+    # Walk back through the channel history 100 messages at a time, starting right after the last message.
+    if history:
+        ranges = scraper.checkpoint.getRanges(channel)
+        cursor = lastmessage + 1
+
+        while cursor is not None:
+
+            # Step over the pages that a previous run already finished.
+            cursor = Checkpoint.skipCompleted(ranges, cursor - 1) + 1
+
+            # Stop once we've stepped past the creation of the channel.
+            if cursor <= int(channel):
+                break
+
+            cursor = startHistory(scraper, guild, channel, cursor)
+
+            # Stop the walk if a page failed even after retrying, the channel isn't recorded as finished so the next run picks the walk up from here.
+            if cursor is False:
+                warn('Stopped walking the history of {0}/{1}, a page failed even after retrying.'.format(guild, channel))
+                break
+
+    else:
+        # Plan the search walk from the last message back to the creation of the channel (the channel ID is its creation snowflake), stepping over the windows that a previous run already finished.
+        planner = SearchPlanner(int(channel), lastmessage, completed=scraper.checkpoint.getRanges(scraper.getRangeKey(channel)))
+
+        # Walk through the windows until we reach the creation of the channel.
+        while not planner.finished():
+            planner = startGuild(scraper, guild, channel, planner)
+
+def startShard(index, args, tasks, progress, remote):
+    """
+    The shard process, scrape the channels that the coordinator queued up one after another until it runs out, sharing the rate limiter with the other shards.
+    :param index: The number of this shard, starting from 0.
+    :param args: The command line arguments of the coordinator.
+    :param tasks: The queue of [guild, channel] pairs, a None tells the shard to stop.
+    :param progress: The queue that the shard reports its progress to the coordinator on.
+    :param remote: The proxy of the rate limiter that every shard shares.
+    """
+    from globalVars import GlobalVars
+    GlobalVars.args = args
+
+    # Pace every request against the rate limits that the whole group of shards has used up.
+    limiter.share(remote)
+
+    # Keep the progress output of the shard out of the terminal, the coordinator prints a line for every channel instead.
+    with open(path.join(getcwd(), 'shard{0}.log'.format(index)), 'a') as logstream, redirect_stdout(logstream):
         scraper = DiscordScraper()
 
-    # Determine if the day is empty, default to the current day if so.
-    if day is None:
-        day = datetime.today()
+        # Give the shard a metrics port and snapshot file of its own.
+        scraper.startMetrics(index)
 
-    # Determine if the year is no less than 2015 since any time before this point will be guaranteed invalid.
-    if day.year <= 2014:
-        exit(0)
-        
-    # The smallest snowflake that Discord recognizes is from January 1, 2015.
-    while day > datetime(2015, 1, 1):
-        day = startGuild(scraper, guild, channel, day)
+        # Give the shard a profile of its own.
+        if args.profile:
+            profiler.start(args.profile_interval / 1000.0, args.profile_window, 'profile.shard{0}'.format(index))
+
+        while True:
+            task = tasks.get()
+
+            # Stop once the coordinator tells us that there's nothing left.
+            if task is None:
+                break
+
+            guild, channel = task
+            progress.put(['started', index, guild, channel, None])
+            started = time()
+
+            try:
+                # Scrape the channel just like the single process loop does.
+                lastmessage = None if args.incremental else getLastMessageId(scraper, guild, channel)
+                start(scraper, guild, channel, lastmessage, args.history, args.incremental)
+                progress.put(['finished', index, guild, channel, time() - started])
+
+            except Exception as ex:
+                progress.put(['failed', index, guild, channel, str(ex)])
+
+        # Wait for the download workers to finish the files that are still queued up.
+        scraper.downloads.join()
+
+        # Stop the image compression worker processes.
+        if scraper.compressor is not None:
+            scraper.compressor.close()
+
+        # Write the final snapshot of the metrics and the profile of the shard.
+        if scraper.metricsfile is not None:
+            metrics.writeSnapshot(scraper.metricsfile)
+
+        profiler.writeReport(getcwd())
+
+    progress.put(['exited', index, None, None, None])
+
+def startShards(scraper, args):
+    """
+    The coordinator, spread the configured channels over a number of shard processes that share a single rate limiter, and print their progress.
+    :param scraper: The DiscordScraper class reference that we will be using, only its list of guilds and channels is used.
+    :param args: The command line arguments.
+    """
+
+    # The shards walk their channels one after another with the threaded engine.
+    if args.asynchronous:
+        warn('The shard processes use the threaded engine, --asynchronous is ignored.')
+
+    # Grab every [guild, channel] pair, the shards take them off the queue as they go so that a long channel doesn't hold up the others.
+    channels = [[guild, channel] for guild, channelids in scraper.guilds.items() for channel in channelids]
+    shards = max(1, min(args.shards, len(channels)))
+
+    # Start the rate limiter that the shards share.
+    manager, remote = startSharedLimiter()
+
+    # Queue up the channels, followed by a stop signal for every shard.
+    context = get_context('spawn')
+    tasks = context.Queue()
+    progress = context.Queue()
+
+    for task in channels + [None] * shards:
+        tasks.put(task)
 
+    # Start the shard processes.
+    processes = [context.Process(target=startShard, args=(index, args, tasks, progress, remote)) for index in range(shards)]
+
+    for process in processes:
+        process.start()
+
+    print('Scraping {0} channels with {1} shard processes.'.format(len(channels), shards))
+
+    # Create variables to store the number of channels done and the shards that haven't exited yet.
+    done = 0
+    running = set(range(shards))
+
+    while running:
+        try:
+            event, index, guild, channel, value = progress.get(timeout=1.0)
+
+        except Empty:
+            # Notice a shard that died without telling us.
+            for index in list(running):
+                if not processes[index].is_alive():
+                    warn('Shard {0} exited unexpectedly (exit code {1}).'.format(index, processes[index].exitcode))
+                    running.discard(index)
+
+            continue
+
+        if event == 'started':
+            print('[shard {0}] Started {1}/{2}.'.format(index, guild, channel))
+
+        elif event == 'finished':
+            done += 1
+            print('[shard {0}] Finished {1}/{2} in {3:.1f} seconds ({4} of {5} channels done).'.format(index, guild, channel, value, done, len(channels)))
+
+        elif event == 'failed':
+            done += 1
+            warn('[shard {0}] Failed {1}/{2}: {3}'.format(index, guild, channel, value))
+
+        elif event == 'exited':
+            running.discard(index)
+
+    for process in processes:
+        process.join()
+
+    # Stop the shared rate limiter.
+    manager.shutdown()
+
+def startRange(scraper, guild, channel, minsnow, maxsnow, history=False):
+    """
+    Scrape the messages of a channel between two snowflakes, this is one unit of the work queue.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param minsnow: The oldest snowflake of the range.
+    :param maxsnow: The newest snowflake of the range.
+    :param history: A true or false (boolean) value that walks the range with the messages endpoint instead of the search endpoint.
+    """
 
+    # Give the range a clean copy of the scraper (sharing the checkpoint database and download queue).
+    scraper = scraper.clone()
+
+    # Walk back through the range 100 messages at a time, starting right after its newest snowflake.
+    if history:
+        ranges = scraper.checkpoint.getRanges(channel)
+        cursor = maxsnow + 1
+
+        while cursor is not None:
+
+            # Step over the pages that a previous lease already finished.
+            cursor = Checkpoint.skipCompleted(ranges, cursor - 1) + 1
+
+            # Stop once we've stepped past the oldest snowflake of the range.
+            if cursor <= minsnow:
+                break
+
+            cursor = startHistory(scraper, guild, channel, cursor)
+
+            # Stop the walk if a page failed even after retrying, the range isn't recorded as finished so the unit goes back to the queue.
+            if cursor is False:
+                warn('Stopped walking the history of {0}/{1}, a page failed even after retrying.'.format(guild, channel))
+                break
+
+    else:
+        # Plan the search walk over the range, stepping over the windows that a previous lease already finished.
+        planner = SearchPlanner(minsnow, maxsnow, completed=scraper.checkpoint.getRanges(scraper.getRangeKey(channel)))
+
+        while not planner.finished():
+            planner = startGuild(scraper, guild, channel, planner)
+
+def startWorker(scraper, args):
+    """
+    The work queue worker, lease a unit, scrape it while a heartbeat keeps the lease alive, mark it done and go around again until the queue is empty.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param args: The command line arguments.
+    """
+
+    # The worker walks its units one after another with the threaded engine.
+    if args.asynchronous or args.incremental:
+        warn('The work queue worker scrapes the leased snowflake ranges with the threaded engine, --asynchronous and --incremental are ignored.')
+
+    workqueue = WorkQueue(args.queue, args.lease)
+
+    # Name the worker after its host and process so that every lease has a single owner.
+    owner = '{0}:{1}'.format(gethostname(), getpid())
+
+    # Create a variable to store the number of units that this worker finished.
+    done = 0
+
+    while True:
+        unit = workqueue.lease(owner)
+
+        if unit is None:
+
+            # Wait while other workers still hold units, their leases come back to the queue if they die.
+            if workqueue.hasPending():
+                sleep(min(30.0, args.lease / 3.0))
+                continue
+
+            break
+
+        unitid, guild, channel, minsnow, maxsnow = unit
+        print('[{0}] Leased unit {1}: {2}/{3} from {4} to {5}.'.format(owner, unitid, guild, channel, datetime.fromtimestamp(DiscordScraper.snowflakeToTimestamp(minsnow)), datetime.fromtimestamp(DiscordScraper.snowflakeToTimestamp(maxsnow))))
+
+        # Read the manifest and message log of the channel from the disk again, the last worker to scrape it may have been on another host.
+        scraper.forgetChannels()
+
+        # Keep the lease alive while we're scraping the unit.
+        heartbeat = workqueue.startHeartbeat(unitid, owner)
+        started = time()
+
+        try:
+            startRange(scraper, guild, channel, minsnow, maxsnow, args.history)
+
+            # The unit is only done once its files are on the disk.
+            scraper.downloads.join()
+
+            # Hand the unit back if a window or page of it failed (the walk carries on past those), its finished windows are stepped over when it's leased again.
+            if not scraper.checkpoint.isCovered(scraper.getRangeKey(channel, args.history), minsnow, maxsnow):
+                warn('Unit {0} is incomplete, handing it back to the queue.'.format(unitid))
+                workqueue.release(unitid, owner)
+
+            elif workqueue.complete(unitid, owner):
+                done += 1
+                print('[{0}] Finished unit {1} in {2:.1f} seconds ({3} units done).'.format(owner, unitid, time() - started, done))
+
+            else:
+                warn('Lost the lease on unit {0} before it was finished, another worker will scrape it again.'.format(unitid))
+
+        except Exception as ex:
+            warn('Unit {0} failed: {1}'.format(unitid, ex))
+            workqueue.release(unitid, owner)
+
+        finally:
+            heartbeat.set()
+
+    workqueue.close()
+    print('[{0}] The work queue is empty, finished {1} units.'.format(owner, done))
+
+def enqueueUnits(scraper, args):
+    """
+    The work queue coordinator, split every configured channel into snowflake ranges of a few days each and queue them up for the workers.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param args: The command line arguments.
+    """
+
+    workqueue = WorkQueue(args.queue, args.lease)
+
+    # Create variables to store the number of units that were queued up and the number that were already queued.
+    added, total = 0, 0
+
+    for guild, channels in scraper.guilds.items():
+        for channel in channels:
+
+            # Retrieve the snowflake for the most recent post in the channel, skipping the channels that we can't see any posts in.
+            lastmessage = getLastMessageId(scraper, guild, channel)
+
+            if lastmessage is None:
+                continue
+
+            # Split the channel from its last message back to its creation (the channel ID is its creation snowflake).
+            for minsnow, maxsnow in WorkQueue.splitRange(int(channel), lastmessage, args.unit_days):
+                added += 1 if workqueue.enqueue(guild, channel, minsnow, maxsnow) else 0
+                total += 1
+
+    workqueue.close()
+    print('Queued {0} new units ({1} were already queued).'.format(added, total - added))
+
+def printStatus(args):
+    """
+    Print the number of units in each state and the number of units that each worker finished.
+    :param args: The command line arguments.
+    """
+
+    workqueue = WorkQueue(args.queue, args.lease)
+    status = workqueue.getStatus()
+    workqueue.close()
+
+    for state in ['queued', 'leased', 'done', 'failed']:
+        print('{0:<8} {1}'.format(state, status['states'].get(state, 0)))
+
+    for owner, count in sorted(status['owners'].items()):
+        print('{0:<8} {1} ({2} units)'.format('worker', owner, count))
+
+    print('{0} units finished in the last hour.'.format(status['lasthour']))
 
 import argparse
 def argsParser():
     parser = argparse.ArgumentParser(description='Discord Spiders')
     parser.add_argument('-d', '--direct', help='Connect directly without proxy')
     parser.add_argument('-p', '--port', default='7890', help='Local Proxy Port')
+    parser.add_argument('-a', '--asynchronous', action='store_true', help='Scrape every channel at the same time with the asyncio engine')
+    parser.add_argument('-c', '--concurrency', type=int, default=None, help='Maximum number of requests in flight for the asyncio engine (defaults to the config value)')
+    parser.add_argument('-H', '--history', action='store_true', help='Walk the full channel history 100 messages at a time instead of searching (ignores the query filters)')
+    parser.add_argument('-i', '--incremental', action='store_true', help='Only scrape the messages posted since the last full run of each channel')
+    parser.add_argument('-e', '--export', default=None, help='Export the compressed message logs to per-day JSON files in this folder and exit')
+    parser.add_argument('-I', '--import-cache', action='store_true', help='Load the cache directory into the messages.db message database and exit')
+    parser.add_argument('-P', '--profile', action='store_true', help='Time the pipeline stages of every channel and sample the stacks of every thread, writing profile.collapsed and profile.json at exit')
+    parser.add_argument('--profile-window', type=float, default=0, help='Number of seconds to sample stacks for in --profile mode (0 samples the whole run)')
+    parser.add_argument('--profile-interval', type=float, default=10, help='Milliseconds between stack samples in --profile mode')
+    parser.add_argument('-s', '--shards', type=int, default=0, help='Spread the channels over this many processes that share one rate limiter (0 keeps everything in this process)')
+    parser.add_argument('-q', '--queue', default=None, help='Lease snowflake ranges from this shared work queue file and scrape them until it runs out')
+    parser.add_argument('--enqueue', action='store_true', help='Split the configured channels into snowflake ranges, add them to the --queue file and exit')
+    parser.add_argument('--status', action='store_true', help='Print the progress of the --queue file and exit')
+    parser.add_argument('--unit-days', type=float, default=30, help='Number of days that every unit covers with --enqueue')
+    parser.add_argument('--lease', type=float, default=300, help='Number of seconds that a worker holds a unit without renewing it before it goes back to the queue')
     args = parser.parse_args()
     return args
 
@@ -199,15 +847,89 @@ if __name__ == '__main__':
     from globalVars import GlobalVars
     GlobalVars.args = args
 
+    # Export the compressed message logs to per-day JSON files if we've been asked to, this doesn't need the configuration file.
+    if args.export is not None:
+        from module.MessageLog import MessageLog
+        MessageLog.exportAll(path.join(getcwd(), 'cached'), args.export)
+        exit(0)
+
+    # Load the cache directory into the message database if we've been asked to.
+    if args.import_cache:
+        from module.MessageDatabase import MessageDatabase
+        messagedatabase = MessageDatabase(path.join(getcwd(), 'messages.db'))
+        print('Imported {0} messages.'.format(messagedatabase.importCache(path.join(getcwd(), 'cached'))))
+        messagedatabase.close()
+        exit(0)
+
+    # Print the progress of the work queue if we've been asked to, this doesn't need the configuration file either.
+    if args.queue is not None and args.status:
+        printStatus(args)
+        exit(0)
+
     discordscraper = DiscordScraper()
+
+    # Queue up the configured channels for the work queue workers if we've been asked to.
+    if args.queue is not None and args.enqueue:
+        enqueueUnits(discordscraper, args)
+        exit(0)
+
+    # Spread the channels over shard processes if we've been asked to, the coordinator only prints their progress.
+    if args.shards > 0:
+        startShards(discordscraper, args)
+        exit(0)
+
+    # Serve the metrics and write snapshots of them if we've configured the script to.
+    discordscraper.startMetrics()
+
+    # Start timing the pipeline stages and sampling the stacks if we've been asked to profile the run.
+    if args.profile:
+        profiler.start(args.profile_interval / 1000.0, args.profile_window)
+
+    # Work through the units of the shared work queue if we've been given one, instead of the configured channels.
+    if args.queue is not None:
+        startWorker(discordscraper, args)
+
+        # Stop the image compression worker processes.
+        if discordscraper.compressor is not None:
+            discordscraper.compressor.close()
+
+        # Write the final snapshot of the metrics.
+        if discordscraper.metricsfile is not None:
+            metrics.writeSnapshot(discordscraper.metricsfile)
+
+        profiler.writeReport(getcwd())
+        exit(0)
+
+    # Hand every channel over to the asyncio engine if we've been asked to.
+    if args.asynchronous:
+        from asyncio import run
+        from module.AsyncScraper import startAll
+        run(startAll(discordscraper, args.concurrency, args.history, args.incremental))
+        profiler.writeReport(getcwd())
+        exit(0)
+
     for guild, channels in discordscraper.guilds.items():
         for channel in channels:
             print("[debug]try to connect {}:{}".format(guild, channels))
-            # Retrieve the datetime object for the most recent post in the channel.
-            lastdate = getLastMessageGuild(discordscraper, guild, channel)
-            print("[debug]Last Active Date:",lastdate)
+            # Retrieve the snowflake for the most recent post in the channel (an incremental run only needs it for channels that were never scraped).
+            lastmessage = None if args.incremental else getLastMessageId(discordscraper, guild, channel)
+            print("[debug]Last Active Date:", None if lastmessage is None else datetime.fromtimestamp(DiscordScraper.snowflakeToTimestamp(lastmessage)))
             # Start the scraper for the current channel.
-            start(discordscraper, guild, channel, lastdate) # for debug temporary annoted
+            start(discordscraper, guild, channel, lastmessage, args.history, args.incremental) # for debug temporary annoted
+
+    # Wait for the download workers to finish the files that are still queued up.
+    discordscraper.downloads.join()
+
+    # Stop the image compression worker processes.
+    if discordscraper.compressor is not None:
+        discordscraper.compressor.close()
+
+    # Write the final snapshot of the metrics.
+    if discordscraper.metricsfile is not None:
+        metrics.writeSnapshot(discordscraper.metricsfile)
+
+    # Write the profile of the run if we've been asked to profile it.
+    profiler.writeReport(getcwd())
 
     # # Iterate through the direct messages to scrape.
     # for alias, channel in discordscraper.directs.items():
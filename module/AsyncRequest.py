@@ -0,0 +1,95 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+asyncio.Semaphore:          Used to cap the number of requests that are in flight at the same time across every channel.
+asyncio.get_running_loop:   Used to hand the blocking request work off to the thread pool without stalling the event loop.
+"""
+from asyncio import Semaphore, get_running_loop
+
+"""
+concurrent.futures.ThreadPoolExecutor: Used to run the blocking DiscordRequest calls over the shared keep-alive connection pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+module.RequestB.DiscordRequest: The blocking request class that does the actual talking to Discord.
+"""
+from .RequestB import DiscordRequest
+
+class AsyncDiscordRequest(object):
+    """
+    The asyncio counterpart of the DiscordRequest class, every call is awaited and bounded by a global concurrency limit.
+    """
+
+    def __init__(self, concurrency=8):
+        """
+        :param concurrency: The maximum number of requests and downloads that can be in flight at the same time.
+        """
+
+        # Store the concurrency limit.
+        self.concurrency = concurrency
+
+        # Create the semaphore that every request has to pass through.
+        self.semaphore = Semaphore(concurrency)
+
+        # Create the thread pool that runs the blocking requests, one thread for each request slot.
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def close(self):
+        """
+        Shut down the thread pool once we're finished with it.
+        """
+        self.executor.shutdown(wait=True)
+
+    async def run(self, function, *args):
+        """
+        Run a blocking function in the thread pool once a request slot opens up.
+        :param function: The blocking function that we want to run.
+        :param args: The arguments that we want to pass to the function.
+        """
+
+        async with self.semaphore:
+            return await get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def requestData(self, url, headers=None):
+        """
+        Send a request to the target URL and return the response body, or None if the request failed.
+        :param url: The URL that we want to grab data from.
+        :param headers: The headers dictionary that we want to set.
+        """
+        if headers is None: headers = {}
+        return await self.run(AsyncDiscordRequest.readData, url, dict(headers))
+
+    async def downloadFile(self, url, filename, buffer=0, headers=None):
+        """
+        Download the file to the correct location on our storage device.
+        :param url: The URL for the file that we're wanting to download.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        :param buffer: The buffer size in bytes that we want to use to download our file in chunks.
+        :param headers: The headers dictionary that we want to set.
+        """
+        if headers is None: headers = {}
+        request = DiscordRequest()
+        request.setHeaders(dict(headers))
+        return await self.run(request.downloadFile, url, filename, buffer)
+
+    @staticmethod
+    def readData(url, headers):
+        """
+        Send a blocking request and read the whole response body (so that the connection goes back into the pool) before handing it back.
+        :param url: The URL that we want to grab data from.
+        :param headers: The headers dictionary that we want to set.
+        """
+        request = DiscordRequest()
+        request.setHeaders(headers)
+        response = request.sendRequest(url)
+
+        # Return nothing to signify a failed request.
+        if response is None:
+            return None
+
+        return response.read()
@@ -0,0 +1,470 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+asyncio.gather: Used to run every configured channel at the same time.
+asyncio.sleep:  Used to back off before retrying a failed history page.
+"""
+from asyncio import gather, sleep
+
+"""
+json.loads: Used to convert a serialized string into a dictionary object.
+"""
+from json import loads
+
+"""
+module.AsyncRequest.AsyncDiscordRequest: The asyncio counterpart to the DiscordRequest class.
+module.DiscordScraper.DiscordScraper:    Used to access the Discord Scraper class functions.
+module.DiscordScraper.warn:              Used to report a failed window without halting the other channels.
+module.SearchPlanner.SearchPlanner:      Used to plan the snowflake windows of the search walk.
+module.Checkpoint.Checkpoint:            Used to step over the history pages that a previous run already finished.
+module.Metrics.metrics:                  Used to write the final snapshot of the metrics.
+module.Profiler.profiler:                Used to time the search stage of every channel in --profile mode.
+"""
+from .Checkpoint import Checkpoint
+from .AsyncRequest import AsyncDiscordRequest
+from .DiscordScraper import DiscordScraper, warn
+from .SearchPlanner import SearchPlanner
+from .Metrics import metrics
+from .Profiler import profiler
+
+async def getLastMessageId(request, scraper, guild, channel):
+    """
+    Use the official Discord API to retrieve the snowflake of the last publicly viewable message in a channel.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    """
+
+    # API function for retrieving channel messages (we don't care about the 100 message limit this time).
+    lastmessage = 'https://discord.com/api/{0}/channels/{1}/messages?limit=1'.format(scraper.apiversion, channel)
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        response = await request.requestData(lastmessage, scraper.headers)
+
+        # If we returned nothing then return nothing.
+        if response is None: return None
+
+        # Read the response data and convert it into a dictionary object.
+        data = loads(response)
+
+        # Return the snowflake of the post.
+        return int(data[0]['id'])
+
+    except Exception as ex:
+        warn(ex)
+
+async def grabNames(request, scraper, guild, channel):
+    """
+    Retrieve the guild and channel names and create the scrape folders without blocking the event loop.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    """
+
+    # Generate the guild name.
+    if scraper.guildname == None:
+        await request.run(scraper.grabGuildName, guild)
+
+    # Generate the channel name.
+    if scraper.channelname == None:
+        await request.run(scraper.grabChannelName, channel)
+
+    # Generate the scrape folders.
+    scraper.createFolders()
+
+async def searchWindow(request, scraper, channel, window, offset=0):
+    """
+    The asyncio counterpart of the searchWindow function, request a single page of search results for a snowflake window.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param window: The [oldest, newest] snowflakes of the window, both ends are included.
+    :param offset: The number of results to skip, this picks the page.
+    """
+
+    # Generate a valid URL to the undocumented API function for the search feature (min_id and max_id are exclusive).
+    search = 'https://discord.com/api/{0}/channels/{1}/messages/search?min_id={2}&max_id={3}&{4}'.format(scraper.apiversion, channel, window[0] - 1, window[1] + 1, scraper.query)
+
+    # Append the offset for every page after the first one.
+    if offset > 0:
+        search = '{0}&offset={1}'.format(search, offset)
+
+    with profiler.span('search', channel):
+
+        # Grab the API response for the search query URL.
+        response = await request.requestData(search, scraper.headers)
+
+        # If we returned nothing then return nothing.
+        if response is None:
+            return None
+
+        # Read the response data.
+        return loads(response.decode('iso-8859-1'))
+
+async def searchPage(request, scraper, channel, window, offset, retries=3):
+    """
+    The asyncio counterpart of the searchPage function, request a single page of search results and retry it with a growing pause if it fails.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param window: The [oldest, newest] snowflakes of the window, both ends are included.
+    :param offset: The number of results to skip, this picks the page.
+    :param retries: The number of times that we retry the page before giving up on it.
+    """
+
+    # Create a variable to store how long Discord asked us to wait before the next attempt.
+    wait = 0.0
+
+    for attempt in range(retries + 1):
+
+        # Back off for 1, 2, 4... seconds before every retry, or for as long as Discord asked if that's longer.
+        if attempt > 0:
+            await sleep(max(wait, 2 ** (attempt - 1)))
+            wait = 0.0
+
+        try:
+            # Grab the search results for the page.
+            data = await searchWindow(request, scraper, channel, window, offset)
+
+            # Wait for the search index if Discord is still building it for the channel (a 202 response with a retry_after value instead of results).
+            if data is not None and 'messages' not in data and 'retry_after' in data:
+                wait = float(data['retry_after'] or 0.0)
+                warn('The search index for {0} isn\'t ready yet.'.format(channel))
+                continue
+
+            # Return the page if it came back.
+            if data is not None:
+                return data
+
+        except Exception as ex:
+            warn('Search page at offset {0} failed: {1}'.format(offset, ex))
+
+    # Return nothing to signify a failed page.
+    return None
+
+async def startGuild(request, scraper, guild, channel, planner):
+    """
+    The asyncio counterpart of the startGuild function, scrape the next snowflake window that the search planner hands us.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param planner: The SearchPlanner object that keeps track of the search walk for this channel.
+    """
+
+    # Get the snowflakes for the next window.
+    window = planner.nextWindow()
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Grab the first page of search results for the window.
+        data = await searchPage(request, scraper, channel, window, 0)
+
+        # If we returned nothing then continue on to the previous window.
+        if data is None:
+            planner.skip(window)
+            return planner
+
+        # Get the number of posts.
+        posts = data['total_results']
+
+        # Let the planner split the window if it holds too many posts, we'll search the smaller window next time around.
+        if not planner.report(window, posts):
+            return planner
+
+        # Fetch every page after the first one at the same time, gather hands them back in order.
+        # Keep track of whether every page came back so that we only checkpoint complete windows.
+        complete = True
+
+        for data2 in await gather(*[searchPage(request, scraper, channel, window, SearchPlanner.pagesize * (page - 1)) for page in range(2, SearchPlanner.getPageCount(posts) + 1)]):
+
+            # Warn about the page if it failed even after retrying.
+            if data2 is None:
+                warn('Unable to fetch a search page for {0}/{1} between {2} and {3}!'.format(guild, channel, window[0], window[1]))
+                complete = False
+                continue
+
+            # Append the messages from the page into data.
+            data['messages'].extend(data2['messages'])
+
+        # Cache the JSON data if there's anything to cache (don't fill the cache directory with useless API response junk).
+        if posts > 0:
+            await request.run(scraper.downloadWindowJSON, data, window[0], window[1])
+
+        # Check the mimetypes of the embedded and attached files, and record the window as finished once they're downloaded so that we never search it again.
+        await checkMimetypes(request, scraper, data, (lambda: scraper.checkpoint.addRange(scraper.getRangeKey(channel), window[0], window[1])) if complete else None)
+
+    except Exception as ex:
+        warn('Failed to scrape {0}/{1} between {2} and {3}: {4}'.format(guild, channel, window[0], window[1], ex))
+
+        # Make sure that we move on from the window even if it failed.
+        if planner.nextWindow() == window:
+            planner.skip(window)
+
+    # Return the planner.
+    return planner
+
+async def historyPage(request, scraper, channel, before, limit=100, direction=None):
+    """
+    The asyncio counterpart of the historyPage function, retrieve a page of messages posted before (or after) a snowflake.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param before: The snowflake cursor, only messages older than this are returned.
+    :param limit: The number of messages to return, Discord allows up to 100.
+    :param direction: Set this to "after" to retrieve the messages posted right after the snowflake instead.
+    """
+    if direction is None: direction = 'before'
+
+    # Docs: https://discord.com/developers/docs/resources/channel#get-channel-messages
+    history = 'https://discord.com/api/{0}/channels/{1}/messages?{2}={3}&limit={4}'.format(scraper.apiversion, channel, direction, before, limit)
+
+    with profiler.span('search', channel):
+
+        # Grab the API response for the history URL.
+        response = await request.requestData(history, scraper.headers)
+
+        # If we returned nothing then return nothing.
+        if response is None:
+            return None
+
+        # Read the response data.
+        return loads(response.decode('iso-8859-1'))
+
+async def fetchHistoryPage(request, scraper, channel, cursor, direction=None, retries=3):
+    """
+    The asyncio counterpart of the fetchHistoryPage function, request a page of the channel history and retry it with a growing pause if it fails.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param cursor: The snowflake cursor of the page.
+    :param direction: Set this to "after" to retrieve the messages posted right after the snowflake instead.
+    :param retries: The number of times that we retry the page before giving up on it.
+    """
+
+    for attempt in range(retries + 1):
+
+        # Back off for 1, 2, 4... seconds before every retry.
+        if attempt > 0:
+            await sleep(2 ** (attempt - 1))
+
+        try:
+            # Grab the page of messages.
+            messages = await historyPage(request, scraper, channel, cursor, direction=direction)
+
+            # Return the page if it came back.
+            if messages is not None:
+                return messages
+
+        except Exception as ex:
+            warn('History page at {0} failed: {1}'.format(cursor, ex))
+
+    # Return nothing to signify a failed page.
+    return None
+
+async def startHistory(request, scraper, guild, channel, before):
+    """
+    The asyncio counterpart of the startHistory function, scrape a page of the channel history and return the cursor for the next page, None once we've reached the start of the channel, or False if the page failed even after retrying.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param before: The snowflake cursor, only messages older than this are scraped.
+    """
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Grab the page of messages.
+        messages = await fetchHistoryPage(request, scraper, channel, before)
+
+        # Let the caller know that the page failed, the pages below it can't be reached without it.
+        if messages is None:
+            return False
+
+        # We've reached the start of the channel once there are no more messages, so record everything down to its creation as finished.
+        if not messages:
+            await request.run(scraper.checkpoint.addRange, channel, int(channel), before - 1)
+            return None
+
+        # Wrap the messages up like a search response so that they go through the same cache and media pipeline.
+        data = DiscordScraper.wrapMessages(messages)
+
+        # Grab the snowflake bounds of the page, the messages come back newest first.
+        window = [int(messages[-1]['id']), int(messages[0]['id'])]
+
+        # Cache the JSON data.
+        await request.run(scraper.downloadWindowJSON, data, window[0], window[1])
+
+        # Check the mimetypes of the embedded and attached files, and record the page as finished once they're downloaded (a page that isn't full means that everything down to the creation of the channel is finished too).
+        await checkMimetypes(request, scraper, data, lambda: scraper.checkpoint.addRange(channel, window[0] if len(messages) == 100 else int(channel), before - 1))
+
+    except Exception as ex:
+        warn('Failed to scrape {0}/{1} before {2}: {3}'.format(guild, channel, before, ex))
+        return False
+
+    # Continue from the oldest message of the page, a page that isn't full means that we've reached the start of the channel.
+    return window[0] if len(messages) == 100 else None
+
+async def startDelta(request, scraper, guild, channel, after):
+    """
+    The asyncio counterpart of the startDelta function, scrape the messages posted right after a snowflake and return the cursor for the next page.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param after: The snowflake cursor, only messages newer than this are scraped.
+    """
+
+    # Update the HTTP request headers to set the referer to the current guild channel URL.
+    scraper.headers.update({'Referer': 'https://discord.com/channels/{0}/{1}'.format(guild, channel)})
+
+    try:
+        # Grab the page of messages posted right after the cursor.
+        messages = await fetchHistoryPage(request, scraper, channel, after, direction='after')
+
+        # We've caught up once there are no more messages.
+        if not messages:
+            return None
+
+        # Wrap the messages up like a search response so that they go through the same cache and media pipeline.
+        data = DiscordScraper.wrapMessages(messages)
+
+        # Grab the snowflake bounds of the page.
+        snowflakes = [int(message['id']) for message in messages]
+        window = [min(snowflakes), max(snowflakes)]
+
+        # Cache the JSON data.
+        await request.run(scraper.downloadWindowJSON, data, window[0], window[1])
+
+        # Check the mimetypes of the embedded and attached files, and record the page as finished once they're downloaded (this raises the high-water mark past the page).
+        await checkMimetypes(request, scraper, data, lambda: scraper.checkpoint.addRange(channel, after + 1, window[1]))
+
+    except Exception as ex:
+        warn('Failed to scrape {0}/{1} after {2}: {3}'.format(guild, channel, after, ex))
+        return None
+
+    # Continue from the newest message of the page, a page that isn't full means that we've caught up.
+    return window[1] if len(messages) == 100 else None
+
+async def checkMimetypes(request, scraper, data, callback=None):
+    """
+    The asyncio counterpart of DiscordScraper.checkMimetypes, hand every wanted file from the data over to the download workers.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param data: The response data from Discord's backend API that should contain the information we desire.
+    :param callback: A function that is called once every file from the data has finished downloading.
+    """
+
+    # Queue the files up from the thread pool since the download queue blocks this channel while it's full.
+    await request.run(scraper.checkMimetypes, data, callback)
+
+async def startChannel(request, scraper, guild, channel, history=False, incremental=False):
+    """
+    Scrape a channel from its last message back to the creation of the channel.
+    :param request: The AsyncDiscordRequest object that we send our requests through.
+    :param scraper: The DiscordScraper class reference that we will be using, this should be a clone that belongs to this channel alone.
+    :param guild: The ID for the guild that we're wanting to scrape from.
+    :param channel: The ID for the channel that we're wanting to scrape from.
+    :param history: A true or false (boolean) value that walks the channel with the messages endpoint instead of the search endpoint.
+    :param incremental: A true or false (boolean) value that only scrapes the messages posted since the last full run of the channel.
+    """
+
+    # Grab the high-water mark of the channel if we only want what's new, the checkpoint raises it once the finished ranges reach from the creation of the channel up to a snowflake.
+    highwater = await request.run(scraper.checkpoint.getHighWater, channel) if incremental else None
+
+    # Walk forward from the high-water mark 100 messages at a time and stop once we've caught up.
+    if highwater is not None:
+        await grabNames(request, scraper, guild, channel)
+        cursor = highwater
+
+        while cursor is not None:
+            cursor = await startDelta(request, scraper, guild, channel, cursor)
+
+        return None
+
+    # Retrieve the snowflake for the most recent post in the channel.
+    lastmessage = await getLastMessageId(request, scraper, guild, channel)
+
+    # Skip the channel if we can't see any posts in it.
+    if lastmessage is None:
+        warn('Unable to find the last message in {0}/{1}, skipping it!'.format(guild, channel))
+        return None
+
+    # Generate the guild name, channel name, and scrape folders.
+    await grabNames(request, scraper, guild, channel)
+
+    # Walk back through the channel history 100 messages at a time, starting right after the last message.
+    if history:
+        ranges = await request.run(scraper.checkpoint.getRanges, channel)
+        cursor = lastmessage + 1
+
+        while cursor is not None:
+
+            # Step over the pages that a previous run already finished.
+            cursor = Checkpoint.skipCompleted(ranges, cursor - 1) + 1
+
+            # Stop once we've stepped past the creation of the channel.
+            if cursor <= int(channel):
+                break
+
+            cursor = await startHistory(request, scraper, guild, channel, cursor)
+
+            # Stop the walk if a page failed even after retrying, the channel isn't recorded as finished so the next run picks the walk up from here.
+            if cursor is False:
+                warn('Stopped walking the history of {0}/{1}, a page failed even after retrying.'.format(guild, channel))
+                break
+
+    else:
+        # Plan the search walk from the last message back to the creation of the channel (the channel ID is its creation snowflake), stepping over the windows that a previous run already finished.
+        planner = SearchPlanner(int(channel), lastmessage, completed=await request.run(scraper.checkpoint.getRanges, scraper.getRangeKey(channel)))
+
+        # Walk through the windows until we reach the creation of the channel.
+        while not planner.finished():
+            planner = await startGuild(request, scraper, guild, channel, planner)
+
+async def startAll(scraper, concurrency=None, history=False, incremental=False):
+    """
+    Scrape every configured channel of every configured guild at the same time.
+    :param scraper: The DiscordScraper class reference that we will be using.
+    :param concurrency: The maximum number of requests and downloads in flight at the same time, defaults to the configuration file value.
+    :param history: A true or false (boolean) value that walks the channels with the messages endpoint instead of the search endpoint.
+    :param incremental: A true or false (boolean) value that only scrapes the messages posted since the last full run of each channel.
+    """
+
+    # Fall back to the configuration file value.
+    if concurrency is None:
+        concurrency = scraper.concurrency
+
+    # Create the shared request object.
+    request = AsyncDiscordRequest(concurrency)
+
+    try:
+        # Give every channel its own scraper so that their names, folders, and referers don't collide.
+        await gather(*[startChannel(request, scraper.clone(), guild, channel, history, incremental) for guild, channels in scraper.guilds.items() for channel in channels])
+
+        # Wait for the download workers to finish the files that are still queued up.
+        await request.run(scraper.downloads.join)
+
+    finally:
+        request.close()
+
+        # Stop the image compression worker processes.
+        if scraper.compressor is not None:
+            scraper.compressor.close()
+
+        # Write the final snapshot of the metrics.
+        if scraper.metricsfile is not None:
+            metrics.writeSnapshot(scraper.metricsfile)
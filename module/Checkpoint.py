@@ -0,0 +1,194 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+sqlite3.connect: Used to open the checkpoint database, every write is committed straight away so that a crash or CTRL+C never loses finished work.
+"""
+from sqlite3 import connect
+
+"""
+threading.Lock: Used to share a single database connection between the threads of the scraper.
+"""
+from threading import Lock
+
+class Checkpoint(object):
+    """
+    A persistent record of the snowflake ranges that have been fully fetched for each channel (a filtered search stores its ranges under the channel ID followed by its query, see DiscordScraper.getRangeKey), the high-water mark of each channel (the newest snowflake of the range that reaches back to its creation), and the media that has been fully downloaded.
+    """
+
+    def __init__(self, filename, wal=False):
+        """
+        :param filename: The full file path to the SQLite database that stores the checkpoints.
+        :param wal: A true or false (boolean) value that turns on write ahead logging, which lets the shard processes read while another one writes but needs shared memory, so it's only safe on a local disk (never on a network file system).
+        """
+
+        # Open the database, the connection is shared between threads so we guard it ourselves.
+        self.connection = connect(filename, timeout=60, check_same_thread=False)
+
+        # Create a lock to guard the connection.
+        self.lock = Lock()
+
+        with self.lock:
+            # Stay on the rollback journal unless we've been told that the database is on a local disk, setting it every time also switches a database back from write ahead logging.
+            self.connection.execute('PRAGMA journal_mode = {0}'.format('WAL' if wal else 'DELETE'))
+
+            # Create the table of fully fetched snowflake ranges, both ends of a range are included.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS ranges (channel TEXT NOT NULL, minsnow INTEGER NOT NULL, maxsnow INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS ranges_channel ON ranges (channel, maxsnow)')
+
+            # Create the table of high-water marks, the newest snowflake that each channel has been scraped up to.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS highwater (channel TEXT PRIMARY KEY, snowflake INTEGER NOT NULL)')
+
+            # Create the table of fully downloaded media.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS media (url TEXT PRIMARY KEY, filename TEXT NOT NULL)')
+
+            # Create the index of the blobs in the content store, a blob is looked up by the size and file name of an attachment before it is downloaded.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS blobs (size INTEGER NOT NULL, name TEXT NOT NULL, checksum TEXT NOT NULL, extension TEXT, PRIMARY KEY (size, name))')
+
+            # Add the file extension of the blobs to a database from before it was recorded, an image that was converted to another format is stored under a new extension.
+            if 'extension' not in [row[1] for row in self.connection.execute('PRAGMA table_info(blobs)').fetchall()]:
+                self.connection.execute('ALTER TABLE blobs ADD COLUMN extension TEXT')
+
+            self.connection.commit()
+
+    def getRanges(self, channel):
+        """
+        Return the fully fetched [oldest, newest] snowflake ranges for a channel, newest first.
+        :param channel: The ID for the channel.
+        """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT minsnow, maxsnow FROM ranges WHERE channel = ? ORDER BY maxsnow DESC', (str(channel), )).fetchall()
+
+        return [list(row) for row in rows]
+
+    def addRange(self, channel, minsnow, maxsnow):
+        """
+        Record a snowflake range as fully fetched, merging it with the ranges that it overlaps or touches.
+        :param channel: The ID for the channel.
+        :param minsnow: The oldest snowflake of the range.
+        :param maxsnow: The newest snowflake of the range.
+        """
+
+        with self.lock:
+            # Find the ranges that overlap or touch the new one.
+            rows = self.connection.execute('SELECT minsnow, maxsnow FROM ranges WHERE channel = ? AND maxsnow >= ? AND minsnow <= ?', (str(channel), minsnow - 1, maxsnow + 1)).fetchall()
+
+            # Grow the new range to cover all of them.
+            for row in rows:
+                minsnow = min(minsnow, row[0])
+                maxsnow = max(maxsnow, row[1])
+
+            # Replace them with the merged range.
+            self.connection.execute('DELETE FROM ranges WHERE channel = ? AND maxsnow >= ? AND minsnow <= ?', (str(channel), minsnow, maxsnow))
+            self.connection.execute('INSERT INTO ranges (channel, minsnow, maxsnow) VALUES (?, ?, ?)', (str(channel), minsnow, maxsnow))
+
+            # Raise the high-water mark once the range reaches back to the creation of the channel (the channel ID is its creation snowflake), everything up to its newest snowflake has been scraped then, the ranges of a filtered search never raise it.
+            if str(channel).isdigit() and minsnow <= int(channel):
+                self.connection.execute('INSERT INTO highwater (channel, snowflake) VALUES (?, ?) ON CONFLICT (channel) DO UPDATE SET snowflake = MAX(snowflake, excluded.snowflake)', (str(channel), maxsnow))
+
+            self.connection.commit()
+
+    def isCovered(self, channel, minsnow, maxsnow):
+        """
+        Determine if a single fully fetched range covers a snowflake range, the ranges are merged so one is enough.
+        :param channel: The ID for the channel.
+        :param minsnow: The oldest snowflake of the range.
+        :param maxsnow: The newest snowflake of the range.
+        """
+
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM ranges WHERE channel = ? AND minsnow <= ? AND maxsnow >= ?', (str(channel), minsnow, maxsnow)).fetchone() is not None
+
+    def getHighWater(self, channel):
+        """
+        Return the newest snowflake that the channel has been scraped up to, or None if it has never been scraped all the way.
+        :param channel: The ID for the channel.
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT snowflake FROM highwater WHERE channel = ?', (str(channel), )).fetchone()
+
+        return None if row is None else row[0]
+
+    def setHighWater(self, channel, snowflake):
+        """
+        Raise the high-water mark of a channel, it never moves backwards.
+        :param channel: The ID for the channel.
+        :param snowflake: The newest snowflake that the channel has been scraped up to.
+        """
+
+        with self.lock:
+            self.connection.execute('INSERT INTO highwater (channel, snowflake) VALUES (?, ?) ON CONFLICT (channel) DO UPDATE SET snowflake = MAX(snowflake, excluded.snowflake)', (str(channel), snowflake))
+            self.connection.commit()
+
+    def hasMedia(self, url):
+        """
+        Determine if the media at the URL has already been fully downloaded.
+        :param url: The proxied URL for the media.
+        """
+
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM media WHERE url = ?', (url, )).fetchone() is not None
+
+    def addMedia(self, url, filename):
+        """
+        Record the media at the URL as fully downloaded.
+        :param url: The proxied URL for the media.
+        :param filename: The full file path that the media was downloaded to.
+        """
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO media (url, filename) VALUES (?, ?)', (url, filename))
+            self.connection.commit()
+
+    def findBlob(self, size, name):
+        """
+        Return the [checksum, extension] of the stored blob for an attachment with the same size and file name, or None if we haven't stored one (the extension is None if it wasn't recorded).
+        :param size: The size of the attachment in bytes.
+        :param name: The file name of the attachment.
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT checksum, extension FROM blobs WHERE size = ? AND name = ?', (size, name)).fetchone()
+
+        return None if row is None else list(row)
+
+    def addBlob(self, size, name, checksum, extension=None):
+        """
+        Record the blob that holds an attachment with this size and file name.
+        :param size: The size of the attachment in bytes.
+        :param name: The file name of the attachment.
+        :param checksum: The SHA-256 checksum of the blob.
+        :param extension: The file extension that the blob was stored under (such as ".webp"), a repost is linked under the same one.
+        """
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO blobs (size, name, checksum, extension) VALUES (?, ?, ?, ?)', (size, name, checksum, extension))
+            self.connection.commit()
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def skipCompleted(ranges, snowflake):
+        """
+        Return the newest snowflake at or below the given one that isn't covered by a fully fetched range.
+        :param ranges: The fully fetched ranges for the channel, newest first.
+        :param snowflake: The snowflake that we want to continue from.
+        """
+
+        # Step below every range that covers the snowflake, the ranges are merged so this only ever steps once per range.
+        for minsnow, maxsnow in ranges:
+            if minsnow <= snowflake <= maxsnow:
+                snowflake = minsnow - 1
+
+        return snowflake
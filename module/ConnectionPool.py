@@ -0,0 +1,177 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+http.client.HTTPConnection:  Used to connect to a local mock server when the host is overridden.
+http.client.HTTPSConnection: Used to grab data from sites that use TLS or SSL encryption.
+"""
+from http.client import HTTPConnection, HTTPSConnection
+
+"""
+threading.Lock: Used to keep the pool consistent when more than one thread is borrowing connections from it.
+"""
+from threading import Lock
+
+from globalVars import GlobalVars # to fix proxy problem
+
+class PendingResponse(object):
+    """
+    A placeholder response that marks a pooled connection as busy between sending a request and receiving its response.
+    """
+
+    def isclosed(self):
+        """
+        A connection with a request in flight is never free to be borrowed.
+        """
+        return False
+
+class ConnectionPool(object):
+    """
+    A process-wide, per-host pool of keep-alive HTTPS connections (and proxy tunnels) that is shared by every DiscordRequest.
+    """
+
+    def __init__(self, maxsize=8, timeout=60):
+        """
+        :param maxsize: The maximum number of connections that we keep alive for each host.
+        :param timeout: The socket timeout in seconds for each connection, this stops a dead proxy tunnel from hanging the script forever.
+        """
+
+        # Create a dictionary that maps a host name to the list of [connection, last response] pairs for that host.
+        self.connections = {}
+
+        # Store the pool size and the socket timeout.
+        self.maxsize = maxsize
+        self.timeout = timeout
+
+        # Create a lock to guard the connections dictionary.
+        self.lock = Lock()
+
+        # Create a variable to store the (host, port) pair that every connection is sent to instead, this is used to benchmark against a local mock server.
+        self.override = None
+
+    def setOverride(self, host, port):
+        """
+        Send every connection to a plain HTTP server instead of the real domains, whatever the URL says.
+        :param host: The host name of the server, or None to connect to the real domains again.
+        :param port: The port of the server.
+        """
+
+        # Throw away the connections to the old hosts.
+        self.closeAll()
+
+        self.override = None if host is None else (host, port)
+
+    def createConnection(self, domain):
+        """
+        Create a brand new HTTPS connection to the domain, tunneling through the local proxy if we're not connecting directly.
+        :param domain: The domain name that we're wanting to connect to.
+        """
+
+        # Connect to the overridden host if there is one.
+        if self.override is not None:
+            return HTTPConnection(self.override[0], self.override[1], timeout=self.timeout)
+
+        # Connect straight to the domain.
+        if GlobalVars.args.direct:
+            return HTTPSConnection(domain, 443, timeout=self.timeout)
+
+        # Otherwise create a CONNECT tunnel through the local proxy, the tunnel stays open for as long as the connection does.
+        connection = HTTPSConnection('localhost', GlobalVars.args.port, timeout=self.timeout)
+        connection.set_tunnel(domain)
+        return connection
+
+    def getConnection(self, domain, fresh=False):
+        """
+        Borrow an idle connection to the domain from the pool, or create a new one if every pooled connection is busy.
+        :param domain: The domain name that we're wanting to connect to.
+        :param fresh: A true or false (boolean) value that skips the idle connections and always creates a new one.
+        """
+
+        with self.lock:
+
+            # Grab the list of pooled connections for this domain.
+            entries = self.connections.setdefault(domain, [])
+
+            # Find a connection whose previous response has been fully read.
+            for entry in entries:
+                if not fresh and (entry[1] is None or entry[1].isclosed()):
+
+                    # Mark the connection as busy and hand it out.
+                    entry[1] = PendingResponse()
+                    return entry[0]
+
+            # Create a new connection since all of the pooled connections are busy.
+            connection = self.createConnection(domain)
+
+            # Keep the new connection alive in the pool if there's room for it.
+            if len(entries) < self.maxsize:
+                entries.append([connection, PendingResponse()])
+
+            return connection
+
+    def setResponse(self, domain, connection, response):
+        """
+        Tie a response to its connection, the connection goes back into the pool once the response has been read to the end.
+        :param domain: The domain name that the connection belongs to.
+        :param connection: The connection that the response was read from.
+        :param response: The response object, or None if the request failed and the connection can be borrowed straight away.
+        """
+
+        with self.lock:
+            for entry in self.connections.get(domain, []):
+                if entry[0] is connection:
+                    entry[1] = response
+                    return None
+
+    def discardConnection(self, domain, connection):
+        """
+        Close a broken connection and remove it from the pool.
+        :param domain: The domain name that the connection belongs to.
+        :param connection: The connection that we want to throw away.
+        """
+
+        # Close the connection (and its proxy tunnel).
+        connection.close()
+
+        with self.lock:
+            entries = self.connections.get(domain, [])
+            self.connections[domain] = [entry for entry in entries if entry[0] is not connection]
+
+    def discardResponse(self, response):
+        """
+        Throw away the connection behind a response that we don't want to read to the end, reusing it would mix the leftover bytes into the next response.
+        :param response: The response object that we're abandoning.
+        """
+
+        # Close the response itself.
+        response.close()
+
+        with self.lock:
+            for entries in self.connections.values():
+                for entry in entries:
+                    if entry[1] is response:
+
+                        # Remove the connection from the pool and close its socket.
+                        entries.remove(entry)
+                        entry[0].close()
+                        return None
+
+    def closeAll(self):
+        """
+        Close every pooled connection.
+        """
+
+        with self.lock:
+            for entries in self.connections.values():
+                for entry in entries:
+                    entry[0].close()
+
+            self.connections = {}
+
+"""
+The process-wide connection pool that is shared by every DiscordRequest object.
+"""
+pool = ConnectionPool()
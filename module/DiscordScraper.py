@@ -21,6 +21,11 @@ mimetypes.MimeTypes: Used to access the MimeTypes class and its functions for qu
 """
 from mimetypes import MimeTypes
 
+"""
+functools.lru_cache: Used to remember the mimetypes of the file extensions that aren't in the category table.
+"""
+from functools import lru_cache
+
 """
 os.makedirs: Used to create a folder with subfolders.
 os.getcwd:   Used to get the current working directory for the commandline, hopefully this is the same directory as the discord.py file.
@@ -42,15 +47,81 @@ json.dumps: Used to convert a dictionary object into a serialized string.
 """
 from json import loads, dump
 
+"""
+threading.Lock: Used to load each channel manifest only once when several channels are scraped at the same time.
+"""
+from threading import Lock
+
+"""
+concurrent.futures.Future: Used to tell the download queue when a re-encoded image has been recorded.
+"""
+from concurrent.futures import Future
+
+"""
+copy.copy: Used to create a shallow copy of the scraper for each channel that we scrape concurrently.
+"""
+from copy import copy
+
 """
 random.choice: Used to simplify the process of "randomly" choosing a value from an array.
 """
 from random import choice
 
 """
-time.mktime: Used to get the current timestamp of the system, this is here to uphold Python 2 compatibility in the script.
+time.mktime:        Used to get the current timestamp of the system, this is here to uphold Python 2 compatibility in the script.
+time.perf_counter:  Used to time the image compression stage for the profiler, it finishes on another process.
+"""
+from time import mktime, perf_counter
+
+"""
+module.Checkpoint.Checkpoint: Used to record the finished snowflake ranges and downloads in a persistent database.
+"""
+from .Checkpoint import Checkpoint
+
+"""
+module.MediaStore.MediaStore: Used to store every downloaded file once under its checksum when generateFileChecksums is enabled.
+"""
+from .MediaStore import MediaStore
+
+"""
+module.Manifest.Manifest: Used to remember which files each channel folder already holds without a stat call for every file.
+"""
+from .Manifest import Manifest
+
+"""
+module.MessageLog.MessageLog: Used to store the messages of each channel in a compressed append-only log when compressTextData is enabled.
+"""
+from .MessageLog import MessageLog
+
+"""
+module.MessageDatabase.MessageDatabase: Used to store the scraped messages in a searchable SQLite database when storeMessageDatabase is enabled.
+"""
+from .MessageDatabase import MessageDatabase
+
+"""
+module.FileSignatures.getMimetypeCategory: Used to check the real type of a file against the types that we want to download.
+"""
+from .FileSignatures import getMimetypeCategory
+
+"""
+module.ImageCompressor.ImageCompressor: Used to re-encode the downloaded images on worker processes when compressImageData is enabled.
 """
-from time import mktime
+from .ImageCompressor import ImageCompressor
+
+"""
+module.Metrics.metrics: The process-wide metrics registry, the download queue depths are read into it and it is served or snapshotted if we've configured it.
+"""
+from .Metrics import metrics
+
+"""
+module.Profiler.profiler: The process-wide profiler that times the pipeline stages of every channel in --profile mode.
+"""
+from .Profiler import profiler
+
+"""
+module.DownloadQueue.DownloadQueue: Used to download files on worker threads while the search walk carries on.
+"""
+from .DownloadQueue import DownloadQueue
 
 """
 This conditional statement will be used to import the class from the correct file based on the version of the Python interpreter used.
@@ -70,6 +141,10 @@ Create a function and tie SIGINT to said function.
 """
 def sigintEvent(sig, frame):
     print('You pressed CTRL + C')
+
+    # Keep the profile of the run that we're stopping.
+    profiler.writeReport(getcwd())
+
     exit(0)
 
 signal(SIGINT, sigintEvent)
@@ -95,6 +170,31 @@ def warn(message):
     # Append our message with a newline character.
     stderr.write('[WARN] {0}\n'.format(message))
 
+"""
+The mimetype database, it reads the system mimetype files so it is only built once when the script starts.
+"""
+mimedatabase = MimeTypes()
+
+"""
+A table that maps every file extension that the mimetype database knows about to its category (image, video, or file).
+"""
+extensioncategories = dict(
+    (extension, mimetype.split('/')[0] if mimetype.split('/')[0] in ['image', 'video'] else 'file')
+    for types in reversed(mimedatabase.types_map) for extension, mimetype in types.items()
+)
+
+# Fill in the common Discord upload formats that the system mimetype files tend to leave out.
+for extension, category in [('.mkv', 'video'), ('.heic', 'image'), ('.heif', 'image'), ('.avif', 'image'), ('.jfif', 'image')]:
+    extensioncategories.setdefault(extension, category)
+
+@lru_cache(maxsize=4096)
+def guessExtensionMimetype(extension):
+    """
+    Return the guessed mimetype for a file extension that isn't in the category table, or None if it can't be guessed.
+    :param extension: The lowercase file extension, including the dot.
+    """
+    return mimedatabase.guess_type('file{0}'.format(extension))[0]
+
 class DiscordConfig(object):
     """
     This class will only serve the purpose of converting a dictionary object into a class object.
@@ -145,6 +245,22 @@ class DiscordScraper(object):
         self.buffersize = config.buffer   # The file download buffer that will be stored in memory before offloading to the hard drive.
         self.options    = config.options  # The experimental options portion of the configuration file that will give extra control over how the script functions.
         self.types      = config.types    # The file types that we are wanting to scrape and download to our storage device.
+        self.concurrency = getattr(config, 'concurrency', 8)  # The maximum number of requests that the asyncio engine keeps in flight at the same time.
+
+        # The number of chunks of a single file that are downloaded at the same time.
+        self.downloadsegments = getattr(config, 'downloadsegments', 4)
+
+        # Create the download queue that the search walk hands its files over to, it is shared with every clone of this scraper.
+        self.downloads = DownloadQueue(getattr(config, 'downloadworkers', 4), getattr(config, 'downloadqueue', 256))
+
+        # Report the depth of the download queue and the number of busy workers in the metrics.
+        metrics.addGauge('download_queue_depth', 'Downloads waiting in the queue for a worker.', self.downloads.queue.qsize)
+        metrics.addGauge('download_workers_busy', 'Download workers that are busy with a file.', lambda: self.downloads.active)
+
+        # Store the settings for serving the metrics on a local port and writing JSON snapshots of them, see startMetrics.
+        self.metricsport = getattr(config, 'metricsport', 0)
+        self.metricsfile = path.join(getcwd(), config.metricsfile) if getattr(config, 'metricsfile', '') else None
+        self.metricsinterval = getattr(config, 'metricsinterval', 15)
 
         # Make the options available for quick and easy access.
         self.validateFileHeaders = config.options['validateFileHeaders']      # The option that will not only check the MIME type of a file but go one step further and check the magic number (header) of the file.
@@ -153,11 +269,47 @@ class DiscordScraper(object):
         self.compressImageData = config.options['compressImageData']          # The option that will enable image file compression to save on storage space when downloading data, this will likely be a generic algorithm.
         self.compressTextData = config.options['compressTextData']            # The option that will enable textual data compression to save on storage space when downloading data, this will most likely be GZIP compression.
         self.gatherJSONData = config.options['gatherJSONData']                # The option that will determine whether or not the script should cache the response text in JSON formatting.
+        self.storeMessageDatabase = config.options.get('storeMessageDatabase', False)  # The option that will store the messages in an SQLite database with a full-text index on their content.
         
         # Use Python ternary operators to set the class variables for direct messages and guilds that we should scrape.
         # self.directs = config.directs if len(config.directs) > 0 else {}
         self.guilds  = config.guilds  if len(config.guilds ) > 0 else {}
 
+        # Store the setting that turns on write ahead logging for the SQLite databases, this is only safe when the working directory is on a local disk.
+        self.sqlitewal = getattr(config, 'sqlitewal', False)
+
+        # Open the checkpoint database that records the finished snowflake ranges and downloads so that an interrupted run can pick up where it stopped.
+        self.checkpoint = Checkpoint(path.join(getcwd(), 'checkpoint.db'), self.sqlitewal)
+
+        # Create the content store that keeps a single copy of the files that get reposted across channels.
+        self.store = MediaStore(path.join(getcwd(), 'blobs'), self.checkpoint)
+
+        # Create a dictionary to store the manifest of each channel folder, it is shared with every clone of this scraper (the lock guards the message logs below as well).
+        self.manifests = {}
+        self.manifestlock = Lock()
+
+        # Create a dictionary to store the message log of each channel, it is shared with every clone of this scraper.
+        self.messagelogs = {}
+
+        # Create the image compressor if we've configured the script to compress images, this needs Pillow.
+        self.compressor = None
+
+        if self.compressImageData:
+            if ImageCompressor.available():
+                # Images are only optimized losslessly unless we've opted into a lossy quality setting or a conversion to WebP or AVIF.
+                imageformat = getattr(config, 'imageformat', '') or None
+
+                if imageformat is not None and not ImageCompressor.supports(imageformat):
+                    warn('imageformat {0} is not supported by this Pillow install, images will keep their own formats.'.format(imageformat))
+                    imageformat = None
+
+                self.compressor = ImageCompressor(getattr(config, 'compressworkers', None), getattr(config, 'imagequality', None), imageformat)
+            else:
+                warn('compressImageData needs Pillow (pip install Pillow), images will be stored as they are.')
+
+        # Open the message database if we've configured the script to store the messages in one.
+        self.messagedatabase = MessageDatabase(path.join(getcwd(), 'messages.db'), self.sqlitewal) if self.storeMessageDatabase else None
+
         # Create a blank guild name, channel name, and folder location class variable.
         self.guildname = None
         self.channelname = None
@@ -178,6 +330,45 @@ class DiscordScraper(object):
             nsfw   = config.query['nsfw'  ]
         )
 
+    def startMetrics(self, shard=None):
+        """
+        Serve the metrics in the Prometheus text format on a local port, and write a JSON snapshot of them every so often, if we've configured the script to.
+        :param shard: The number of the shard process that this scraper runs in, each shard serves on the port after the previous one and writes a snapshot file of its own.
+        """
+
+        # Give every shard a port and a snapshot file of its own.
+        if shard is not None:
+            if self.metricsport:
+                self.metricsport += shard + 1
+
+            if self.metricsfile is not None:
+                self.metricsfile = '{0}.shard{1}{2}'.format(path.splitext(self.metricsfile)[0], shard, path.splitext(self.metricsfile)[1])
+
+        if self.metricsport:
+            metrics.serve(self.metricsport)
+
+        if self.metricsfile is not None:
+            metrics.startSnapshots(self.metricsfile, self.metricsinterval)
+
+    def clone(self):
+        """
+        Create a copy of this scraper with its own request headers and a blank guild name, channel name, and folder location so that several channels can be scraped at the same time.
+        """
+
+        # Copy the configuration over from this scraper.
+        scraper = copy(self)
+
+        # Give the copy its own headers so that setting the referer for one channel doesn't leak into another.
+        scraper.headers = dict(self.headers)
+
+        # Clear out the channel specific class variables.
+        scraper.guildname = None
+        scraper.channelname = None
+        scraper.location = None
+
+        # Return the new scraper.
+        return scraper
+
     def grabGuildName(self, id, dm=None):
         """
         Send a request to retrieve the guild name by its ID.
@@ -313,6 +504,33 @@ class DiscordScraper(object):
         :param month: The month when the data was scraped.
         :param year: The year when the data was scraped.
         """
+
+        # Cache the data under the date.
+        with profiler.span('cache', self.channelname.split('_')[0]):
+            self.writeCache(data, '{0}_{1}_{2}'.format(year, month, day))
+
+    def downloadWindowJSON(self, data, minsnow, maxsnow):
+        """
+        Cache the JSON data for a snowflake window of the search walk.
+        :param data: The response data from Discord's backend API that should contain the information we desire.
+        :param minsnow: The oldest snowflake of the window.
+        :param maxsnow: The newest snowflake of the window.
+        """
+
+        # Cache the data under the snowflake bounds.
+        with profiler.span('cache', self.channelname.split('_')[0]):
+            self.writeCache(data, '{0}_{1}'.format(minsnow, maxsnow))
+
+    def writeCache(self, data, name):
+        """
+        Write the JSON data to a cache file in the cache directory of the current channel, or append its messages to the message log of the channel if we're compressing textual data.
+        :param data: The response data from Discord's backend API that should contain the information we desire.
+        :param name: The name of the cache file without the extension.
+        """
+
+        # Store the messages in the message database, the guild name starts with the guild ID.
+        if self.messagedatabase is not None:
+            self.messagedatabase.add([message for messages in data['messages'] for message in messages], int(self.guildname.split('_')[0]) if self.guildname.split('_')[0].isdigit() else None)
         
         # Determine if we have configured the script to cache JSON data to begin with.
         if self.gatherJSONData:
@@ -320,12 +538,17 @@ class DiscordScraper(object):
             # Create a cache directory.
             cachedir = path.join(getcwd(), 'cached', self.guildname, self.channelname)
 
+            # Append the messages to the compressed log instead of writing a JSON file, the log can be exported to JSON files later on.
+            if self.compressTextData:
+                self.getMessageLog(cachedir).append([message for messages in data['messages'] for message in messages])
+                return None
+
             # Check if it already exists, if not then create it.
             if not path.exists(cachedir):
                 makedirs(cachedir)
 
             # Generate the direct file name for the cachefile.
-            cachefile = path.join(cachedir, '{0}_{1}_{2}.cache.json'.format(year, month, day))
+            cachefile = path.join(cachedir, '{0}.cache.json'.format(name))
 
             # Determine if the cachefile already exists, if so then skip it (TODO this might cause issues for incomplete runs, so this needs to be figured out in due time).
             if path.isfile(cachefile):
@@ -337,12 +560,14 @@ class DiscordScraper(object):
                 # Write the JSON data directly to the file.
                 dump(data, cachefilestream, indent=4)
     
-    def startDownloading(self, url, location):
+    def startDownloading(self, url, location, media=None):
         """
-        Call the Requests.download function to begin downloading our files.
+        Call the Requests.download function to begin downloading our files, returning True once the file is on the disk or was skipped on purpose (or a Future that resolves to that while the image is re-encoded).
         :param url: The direct URL (proxied URL to protect from requesting any malicious sites that might be watching out for the request header that stores our authorization token) for our content.
         :param location: The folder that we will be downloading the content into.
+        :param media: The attachment or embed dictionary that the URL came from.
         """
+        if media is None: media = {}
         
         # Split the url into parts.
         urlparts = url.split('/')
@@ -357,88 +582,250 @@ class DiscordScraper(object):
         # Join the file name with the location.
         filename = path.join(location, filename)
 
-        # Skip this function if the file already exists.
-        if path.isfile(filename):
-            return None
+        # Grab the manifest for the folder, attachments are known by their ID and embeds by their file name.
+        manifest = self.getManifest(location)
+        key = str(media['id']) if 'id' in media else path.basename(filename)
+
+        # Skip this function if the folder already holds the file.
+        if manifest.has(key):
+            return True
+
+        # Skip the files that turned out to be of a type we don't want, unless we've been told to take that type (or stopped checking file headers) since.
+        rejected = manifest.getRejected(key)
+
+        if rejected is not None and self.validateFileHeaders and not self.acceptMimetype(rejected):
+            return True
+
+        # Skip this function if a previous run already finished downloading the file.
+        if self.checkpoint.hasMedia(url):
+            manifest.add(key)
+            return True
         
+        # Grab the size and file name of the attachment, embeds don't come with a size so they can't be matched before they're downloaded.
+        size = media.get('size')
+        name = media.get('filename')
+
+        # Link to the blob of a known repost instead of downloading it again.
+        if self.generateFileChecksums and size is not None and name is not None:
+            checksum, extension = self.checkpoint.findBlob(size, name) or [None, None]
+
+            # Name the link after the blob, an image that was converted to another format is stored under the extension of that format.
+            linkname = '{0}{1}'.format(path.splitext(filename)[0], extension) if extension else filename
+
+            if checksum is not None and self.store.linkBlob(checksum, linkname):
+                self.store.writeChecksum(checksum, linkname)
+                self.checkpoint.addMedia(url, linkname)
+                manifest.add(key)
+                return True
+
         # Create a request.
         request = DiscordRequest()
 
         # Set the request headers.
         request.setHeaders(self.headers)
 
-        # Download the file directly.
-        request.downloadFile(url, filename, self.buffersize)
+        # Grab the channel ID from the folder name for the profiler.
+        channel = path.basename(location).split('_')[0]
+
+        # Download the file directly, hashing it on the way in if we're deduplicating or recompressing and checking its first bytes if we're validating file headers.
+        with profiler.span('download', channel):
+            finished = request.downloadFile(url, filename, self.buffersize, self.downloadsegments, self.generateFileChecksums or self.compressor is not None, self.acceptMimetype if self.validateFileHeaders else None)
+
+        if not finished:
+
+            # Remember the files that turned out to be of a type we don't want so that we don't try them again while we still don't want that type.
+            if request.rejected:
+                warn('Skipped {0}, it is really {1}.'.format(url, request.mimetype))
+                manifest.add(key, request.mimetype, rejected=True)
+
+            return request.rejected
+
+        # Re-encode images on the worker processes without holding up the download worker, the file is recorded once the copy is done and the download queue counts it as finished then.
+        if self.compressor is not None and (getMimetypeCategory(request.mimetype) if request.mimetype else DiscordScraper.getFileCategory(name or filename, media.get('content_type'))) == 'image':
+            started = perf_counter()
+            future = self.compressor.compress(filename)
+
+            # Hand the download queue a future of its own that resolves once the file has been recorded, to whether that worked.
+            recorded = Future()
+            future.add_done_callback(lambda future: recorded.set_result(self.recordDownload(url, filename, manifest, key, request, size, name, future, channel, started)))
+            return recorded
+
+        return self.recordDownload(url, filename, manifest, key, request, size, name)
+
+    def recordDownload(self, url, filename, manifest, key, request, size=None, name=None, future=None, channel=None, started=None):
+        """
+        Move a finished download into the content store and record it in the checkpoint database and the manifest of its folder, returning True if that worked.
+        :param url: The proxied URL that the file was downloaded from.
+        :param filename: The full file path that the file was downloaded to.
+        :param manifest: The manifest of the folder that the file was downloaded to.
+        :param key: The manifest key of the file.
+        :param request: The DiscordRequest object that downloaded the file, it holds the sniffed mimetype and the checksum of the download.
+        :param size: The size of the attachment in bytes.
+        :param name: The file name of the attachment.
+        :param future: The future of the image compression if the file was handed over to the worker processes.
+        :param channel: The ID for the channel, for the profiler.
+        :param started: The perf_counter value from when the image was handed over, for the profiler.
+        """
+
+        # Grab the checksum of what is on the disk, this is the checksum of the download unless the image was re-encoded.
+        checksum = request.checksum
+
+        try:
+            if future is not None:
+                if profiler.enabled:
+                    profiler.record(channel, 'compress', perf_counter() - started)
+
+                try:
+                    # A converted image has a new extension, and a re-encoded one a new checksum.
+                    filename, saved, compressed = future.result()
+                    checksum = compressed or checksum
+
+                except Exception as ex:
+                    warn('Unable to compress {0}: {1}'.format(filename, ex))
+
+            # Move the file into the content store under the checksum of its contents and list that checksum.
+            if self.generateFileChecksums:
+                self.store.storeFile(checksum, filename, size, name)
+                self.store.writeChecksum(checksum, filename)
+
+            # Record the file once it's finished, along with its real type if we sniffed it and the checksum of the original download.
+            self.checkpoint.addMedia(url, filename)
+            manifest.add(key, request.mimetype, request.checksum)
+
+        except Exception as ex:
+            warn('Unable to record {0}: {1}'.format(filename, ex))
+            return False
+
+        return True
+
+    def getRangeKey(self, channel, history=False):
+        """
+        Return the key that the checkpoint database stores the fetched ranges of a channel under, a search that leaves messages out (a "has" filter, or no NSFW results) only covers what it matched so its ranges are kept apart from those of the full history.
+        :param channel: The ID for the channel.
+        :param history: A true or false (boolean) value that determines if the channel is walked with the messages endpoint, the query filters don't apply to it.
+        """
+
+        # Grab the query parameters of the search.
+        parameters = self.query.split('&') if self.query else []
+
+        # Store the ranges of the full history under the channel ID alone.
+        if history or (not any(parameter.startswith('has=') for parameter in parameters) and 'include_nsfw=true' in parameters):
+            return str(channel)
+
+        return '{0}?{1}'.format(channel, self.query)
+
+    def acceptMimetype(self, mimetype):
+        """
+        Determine if a file whose first bytes were sniffed is of a type that we want to download, files that we don't recognize are let through since their extension already passed.
+        :param mimetype: The mimetype that was sniffed from the file, or None if it wasn't recognized.
+        """
+
+        # Let the files that we don't recognize through.
+        if mimetype is None:
+            return True
+
+        return self.types[DiscordScraper.categorytypes[getMimetypeCategory(mimetype)]]
+
+    def getMessageLog(self, cachedir):
+        """
+        Return the message log for a channel cache directory, loading it the first time that the channel is used.
+        :param cachedir: The cache directory of the channel.
+        """
+
+        with self.manifestlock:
+            if cachedir not in self.messagelogs:
+                self.messagelogs[cachedir] = MessageLog(cachedir)
+
+            return self.messagelogs[cachedir]
+
+    def forgetChannels(self):
+        """
+        Drop the manifests and message logs that we've loaded so that they're read from the disk again, for when other processes may have written to them since (the work queue hands the units of a channel to one worker after another).
+        """
+
+        with self.manifestlock:
+            self.manifests.clear()
+            self.messagelogs.clear()
 
-    def checkMimetypes(self, data):
+    def getManifest(self, location):
+        """
+        Return the manifest for a channel folder, loading it the first time that the folder is used.
+        :param location: The channel folder that we're downloading into.
+        """
+
+        with self.manifestlock:
+            if location not in self.manifests:
+                self.manifests[location] = Manifest(location)
+
+            return self.manifests[location]
+
+    def checkMimetypes(self, data, callback=None):
         """
         Avoid downloading any files that are of the types we do not want to download in accordance with the configuration file settings.
         :param data: The response data from Discord's backend API that should contain the information we desire.
+        :param callback: A function that is called once every file from the data has finished downloading.
         """
 
         try:
 
-            # Determine if there are any results from our scrape.
-            if data['total_results'] > 0:
+            # Grab the channel ID for the profiler.
+            channel = self.channelname.split('_')[0]
+
+            # Pick out the files that we're wanting to download.
+            with profiler.span('filter', channel):
+                tasks = [(self.startDownloading, (url, self.location, media), (url, self.location)) for url, media in self.getDownloadUrls(data)]
+
+            # Hand them over to the download workers, this only blocks while the download queue is full.
+            with profiler.span('enqueue', channel):
+                self.downloads.put(tasks, callback)
+
+        except Exception as ex:
+            warn('Unable to queue up the downloads for {0}, they will be fetched again on the next run: {1}'.format(self.channelname, ex))
+
+    def getDownloadUrls(self, data):
+        """
+        Return the proxied URLs for the attached and embedded files that are of the types we want to download in accordance with the configuration file settings, each paired with the attachment or embed dictionary that it came from.
+        :param data: The response data from Discord's backend API that should contain the information we desire.
+        """
+
+        # Create an array to store the [URL, media] pairs that we want to download.
+        urls = []
+
+        # Determine if there are any results from our scrape.
+        if data['total_results'] > 0:
+
+            # Iterate through all messages one-by-one.
+            for messages in data['messages']:
 
-                # Iterate through all messages one-by-one.
-                for messages in data['messages']:
+                # Iterate through each message one-by-one.
+                for message in messages:
+                    
+                    # Iterate through all of the attachments to check them one-by-one.
+                    for attachment in message['attachments']:
 
-                    # Iterate through each message one-by-one.
-                    for message in messages:
+                        # Get the proxied URL for our content.
+                        proxied = attachment['proxy_url']
+
+                        # Get the category of the attachment, going by the content type that Discord gives us when it's there and the file name otherwise.
+                        category = DiscordScraper.getFileCategory(attachment.get('filename') or proxied.split('/')[-1].split('?')[0], attachment.get('content_type'))
+
+                        # Determine if the attachment is of a type that we want to download.
+                        if self.types[DiscordScraper.categorytypes[category]]:
+                            urls.append([proxied, attachment])
                         
-                        # Iterate through all of the attachments to check them one-by-one.
-                        for attachment in message['attachments']:
-
-                            # Get the proxied URL for our content.
-                            proxied = attachment['proxy_url']
-
-                            # Get the proxied file name from the proxied URL.
-                            proxiedfilename = proxied.split('/')[-1].split('?')[0]
-
-                            # Get the mimetype for the proxied file name.
-                            proxiedfilemime = DiscordScraper.getFileMimetype(proxiedfilename).split('/')[0]
-
-                            # Determine if the proxied file is an image file.
-                            if self.types['images'] and proxiedfilemime == 'image':
-                                
-                                # Begin downloading this file if so.
-                                self.startDownloading(proxied, self.location)
-                            
-                            # Determine if the proxied file is a video file.
-                            if self.types['videos'] and proxiedfilemime == 'video':
-                                
-                                # Begin downloading this file if so.
-                                self.startDownloading(proxied, self.location)
-                            
-                            # Determine if the proxied file is neither an image or a video file.
-                            if self.types['files'] and proxiedfilemime not in ['image', 'video']:
-                                
-                                # Begin downloading this file if so.
-                                self.startDownloading(proxied, self.location)
-                            
-                        # Iterate through all of the embedded contents to check them one-by-one.
-                        for embed in message['embeds']:
-
-                            # Determine if there are any embedded images.
-                            if self.types['images']:
-
-                                # Get the URL for our content.
-                                url = embed['image']['proxy_url']
-                                
-                                # Begin downloading this file if so.
-                                self.startDownloading(url, self.location)
-
-                            # Determine if there are any embedded videos.
-                            if self.types['videos']:
-
-                                # Get the URL for our content.
-                                url = embed['video']['proxy_url']
-
-                                # Begin downloading this file if so.
-                                self.startDownloading(url, self.location)
-        except:
-            pass
+                    # Iterate through all of the embedded contents to check them one-by-one.
+                    for embed in message['embeds']:
+
+                        # Determine if there are any embedded images.
+                        if self.types['images'] and 'image' in embed:
+                            urls.append([embed['image']['proxy_url'], embed['image']])
+
+                        # Determine if there are any embedded videos.
+                        if self.types['videos'] and 'video' in embed:
+                            urls.append([embed['video']['proxy_url'], embed['video']])
+
+        # Return the array of [URL, media] pairs.
+        return urls
     
     @staticmethod
     def randomString(length):
@@ -453,6 +840,39 @@ class DiscordScraper(object):
         # Return a string formed from the joining of an array of "random" characters.
         return ''.join([choice(charset) for i in range(length)])
 
+    # The types configuration key for each file category.
+    categorytypes = {'image': 'images', 'video': 'videos', 'file': 'files'}
+
+    @staticmethod
+    def getFileCategory(name, contenttype=None):
+        """
+        Return the category (image, video, or file) of a file.
+        :param name: The file name whose category we want to determine.
+        :param contenttype: The content type that Discord gave us for the file, if there is one.
+        """
+
+        # Trust the content type when we have one.
+        if contenttype:
+            category = contenttype.split('/')[0]
+            return category if category in ['image', 'video'] else 'file'
+
+        # Grab the lowercase file extension.
+        extension = path.splitext(name)[1].lower()
+
+        # Look the extension up in the category table.
+        category = extensioncategories.get(extension)
+
+        if category is not None:
+            return category
+
+        # Otherwise guess the mimetype of the extension, the guesses are cached.
+        mimetype = guessExtensionMimetype(extension)
+
+        if mimetype is not None and mimetype.split('/')[0] in ['image', 'video']:
+            return mimetype.split('/')[0]
+
+        return 'file'
+
     @staticmethod
     def getFileMimetype(name):
         """
@@ -460,8 +880,8 @@ class DiscordScraper(object):
         :param name: The file name whose mimetype we want to guess.
         """
 
-        # Create a variable to store the guessed mimetype for the file.
-        mimetype = MimeTypes().guess_type(name)[0]
+        # Create a variable to store the guessed mimetype for the file, the mimetype database is only built once.
+        mimetype = mimedatabase.guess_type(name)[0]
 
         # Determine if the mimetype value is empty, return a blob mimetype if it is empty.
         if mimetype is None:
@@ -605,6 +1025,16 @@ class DiscordScraper(object):
         # Join the array of partial URI parameters and return that value.
         return '&'.join(parameters)
 
+    @staticmethod
+    def wrapMessages(messages):
+        """
+        Wrap a list of messages from the documented messages endpoint in the same shape as a search response.
+        :param messages: The list of message objects that Discord returned.
+        """
+
+        # The search endpoint nests every hit in its own list (alongside any context messages).
+        return {'total_results': len(messages), 'messages': [[message] for message in messages]}
+
     @staticmethod
     def requestData(url, headers=None):
         """
@@ -0,0 +1,183 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+queue.Queue: Used to hand the downloads from the search walk to the download workers, it blocks the walk whenever it fills up.
+"""
+from queue import Queue
+
+"""
+threading.Lock:   Used to guard the counters that track when a group of downloads has finished.
+threading.Thread: Used to run the download workers.
+"""
+from threading import Lock, Thread
+
+"""
+concurrent.futures.Future: Used to recognize a download that handed the rest of its work (re-encoding an image) over to another pool.
+"""
+from concurrent.futures import Future
+
+"""
+sys.stderr: Used to write to the standard error filestream.
+"""
+from sys import stderr
+
+def warn(message):
+    """
+    Throw a warning message without halting the script.
+    :param message: A string that will be printed out to STDERR.
+    """
+
+    # Append our message with a newline character.
+    stderr.write('[WARN] {0}\n'.format(message))
+
+class DownloadQueue(object):
+    """
+    A bounded queue of downloads serviced by a pool of worker threads, so that the search walk keeps producing work while the files download.
+    """
+
+    def __init__(self, workers=4, maxsize=256):
+        """
+        :param workers: The number of worker threads that download files at the same time.
+        :param maxsize: The number of downloads that can wait in the queue before the search walk has to wait for the workers to catch up.
+        """
+
+        # Store the number of workers.
+        self.workers = workers
+
+        # Create the bounded queue.
+        self.queue = Queue(maxsize)
+
+        # Create an array to store the worker threads, they're started on the first download.
+        self.threads = []
+
+        # Create a counter for the workers that are busy downloading right now.
+        self.active = 0
+
+        # Create a dictionary that maps the key of every download in flight to the groups of the duplicates that wait on it, so that two workers never write to the same file.
+        self.inflight = {}
+
+        # Create a lock to guard the group counters and the worker threads.
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Start the worker threads if they aren't running yet.
+        """
+
+        with self.lock:
+            while len(self.threads) < self.workers:
+
+                # The workers are daemons so that CTRL+C doesn't have to wait on them.
+                thread = Thread(target=self.work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def put(self, tasks, callback=None):
+        """
+        Queue up a group of downloads, blocking while the queue is full.
+        :param tasks: An array of (function, arguments, key) tuples, one for each download, a download whose key is already in flight isn't run again but finishes along with the one in flight (a key of None is never deduplicated).
+        A function returns True once its file is on the disk or was skipped on purpose, anything else (or an exception) counts as a failed download, and a function can also return a Future that resolves to the same.
+        :param callback: A function that is called once every download in the group has finished, straight away if the group is empty, it isn't called at all if any download in the group failed.
+        """
+
+        # Call the callback straight away if there's nothing to download.
+        if len(tasks) == 0:
+            if callback is not None:
+                callback()
+            return None
+
+        # Start the workers.
+        self.start()
+
+        # Create a counter for the downloads in the group that haven't finished yet, along with whether all of them succeeded so far.
+        group = [len(tasks), callback, True]
+
+        # Queue up every download in the group.
+        for function, args, key in tasks:
+            self.queue.put((function, args, key, group))
+
+    def work(self):
+        """
+        The worker loop, download the queued files one after another.
+        """
+
+        while True:
+            function, args, key, group = self.queue.get()
+
+            with self.lock:
+
+                # Wait on the download that is already in flight for the same file instead of running it again.
+                if key is not None and key in self.inflight:
+                    self.inflight[key].append(group)
+                    continue
+
+                if key is not None:
+                    self.inflight[key] = []
+
+                self.active += 1
+
+            try:
+                # Download the file.
+                result = function(*args)
+
+            except Exception as ex:
+                warn('Download failed: {0}'.format(ex))
+                result = None
+
+            with self.lock:
+                self.active -= 1
+
+            # A download that handed the rest of its work over to another pool only counts as finished once that work is done, the worker moves on to the next file in the meantime.
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future, key=key, group=group: self.finish(key, group, future.exception() is None and future.result() is True))
+            else:
+                self.finish(key, group, result is True)
+
+    def finish(self, key, group, succeeded):
+        """
+        Count a finished download and the duplicates that waited on it towards their groups, call the callback of every group that is finished without a failure, and mark the downloads as done.
+        :param key: The key of the download, or None if it isn't deduplicated.
+        :param group: The [downloads left, callback, succeeded] list of the group that the download belongs to.
+        :param succeeded: A true or false (boolean) value that determines if the file is on the disk (or was skipped on purpose), the duplicates that waited on it share the outcome.
+        """
+
+        with self.lock:
+
+            # Take the key out of flight along with the groups of its duplicates.
+            groups = [group] + (self.inflight.pop(key, []) if key is not None else [])
+
+            # Count the downloads towards their groups.
+            finished = []
+
+            for entry in groups:
+                entry[0] -= 1
+                entry[2] = entry[2] and succeeded
+
+                if entry[0] == 0:
+                    finished.append(entry)
+
+        for entry in finished:
+
+            # Leave the callback out if a download of the group failed, so that whatever it records (a checkpointed window) is fetched again on the next run.
+            if entry[1] is not None and not entry[2]:
+                warn('Some of the downloads in a group failed, it will be fetched again on the next run.')
+
+            elif entry[1] is not None:
+                try:
+                    entry[1]()
+                except Exception as ex:
+                    warn('Download callback failed: {0}'.format(ex))
+
+        # Mark the downloads as done.
+        for entry in groups:
+            self.queue.task_done()
+
+    def join(self):
+        """
+        Block until every queued download has finished.
+        """
+        self.queue.join()
@@ -0,0 +1,95 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+The number of bytes from the start of a file that we need to recognize every signature below.
+"""
+headersize = 16
+
+"""
+The table of file signatures (magic numbers), every entry is an (offset, bytes, mimetype) tuple and the first match wins.
+"""
+signatures = [
+    (0, b'\xFF\xD8\xFF', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1A\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'\x00\x00\x01\x00', 'image/x-icon'),
+    (0, b'\x1A\x45\xDF\xA3', 'video/webm'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'%PDF', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'PK\x05\x06', 'application/zip'),
+    (0, b'Rar!\x1A\x07', 'application/vnd.rar'),
+    (0, b'7z\xBC\xAF\x27\x1C', 'application/x-7z-compressed'),
+    (0, b'\x1F\x8B', 'application/gzip'),
+    (0, b'MZ', 'application/x-msdownload'),
+    (0, b'\x7FELF', 'application/x-executable'),
+]
+
+"""
+The mimetypes of the ISO base media (MP4 family) brands that aren't plain MP4 video.
+"""
+brands = {
+    b'qt  ': 'video/quicktime',
+    b'heic': 'image/heic',
+    b'heix': 'image/heic',
+    b'mif1': 'image/heif',
+    b'msf1': 'image/heif',
+    b'avif': 'image/avif',
+    b'M4A ': 'audio/mp4',
+    b'M4B ': 'audio/mp4',
+}
+
+"""
+The mimetypes of the RIFF containers.
+"""
+riffs = {
+    b'WEBP': 'image/webp',
+    b'AVI ': 'video/x-msvideo',
+    b'WAVE': 'audio/wav',
+}
+
+def sniffMimetype(head):
+    """
+    Return the mimetype that the first bytes of a file belong to, or None if they don't match any known signature.
+    :param head: The first bytes of the file, at least headersize of them for a reliable answer.
+    """
+
+    # The ISO base media files (MP4, MOV, HEIC, AVIF) start with a box size followed by "ftyp" and their brand.
+    if head[4:8] == b'ftyp':
+        return brands.get(head[8:12], 'video/mp4')
+
+    # The RIFF files keep their real type eight bytes in.
+    if head[:4] == b'RIFF':
+        return riffs.get(head[8:12])
+
+    # Check the rest of the signatures in order.
+    for offset, signature, mimetype in signatures:
+        if head[offset:offset + len(signature)] == signature:
+            return mimetype
+
+    # The MPEG audio frames start with 11 set bits.
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return 'audio/mpeg'
+
+    return None
+
+def getMimetypeCategory(mimetype):
+    """
+    Return the category (image, video, or file) of a mimetype.
+    :param mimetype: The mimetype that we want to categorize.
+    """
+
+    # Grab the top level type of the mimetype.
+    category = mimetype.split('/')[0]
+
+    return category if category in ['image', 'video'] else 'file'
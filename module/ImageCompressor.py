@@ -0,0 +1,187 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+PIL.Image: Used to re-encode the downloaded images, Pillow is optional so compressImageData is turned off without it.
+"""
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+"""
+concurrent.futures.ProcessPoolExecutor: Used to re-encode the images on every processor core, outside of the download threads.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+multiprocessing.get_context: Used to start the worker processes from scratch instead of forking a process full of download threads.
+"""
+from multiprocessing import get_context
+
+"""
+os.path:    Used to measure the images.
+os.remove:  Used to throw away a re-encoded image that didn't come out smaller, or the original once it's been converted to another format.
+os.replace: Used to atomically swap an image for its smaller re-encoded copy.
+"""
+from os import path, remove, replace
+
+"""
+hashlib.sha256: Used to checksum a re-encoded image so that the content store keeps it under the checksum of what is really on the disk.
+"""
+from hashlib import sha256
+
+"""
+threading.Lock: Used to start the worker processes only once.
+"""
+from threading import Lock
+
+"""
+The formats that every image can be converted to, Pillow reads and writes AVIF from version 11.2 on.
+"""
+convertformats = {'webp': 'WEBP', 'avif': 'AVIF'}
+
+def hashFile(filename, buffersize=1048576):
+    """
+    Return the SHA-256 checksum of a file.
+    :param filename: The full file path to the file.
+    :param buffersize: The number of bytes to read at a time.
+    """
+
+    # Create the hash.
+    checksum = sha256()
+
+    with open(filename, 'rb') as filestream:
+        for chunk in iter(lambda: filestream.read(buffersize), b''):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+def recompressImage(filename, quality=None, format=None):
+    """
+    Re-encode an image if that makes it smaller, returning a [file name, bytes saved, checksum] list where the checksum is None if the image was left alone.
+    Without a quality the image is only optimized losslessly (a PNG is re-packed, a JPEG or WebP is left alone since Pillow can't re-encode those without losing detail).
+    This runs in a worker process so it has to stay a plain module level function.
+    :param filename: The full file path to the image.
+    :param quality: The JPEG, WebP and AVIF quality setting (1 to 95) for a lossy re-encode, or None to stay lossless.
+    :param format: The format to convert the image to (webp or avif), or None to keep its own format, the converted copy replaces the original under the new extension.
+    """
+
+    with Image.open(filename) as image:
+
+        # Leave animations alone, re-encoding them would drop frames.
+        if getattr(image, 'is_animated', False):
+            return [filename, 0, None]
+
+        # Carry the color profile and the EXIF data over to the copy.
+        extras = {'icc_profile': image.info.get('icc_profile'), 'exif': image.info.get('exif')}
+        extras = dict((key, value) for key, value in extras.items() if value)
+
+        # Convert the still images that we know how to decode to the format that we've been asked for, keeping CMYK images as they are since their color profile wouldn't fit the converted copy.
+        if format is not None and image.format in ['JPEG', 'PNG', 'WEBP'] and image.mode != 'CMYK':
+            outname = '{0}.{1}'.format(path.splitext(filename)[0], format)
+            options = {'quality': quality} if quality is not None else ({'lossless': True} if format == 'webp' else {'quality': 90})
+            outformat = convertformats[format]
+
+            if image.mode not in ['RGB', 'RGBA']:
+                image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+
+        # Re-pack a PNG, this never changes a pixel.
+        elif image.format == 'PNG':
+            outname, outformat, options = filename, 'PNG', {'optimize': True}
+
+        # Re-encode a JPEG or WebP only if we've opted into a lossy quality setting.
+        elif image.format == 'JPEG' and quality is not None:
+            outname, outformat, options = filename, 'JPEG', {'quality': quality, 'optimize': True, 'progressive': True}
+
+        elif image.format == 'WEBP' and quality is not None:
+            outname, outformat, options = filename, 'WEBP', {'quality': quality, 'method': 6}
+
+        # Leave the formats that we don't know how to shrink alone.
+        else:
+            return [filename, 0, None]
+
+        # Generate the file name for the re-encoded copy.
+        tempname = '{0}.tmp'.format(outname)
+        options.update(extras)
+        image.save(tempname, outformat, **options)
+
+    # Grab the number of bytes that the copy saves.
+    saved = path.getsize(filename) - path.getsize(tempname)
+
+    # Keep the original if the copy didn't come out smaller.
+    if saved <= 0:
+        remove(tempname)
+        return [filename, 0, None]
+
+    # Swap the image for the copy in one atomic step, a converted copy gets the new extension and the original goes.
+    replace(tempname, outname)
+
+    if outname != filename:
+        remove(filename)
+
+    return [outname, saved, hashFile(outname)]
+
+class ImageCompressor(object):
+    """
+    A pool of worker processes that re-encode downloaded images to save on storage space.
+    """
+
+    def __init__(self, workers=None, quality=None, format=None):
+        """
+        :param workers: The number of worker processes, this defaults to the number of processor cores.
+        :param quality: The JPEG, WebP and AVIF quality setting (1 to 95) for a lossy re-encode, or None to only optimize the images losslessly.
+        :param format: The format to convert the images to (webp or avif), or None to keep their own formats.
+        """
+
+        # Store the settings.
+        self.workers = workers
+        self.quality = quality
+        self.format = format
+
+        # Create a variable to store the process pool, it is started on the first image.
+        self.executor = None
+
+        # Create a lock to guard the process pool.
+        self.lock = Lock()
+
+    @staticmethod
+    def available():
+        """
+        Determine if Pillow is installed.
+        """
+        return Image is not None
+
+    @staticmethod
+    def supports(format):
+        """
+        Determine if Pillow can write a format that we can convert the images to.
+        :param format: The format (webp or avif).
+        """
+        return format in convertformats and '.{0}'.format(format) in Image.registered_extensions() and convertformats[format] in Image.SAVE
+
+    def compress(self, filename):
+        """
+        Re-encode an image on a worker process without waiting for it, returning the future that holds the [file name, bytes saved, checksum] list.
+        :param filename: The full file path to the image.
+        """
+
+        # Start the process pool on the first image.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+
+        return self.executor.submit(recompressImage, filename, self.quality, self.format)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
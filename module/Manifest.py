@@ -0,0 +1,169 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+os.listdir: Used to rebuild a missing manifest from the files that are already in the channel folder.
+os.path:    Used to combine file paths and check if the manifest exists.
+"""
+from os import listdir, path
+
+"""
+threading.Lock: Used to keep the manifest file intact when several download workers finish at the same time.
+"""
+from threading import Lock
+
+class Manifest(object):
+    """
+    An in-memory record of the files that a channel folder already holds (or turned down because of their real type), so that a re-scan can skip them without touching the filesystem.
+    Every line of the manifest file holds a key, optionally followed by a tab and the mimetype that was sniffed from the file, and another tab and the SHA-256 checksum of the file as it was downloaded.
+    A file that was turned down has "rejected" in a fourth field, it isn't one of the files that the folder holds, so it's tried again once its type is wanted.
+    """
+
+    # The name of the manifest file in each channel folder.
+    filename = 'manifest.txt'
+
+    # The files in a channel folder that aren't downloads.
+    ignored = ['manifest.txt', 'checksums.sha256']
+
+    # The endings of the partial downloads and the temporary files that a crash can leave behind (MediaStore makes its links under a ".link" name first).
+    temporary = ('.part', '.part.json', '.tmp', '.link')
+
+    def __init__(self, location):
+        """
+        :param location: The channel folder that the manifest belongs to.
+        """
+
+        # Store the full file path to the manifest.
+        self.location = location
+        self.filename = path.join(location, Manifest.filename)
+
+        # Create a set to store the keys of the files that we already have.
+        self.keys = set()
+
+        # Create dictionaries to store the sniffed mimetype and the checksum of each file that has one.
+        self.mimetypes = {}
+        self.checksums = {}
+
+        # Create a dictionary to store the sniffed mimetype of each file that was turned down because of it.
+        self.rejected = {}
+
+        # Create a lock to guard the set and the manifest file.
+        self.lock = Lock()
+
+        # Load the manifest, or rebuild it if it doesn't exist yet.
+        if path.isfile(self.filename):
+            self.load()
+        else:
+            self.rebuild()
+
+    def load(self):
+        """
+        Read the keys from the manifest file, one key per line.
+        """
+
+        with open(self.filename, 'r') as manifeststream:
+            for line in manifeststream:
+
+                # Skip the blank lines.
+                if not line.strip():
+                    continue
+
+                # Split the key from its mimetype.
+                fields = line.rstrip('\n').split('\t')
+
+                # Keep the files that were turned down apart, unless a later line says that the file was downloaded after all.
+                if len(fields) > 3 and fields[3] == 'rejected':
+                    if fields[0] not in self.keys:
+                        self.rejected[fields[0]] = fields[1]
+
+                    continue
+
+                self.keys.add(fields[0])
+                self.rejected.pop(fields[0], None)
+
+                if len(fields) > 1 and fields[1]:
+                    self.mimetypes[fields[0]] = fields[1]
+
+                if len(fields) > 2 and fields[2]:
+                    self.checksums[fields[0]] = fields[2]
+
+    def rebuild(self):
+        """
+        Rebuild the manifest from the files in the channel folder, this is a single directory listing instead of a stat call for every file.
+        """
+
+        # Create a set to store the keys that we find.
+        keys = set()
+
+        if path.isdir(self.location):
+            for name in listdir(self.location):
+
+                # Skip the partial downloads and the files that aren't downloads.
+                if name in Manifest.ignored or name.endswith(Manifest.temporary):
+                    continue
+
+                # Every file is known by its name, and an attachment by the ID at the start of its name as well.
+                keys.add(name)
+                keys.add(name.split('_')[0])
+
+        # Write the keys to the manifest file.
+        with self.lock:
+            self.keys = keys
+
+            if path.isdir(self.location):
+                with open(self.filename, 'w') as manifeststream:
+                    manifeststream.write(''.join('{0}\n'.format(key) for key in sorted(keys)))
+
+    def has(self, key):
+        """
+        Determine if the channel folder already holds the file.
+        :param key: The attachment ID of the file, or its file name if it isn't an attachment.
+        """
+        return key in self.keys
+
+    def getRejected(self, key):
+        """
+        Return the sniffed mimetype of a file that was turned down because of it, or None if the file wasn't turned down.
+        :param key: The attachment ID of the file, or its file name if it isn't an attachment.
+        """
+        return self.rejected.get(key)
+
+    def add(self, key, mimetype=None, checksum=None, rejected=False):
+        """
+        Record a finished file in the manifest.
+        :param key: The attachment ID of the file, or its file name if it isn't an attachment.
+        :param mimetype: The mimetype that was sniffed from the first bytes of the file.
+        :param checksum: The SHA-256 checksum of the file as it was downloaded (before any recompression).
+        :param rejected: A true or false (boolean) value that records the file as turned down because of its sniffed mimetype instead.
+        """
+
+        with self.lock:
+
+            # Skip the file if it's already in the manifest.
+            if key in self.keys or (rejected and self.rejected.get(key) == mimetype):
+                return None
+
+            if rejected:
+                self.rejected[key] = mimetype
+            else:
+                self.keys.add(key)
+                self.rejected.pop(key, None)
+
+            if mimetype is not None and not rejected:
+                self.mimetypes[key] = mimetype
+
+            if checksum is not None:
+                self.checksums[key] = checksum
+
+            # Leave off the empty fields at the end of the line.
+            fields = [key, mimetype or '', checksum or '', 'rejected' if rejected else '']
+
+            while fields[-1] == '':
+                fields.pop()
+
+            # Append the key to the manifest file, the channel folder exists by now since the file was just downloaded into it.
+            with open(self.filename, 'a') as manifeststream:
+                manifeststream.write('{0}\n'.format('\t'.join(fields)))
@@ -0,0 +1,135 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+os.link:     Used to give a channel folder its own name for a blob without storing the data twice.
+os.makedirs: Used to create the folders of the content store.
+os.path:     Used to combine and split file paths.
+os.replace:  Used to swap a download for a link to the blob that already holds its contents.
+"""
+from os import link, makedirs, path, replace
+
+"""
+threading.Lock: Used to keep the checksum documents intact when several download workers finish at the same time.
+"""
+from threading import Lock
+
+"""
+sys.stderr: Used to write to the standard error filestream.
+"""
+from sys import stderr
+
+def warn(message):
+    """
+    Throw a warning message without halting the script.
+    :param message: A string that will be printed out to STDERR.
+    """
+
+    # Append our message with a newline character.
+    stderr.write('[WARN] {0}\n'.format(message))
+
+class MediaStore(object):
+    """
+    A content-addressed store that keeps a single copy of every downloaded file under its SHA-256 checksum, the channel folders hold hard links to the blobs.
+    """
+
+    def __init__(self, root, checkpoint):
+        """
+        :param root: The folder that stores the blobs.
+        :param checkpoint: The Checkpoint object whose blob index maps attachments to the blobs that hold them.
+        """
+
+        # Store the root folder and the blob index.
+        self.root = root
+        self.checkpoint = checkpoint
+
+        # Create a lock to guard the checksum documents.
+        self.lock = Lock()
+
+    def getBlobPath(self, checksum):
+        """
+        Return the full file path to the blob for a checksum, the blobs are spread over 256 subfolders so no single folder gets too large.
+        :param checksum: The SHA-256 checksum of the blob.
+        """
+        return path.join(self.root, checksum[:2], checksum)
+
+    def linkBlob(self, checksum, filename):
+        """
+        Give an existing blob a name in a channel folder, returning True if it worked.
+        :param checksum: The SHA-256 checksum of the blob.
+        :param filename: The full file path that the blob should appear under.
+        """
+
+        # Grab the blob file path.
+        blob = self.getBlobPath(checksum)
+
+        # We can't link to a blob that was removed from the store.
+        if not path.isfile(blob):
+            return False
+
+        # Create the channel folder if it doesn't exist yet.
+        if not path.exists(path.split(filename)[0]):
+            makedirs(path.split(filename)[0])
+
+        try:
+            link(blob, filename)
+
+        except FileExistsError:
+            pass
+
+        except OSError as ex:
+            warn('Unable to link {0} to {1}: {2}'.format(blob, filename, ex))
+            return False
+
+        return True
+
+    def storeFile(self, checksum, filename, size=None, name=None):
+        """
+        Move a finished download into the store, or swap it for a link to the blob if the store already holds the same contents.
+        :param checksum: The SHA-256 checksum of the download.
+        :param filename: The full file path to the finished download.
+        :param size: The size of the attachment in bytes, the blob is only indexed for attachments that Discord gave us a size for.
+        :param name: The file name of the attachment.
+        """
+
+        # Grab the blob file path.
+        blob = self.getBlobPath(checksum)
+
+        try:
+            # Swap the new copy for a link to the blob that we already have, the link is made under a temporary name first so the download survives a failed link.
+            if path.isfile(blob):
+                link(blob, '{0}.link'.format(filename))
+                replace('{0}.link'.format(filename), filename)
+
+            # Otherwise the download becomes the blob.
+            else:
+                if not path.exists(path.split(blob)[0]):
+                    makedirs(path.split(blob)[0])
+
+                link(filename, blob)
+
+        except OSError as ex:
+            # Keep the download as a plain file if the filesystem can't hard link.
+            warn('Unable to store {0} in the content store: {1}'.format(filename, ex))
+            return None
+
+        # Remember which blob holds this attachment so that a repost isn't downloaded again, along with the extension that it's stored under.
+        if size is not None and name is not None:
+            self.checkpoint.addBlob(size, name, checksum, path.splitext(filename)[1])
+
+    def writeChecksum(self, checksum, filename):
+        """
+        Append the checksum of a file to the checksums.sha256 document in its folder, the document can be checked with sha256sum -c.
+        :param checksum: The SHA-256 checksum of the file.
+        :param filename: The full file path to the file.
+        """
+
+        # Split the file path into its folder and file name.
+        location, name = path.split(filename)
+
+        with self.lock:
+            with open(path.join(location, 'checksums.sha256'), 'a') as checkstream:
+                checkstream.write('{0}  {1}\n'.format(checksum, name))
@@ -0,0 +1,243 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+sqlite3.connect:          Used to open the message database.
+sqlite3.OperationalError: Used to detect an SQLite library that was built without FTS5.
+"""
+from sqlite3 import connect, OperationalError
+
+"""
+json.loads: Used to convert the cached JSON files back into dictionary objects when importing them.
+"""
+from json import loads
+
+"""
+os.listdir: Used to walk the cache directory when importing it.
+os.path:    Used to combine file paths.
+"""
+from os import listdir, path
+
+"""
+threading.Lock: Used to share a single database connection between the threads of the scraper.
+"""
+from threading import Lock
+
+"""
+sys.stderr: Used to write to the standard error filestream.
+"""
+from sys import stderr
+
+"""
+module.MessageLog.MessageLog: Used to read the compressed message logs when importing the cache directory.
+"""
+from .MessageLog import MessageLog
+
+def warn(message):
+    """
+    Throw a warning message without halting the script.
+    :param message: A string that will be printed out to STDERR.
+    """
+
+    # Append our message with a newline character.
+    stderr.write('[WARN] {0}\n'.format(message))
+
+class MessageDatabase(object):
+    """
+    A normalized SQLite copy of the scraped messages (messages, authors, attachments and embeds) with a full-text index on the message content.
+    """
+
+    def __init__(self, filename, wal=False):
+        """
+        :param filename: The full file path to the SQLite database that stores the messages.
+        :param wal: A true or false (boolean) value that turns on write ahead logging, which needs shared memory, so it's only safe on a local disk (never on a network file system).
+        """
+
+        # Open the database, the connection is shared between threads so we guard it ourselves.
+        self.connection = connect(filename, timeout=60, check_same_thread=False)
+
+        # Create a lock to guard the connection.
+        self.lock = Lock()
+
+        with self.lock:
+            # Write ahead logging lets the analysts query the database while the scraper is still writing to it, but we stay on the rollback journal unless we've been told that the database is on a local disk.
+            self.connection.execute('PRAGMA journal_mode = {0}'.format('WAL' if wal else 'DELETE'))
+
+            # Create the tables.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS authors (id INTEGER PRIMARY KEY, username TEXT, discriminator TEXT, global_name TEXT, bot INTEGER NOT NULL DEFAULT 0)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, guild INTEGER, channel INTEGER NOT NULL, author INTEGER, timestamp TEXT, edited_timestamp TEXT, type INTEGER, content TEXT, pinned INTEGER NOT NULL DEFAULT 0, reference INTEGER)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS attachments (id INTEGER PRIMARY KEY, message INTEGER NOT NULL, filename TEXT, size INTEGER, content_type TEXT, url TEXT, proxy_url TEXT, width INTEGER, height INTEGER)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS embeds (message INTEGER NOT NULL, position INTEGER NOT NULL, type TEXT, url TEXT, title TEXT, description TEXT, image_url TEXT, video_url TEXT, PRIMARY KEY (message, position))')
+
+            # Create the indexes for looking up messages by guild, channel, author and snowflake.
+            self.connection.execute('CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS messages_guild ON messages (guild, id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS messages_author ON messages (author, id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message)')
+
+            # Create the full-text index on the message content, the triggers keep it in step with the messages table.
+            try:
+                self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id')")
+                self.connection.execute('CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END')
+                self.connection.execute("CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END")
+                self.connection.execute("CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END")
+                self.fulltext = True
+
+            except OperationalError:
+                warn('This SQLite library was built without FTS5, the message database will not have a full-text index.')
+                self.fulltext = False
+
+            self.connection.commit()
+
+    def add(self, messages, guild=None):
+        """
+        Store a batch of messages in a single transaction, messages that are already stored are updated in place.
+        :param messages: The list of message objects that Discord returned.
+        :param guild: The ID for the guild that the messages belong to (Discord leaves it out of search results).
+        """
+
+        # Create arrays to store the rows for each table.
+        authors = {}
+        rows = []
+        attachments = []
+        embeds = []
+
+        for message in messages:
+
+            # Grab the author of the message, the newest copy of an author wins.
+            author = message.get('author') or {}
+
+            if 'id' in author:
+                authors[int(author['id'])] = (int(author['id']), author.get('username'), author.get('discriminator'), author.get('global_name'), int(bool(author.get('bot'))))
+
+            # Grab the message that this one replies to.
+            reference = (message.get('message_reference') or {}).get('message_id')
+
+            rows.append((
+                int(message['id']),
+                int(message['guild_id']) if message.get('guild_id') else guild,
+                int(message['channel_id']),
+                int(author['id']) if 'id' in author else None,
+                message.get('timestamp'),
+                message.get('edited_timestamp'),
+                message.get('type'),
+                message.get('content'),
+                int(bool(message.get('pinned'))),
+                int(reference) if reference else None
+            ))
+
+            for attachment in message.get('attachments', []):
+                attachments.append((int(attachment['id']), int(message['id']), attachment.get('filename'), attachment.get('size'), attachment.get('content_type'), attachment.get('url'), attachment.get('proxy_url'), attachment.get('width'), attachment.get('height')))
+
+            for position, embed in enumerate(message.get('embeds', [])):
+                embeds.append((int(message['id']), position, embed.get('type'), embed.get('url'), embed.get('title'), embed.get('description'), (embed.get('image') or {}).get('url'), (embed.get('video') or {}).get('url')))
+
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO authors (id, username, discriminator, global_name, bot) VALUES (?, ?, ?, ?, ?)', list(authors.values()))
+
+                # Update stored messages instead of replacing them so that the update trigger keeps the full-text index right.
+                self.connection.executemany('INSERT INTO messages (id, guild, channel, author, timestamp, edited_timestamp, type, content, pinned, reference) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET guild = COALESCE(excluded.guild, guild), channel = excluded.channel, author = excluded.author, timestamp = excluded.timestamp, edited_timestamp = excluded.edited_timestamp, type = excluded.type, content = excluded.content, pinned = excluded.pinned, reference = excluded.reference', rows)
+
+                self.connection.executemany('INSERT OR REPLACE INTO attachments (id, message, filename, size, content_type, url, proxy_url, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', attachments)
+                self.connection.executemany('INSERT OR REPLACE INTO embeds (message, position, type, url, title, description, image_url, video_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', embeds)
+
+    def search(self, query, guild=None, channel=None, limit=100):
+        """
+        Return the [id, channel, author, timestamp, content] rows of the newest messages that match a full-text query.
+        :param query: The FTS5 query string, for example "cats AND dogs".
+        :param guild: The ID for the guild that we want to search, or None to search every guild.
+        :param channel: The ID for the channel that we want to search, or None to search every channel.
+        :param limit: The maximum number of rows to return.
+        """
+
+        # Fall back to a substring search if we don't have a full-text index.
+        if self.fulltext:
+            sql = 'SELECT m.id, m.channel, m.author, m.timestamp, m.content FROM messages_fts f JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?'
+        else:
+            sql = "SELECT m.id, m.channel, m.author, m.timestamp, m.content FROM messages m WHERE m.content LIKE '%' || ? || '%'"
+
+        # Create an array to store the query parameters.
+        parameters = [query]
+
+        if guild is not None:
+            sql += ' AND m.guild = ?'
+            parameters.append(int(guild))
+
+        if channel is not None:
+            sql += ' AND m.channel = ?'
+            parameters.append(int(channel))
+
+        parameters.append(limit)
+
+        with self.lock:
+            return [list(row) for row in self.connection.execute('{0} ORDER BY m.id DESC LIMIT ?'.format(sql), parameters).fetchall()]
+
+    def importCache(self, cachedir):
+        """
+        Bulk-load an existing cache directory (the JSON cache files and the compressed message logs) into the database, returning the number of messages loaded.
+        :param cachedir: The cache directory that holds a folder for each guild with a folder for each channel.
+        """
+
+        # Create a variable to store the number of messages loaded.
+        count = 0
+
+        # Determine if there is anything to import.
+        if not path.isdir(cachedir):
+            return count
+
+        for guildname in listdir(cachedir):
+            if not path.isdir(path.join(cachedir, guildname)):
+                continue
+
+            # The guild folders are named after the guild ID followed by the guild name.
+            guild = guildname.split('_')[0]
+            guild = int(guild) if guild.isdigit() else None
+
+            for channelname in listdir(path.join(cachedir, guildname)):
+                channeldir = path.join(cachedir, guildname, channelname)
+
+                if not path.isdir(channeldir):
+                    continue
+
+                # Load the compressed message log a gzip member at a time.
+                if path.isfile(path.join(channeldir, MessageLog.indexname)):
+                    batch = []
+
+                    for message in MessageLog(channeldir).read():
+                        batch.append(message)
+
+                        if len(batch) >= 5000:
+                            self.add(batch, guild)
+                            count += len(batch)
+                            batch = []
+
+                    self.add(batch, guild)
+                    count += len(batch)
+
+                # Load the JSON cache files one transaction each.
+                for name in listdir(channeldir):
+                    if not name.endswith('.cache.json'):
+                        continue
+
+                    with open(path.join(channeldir, name), 'r') as cachefilestream:
+                        data = loads(cachefilestream.read())
+
+                    messages = [message for messages in data.get('messages', []) for message in messages]
+                    self.add(messages, guild)
+                    count += len(messages)
+
+                print('Imported {0}/{1}.'.format(guildname, channelname))
+
+        return count
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,312 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+gzip.compress: Used to compress each batch of messages into its own gzip member, a segment is a chain of members that any gzip tool can read.
+"""
+from gzip import compress
+
+"""
+zlib.decompress: Used to decompress a single gzip member straight from its offset without reading the rest of the segment.
+"""
+from zlib import decompress
+
+"""
+json.dumps: Used to convert a message object into a single line of text.
+json.loads: Used to convert a line of text back into a message object.
+json.dump:  Used to write the messages of a day to an exported JSON file.
+"""
+from json import dumps, loads, dump
+
+"""
+datetime.datetime: Used to work out the local day that a message was posted on from its snowflake.
+"""
+from datetime import datetime
+
+"""
+os.makedirs: Used to create the folder of the log.
+os.path:     Used to combine file paths and measure the segments.
+os.listdir:  Used to find the logs to export.
+"""
+from os import makedirs, path, listdir
+
+"""
+bisect.bisect_left: Used to find out if a gzip member can hold any of the snowflakes of a new batch.
+"""
+from bisect import bisect_left
+
+"""
+threading.Lock: Used to keep the segments and the index in step when more than one thread appends to the log.
+"""
+from threading import Lock
+
+class MessageLog(object):
+    """
+    An append-only, compressed log of the messages of a channel, stored as newline-delimited JSON in gzip segments with an index of the snowflakes in each gzip member.
+    """
+
+    # The size in bytes that a segment can grow to before a new one is started.
+    segmentsize = 64 * 1048576
+
+    # The name of the index file, every line holds the segment, offset, length, oldest snowflake, newest snowflake and message count of a gzip member.
+    indexname = 'index.tsv'
+
+    def __init__(self, directory, segmentsize=None):
+        """
+        :param directory: The folder that stores the segments and the index of the log.
+        :param segmentsize: The size in bytes that a segment can grow to before a new one is started.
+        """
+        if segmentsize is None: segmentsize = MessageLog.segmentsize
+
+        # Store the folder and the segment size.
+        self.directory = directory
+        self.segmentsize = segmentsize
+
+        # Create an array to store the [segment, offset, length, minsnow, maxsnow, count] entry of every gzip member.
+        self.index = []
+
+        # Create a variable to store the [oldest, newest] snowflakes of the whole log, a batch outside of them can't hold anything that the log already has.
+        self.bounds = None
+
+        # Create a lock to guard the segments and the index.
+        self.lock = Lock()
+
+        # Load the index if the log already exists.
+        if path.isfile(path.join(directory, MessageLog.indexname)):
+            self.loadIndex()
+
+    def getSegmentName(self, segment):
+        """
+        Return the full file path to a segment.
+        :param segment: The number of the segment.
+        """
+        return path.join(self.directory, 'messages.{0:05d}.ndjson.gz'.format(segment))
+
+    def loadIndex(self):
+        """
+        Read the index of the log and cut off anything that was written to the last segment after its last indexed gzip member (a crash between the two writes).
+        """
+
+        # Create a variable to remember if a crash left a half written line behind.
+        torn = False
+
+        with open(path.join(self.directory, MessageLog.indexname), 'r') as indexstream:
+            for line in indexstream:
+
+                # Skip a line that was only half written.
+                fields = line.rstrip('\n').split('\t')
+
+                if len(fields) != 6 or not line.endswith('\n'):
+                    torn = True
+                    continue
+
+                self.index.append([int(field) for field in fields])
+                self.extendBounds(self.index[-1])
+
+        # Rewrite the index without the half written line so that the next entry starts on a line of its own.
+        if torn:
+            with open(path.join(self.directory, MessageLog.indexname), 'w') as indexstream:
+                indexstream.write(''.join('{0}\n'.format('\t'.join(str(field) for field in entry)) for entry in self.index))
+
+        # Determine where the last segment should end.
+        if len(self.index) > 0:
+            segment, offset, length = self.index[-1][:3]
+            segmentname = self.getSegmentName(segment)
+
+            # Cut off a gzip member that never made it into the index.
+            if path.isfile(segmentname) and path.getsize(segmentname) > offset + length:
+                with open(segmentname, 'r+b') as segmentstream:
+                    segmentstream.truncate(offset + length)
+
+    def append(self, messages):
+        """
+        Append a batch of messages to the log as a single gzip member.
+        :param messages: The list of message objects that we want to store.
+        """
+
+        # Skip an empty batch.
+        if len(messages) == 0:
+            return None
+
+        with self.lock:
+
+            # Grab the snowflakes of the incoming messages in order.
+            incoming = sorted(int(message['id']) for message in messages)
+
+            # Grab the snowflakes that the log already holds, a window that is scraped again (a retry or a resumed run) would otherwise store its messages twice.
+            # Only the gzip members whose span holds one of the incoming snowflakes are read, and none at all if the batch lies outside the log (a walk that carries on past what's stored).
+            known = set()
+
+            if self.bounds is not None and incoming[0] <= self.bounds[1] and incoming[-1] >= self.bounds[0]:
+                for entry in self.index:
+                    position = bisect_left(incoming, entry[3])
+
+                    if position < len(incoming) and incoming[position] <= entry[4]:
+                        known.update(int(message['id']) for message in self.readMember(*entry[:3]))
+
+            # Drop the messages that the log already holds, along with the repeats inside the batch.
+            batch = []
+
+            for message in messages:
+                if int(message['id']) not in known:
+                    known.add(int(message['id']))
+                    batch.append(message)
+
+            # Skip the batch if there's nothing new in it.
+            if len(batch) == 0:
+                return None
+
+            # Grab the snowflakes of the batch.
+            snowflakes = [int(message['id']) for message in batch]
+
+            # Compress the batch, one message per line.
+            member = compress(''.join('{0}\n'.format(dumps(message, separators=(',', ':'))) for message in batch).encode('utf-8'))
+
+            # Create the folder of the log if it doesn't exist yet.
+            if not path.exists(self.directory):
+                makedirs(self.directory)
+
+            # Carry on from the end of the last gzip member, starting a new segment once the last one is full.
+            if len(self.index) == 0:
+                segment, offset = 0, 0
+            else:
+                segment, offset = self.index[-1][0], self.index[-1][1] + self.index[-1][2]
+
+                if offset >= self.segmentsize:
+                    segment, offset = segment + 1, 0
+
+            # Write the gzip member to the end of the segment, a new segment is opened from scratch in case a crash left a torn member in it.
+            with open(self.getSegmentName(segment), 'wb' if offset == 0 else 'ab') as segmentstream:
+                segmentstream.write(member)
+
+            # Record the gzip member in the index, only after it has been written so the index never points at missing data.
+            entry = [segment, offset, len(member), min(snowflakes), max(snowflakes), len(batch)]
+
+            with open(path.join(self.directory, MessageLog.indexname), 'a') as indexstream:
+                indexstream.write('{0}\n'.format('\t'.join(str(field) for field in entry)))
+
+            self.index.append(entry)
+            self.extendBounds(entry)
+
+    def extendBounds(self, entry):
+        """
+        Widen the [oldest, newest] snowflakes of the log to take in a gzip member.
+        :param entry: The index entry of the gzip member.
+        """
+
+        if self.bounds is None:
+            self.bounds = [entry[3], entry[4]]
+        else:
+            self.bounds = [min(self.bounds[0], entry[3]), max(self.bounds[1], entry[4])]
+
+    def read(self, minsnow=None, maxsnow=None):
+        """
+        Yield the messages in the log between two snowflakes (both included), only the gzip members that overlap the range are decompressed.
+        :param minsnow: The oldest snowflake that we want, or None for no lower bound.
+        :param maxsnow: The newest snowflake that we want, or None for no upper bound.
+        """
+
+        # Grab the gzip members that overlap the range.
+        with self.lock:
+            entries = [entry for entry in self.index if (minsnow is None or entry[4] >= minsnow) and (maxsnow is None or entry[3] <= maxsnow)]
+
+        for segment, offset, length in [entry[:3] for entry in entries]:
+            for message in self.readMember(segment, offset, length):
+
+                # Only yield the messages inside the range.
+                if (minsnow is None or int(message['id']) >= minsnow) and (maxsnow is None or int(message['id']) <= maxsnow):
+                    yield message
+
+    def readMember(self, segment, offset, length):
+        """
+        Return the messages of a single gzip member.
+        :param segment: The number of the segment that holds the gzip member.
+        :param offset: The byte position of the gzip member in the segment.
+        :param length: The size of the gzip member in bytes.
+        """
+
+        # Read the gzip member straight from its offset.
+        with open(self.getSegmentName(segment), 'rb') as segmentstream:
+            segmentstream.seek(offset)
+            member = segmentstream.read(length)
+
+        # Decompress the gzip member (the wbits value tells zlib to expect a gzip header).
+        return [loads(line) for line in decompress(member, 31).decode('utf-8').splitlines()]
+
+    def exportDays(self, directory):
+        """
+        Export the log to the per-day "Y_M_D.cache.json" files that the scraper used to write, returning the number of files written.
+        :param directory: The folder that the JSON files are written to.
+        """
+
+        # Grab the gzip members oldest first, so that once we reach a member every day before its oldest message is complete.
+        with self.lock:
+            entries = sorted(self.index, key=lambda entry: entry[3])
+
+        # Create the folder if it doesn't exist yet.
+        if not path.exists(directory):
+            makedirs(directory)
+
+        # Create a dictionary to group the messages of the days that later gzip members may still add to.
+        days = {}
+
+        # Create a variable to store the number of files written.
+        count = 0
+
+        for index, entry in enumerate(entries):
+
+            # Decompress the gzip member once and sort its messages into their days.
+            for message in self.readMember(*entry[:3]):
+                days.setdefault(MessageLog.getDay(int(message['id'])), []).append(message)
+
+            # Grab the day of the oldest message that the next gzip member holds, no later member holds anything older.
+            nextday = MessageLog.getDay(entries[index + 1][3]) if index + 1 < len(entries) else None
+
+            # Write out the days that are complete and let go of them.
+            for day in sorted(day for day in days if nextday is None or day < nextday):
+                messages = days.pop(day)
+
+                # Write the day in the same shape as a search response.
+                with open(path.join(directory, '{0}_{1}_{2}.cache.json'.format(day.year, day.month, day.day)), 'w') as cachefilestream:
+                    dump({'total_results': len(messages), 'messages': [[message] for message in messages]}, cachefilestream, indent=4)
+
+                count += 1
+
+        return count
+
+    @staticmethod
+    def getDay(snowflake):
+        """
+        Return the local date that a message was posted on, the scraper named its cache files after local days as well (see DiscordScraper.getDayBounds).
+        :param snowflake: The snowflake of the message.
+        """
+
+        # Work out the timestamp from the snowflake, the top 42 bits hold the milliseconds since the start of 2015.
+        return datetime.fromtimestamp(((snowflake >> 22) + 1420070400000) / 1000.0).date()
+
+    @staticmethod
+    def exportAll(cachedir, directory):
+        """
+        Export every channel log under the cache directory to per-day JSON files, keeping the guild and channel folder names.
+        :param cachedir: The cache directory that holds a folder for each guild with a folder for each channel.
+        :param directory: The folder that the JSON files are written to.
+        """
+
+        # Determine if there is anything to export.
+        if not path.isdir(cachedir):
+            return None
+
+        for guildname in listdir(cachedir):
+            if not path.isdir(path.join(cachedir, guildname)):
+                continue
+
+            for channelname in listdir(path.join(cachedir, guildname)):
+                logdir = path.join(cachedir, guildname, channelname)
+
+                # Only export the folders that hold a log.
+                if path.isfile(path.join(logdir, MessageLog.indexname)):
+                    count = MessageLog(logdir).exportDays(path.join(directory, guildname, channelname))
+                    print('Exported {0} days from {1}/{2}.'.format(count, guildname, channelname))
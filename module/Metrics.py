@@ -0,0 +1,349 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+http.server.ThreadingHTTPServer:    Used to serve the metrics in the Prometheus text format on a local port.
+http.server.BaseHTTPRequestHandler: Used to answer the scrape requests of Prometheus.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""
+threading.Lock:   Used to keep the metrics consistent when they're updated from several threads.
+threading.Thread: Used to run the metrics endpoint and the snapshot writer in the background.
+threading.Event:  Used to stop the snapshot writer.
+"""
+from threading import Lock, Thread, Event
+
+"""
+json.dumps: Used to write the JSON snapshots.
+"""
+from json import dumps
+
+"""
+os.replace: Used to atomically swap the snapshot file for a newer one so that readers never see half of it.
+"""
+from os import replace
+
+"""
+time.time: Used to timestamp the snapshots.
+"""
+from time import time
+
+"""
+The upper bounds in seconds of the latency histogram buckets, from a quick API call up to a large file download.
+"""
+latencybuckets = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+"""
+The help text of every metric, this also fixes the order that they're written out in.
+"""
+descriptions = {
+    'requests_total': ['counter', 'Requests sent, by endpoint class and HTTP status (error if no response came back).'],
+    'request_seconds': ['histogram', 'Time from sending a request to receiving its response headers, by endpoint class.'],
+    'ratelimit_wait_seconds_total': ['counter', 'Time spent waiting on the rate limit scheduler before sending a request, by endpoint class.'],
+    'ratelimited_total': ['counter', 'HTTP 429 Too Many Requests responses, by endpoint class.'],
+    'retries_total': ['counter', 'Requests that were sent again after a 429 response or a stale connection, by endpoint class.'],
+    'bytes_total': ['counter', 'Response body bytes received, by endpoint class.'],
+    'write_seconds_total': ['counter', 'Time spent writing downloaded bytes to the disk.'],
+    'downloads_total': ['counter', 'Downloads attempted, by result (finished, incomplete, rejected or failed).'],
+    'requests_in_flight': ['gauge', 'Requests that are waiting on their response headers, by endpoint class.'],
+    'downloads_in_flight': ['gauge', 'Files that are downloading right now.'],
+}
+
+class Metrics(object):
+    """
+    A process-wide registry of counters, gauges and latency histograms that describe what the scraper is spending its time on.
+    """
+
+    def __init__(self):
+        """
+        The class constructor.
+        """
+
+        # Create dictionaries that map a metric name to a dictionary of label tuples and their values.
+        self.counters = {}
+        self.gauges = {}
+
+        # Create a dictionary that maps an endpoint class to the [bucket counts, sum, count] list of its request latency histogram.
+        self.histograms = {}
+
+        # Create a dictionary that maps a gauge name to a [help text, function] pair, the function is called whenever the gauge is read (the queue depths).
+        self.callbacks = {}
+
+        # Create a lock to guard the class variables above.
+        self.lock = Lock()
+
+        # Create variables to store the metrics endpoint and the snapshot writer once they're started.
+        self.server = None
+        self.snapshotter = None
+        self.stopping = Event()
+
+    @staticmethod
+    def getEndpoint(url):
+        """
+        Turn a URL into the endpoint class that its metrics are recorded under: search, messages, metadata (guild and channel lookups) or cdn.
+        :param url: The URL that we're sending the request to.
+        """
+
+        # Split the URL into its domain name and path without the query string.
+        urlparts = url.split('?')[0].split('/')
+        domain = urlparts[2].split(':')[0] if len(urlparts) > 2 else ''
+
+        # Everything that isn't the Discord API is a file download.
+        if domain != 'discord.com' or len(urlparts) < 4 or urlparts[3] != 'api':
+            return 'cdn'
+
+        # Tell the search walk apart from the documented messages endpoint.
+        if urlparts[-2:] == ['messages', 'search']:
+            return 'search'
+
+        if 'messages' in urlparts:
+            return 'messages'
+
+        return 'metadata'
+
+    def increment(self, name, labels=(), value=1):
+        """
+        Add to a counter.
+        :param name: The name of the counter.
+        :param labels: A tuple of (label, value) pairs.
+        :param value: The amount to add.
+        """
+
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def adjust(self, name, labels=(), value=1):
+        """
+        Add to (or subtract from) a gauge.
+        :param name: The name of the gauge.
+        :param labels: A tuple of (label, value) pairs.
+        :param value: The amount to add, negative to subtract.
+        """
+
+        with self.lock:
+            series = self.gauges.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, endpoint, seconds):
+        """
+        Record the latency of a request in the histogram of its endpoint class.
+        :param endpoint: The endpoint class of the request.
+        :param seconds: The time from sending the request to receiving its response headers.
+        """
+
+        with self.lock:
+            histogram = self.histograms.get(endpoint)
+
+            if histogram is None:
+                histogram = self.histograms[endpoint] = [[0] * len(latencybuckets), 0.0, 0]
+
+            # Count the request in the first bucket that it fits in, the buckets are made cumulative when they're written out.
+            for index, bound in enumerate(latencybuckets):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+                    break
+
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def addGauge(self, name, description, function):
+        """
+        Register a gauge that is read by calling a function, for values that something else already keeps track of.
+        :param name: The name of the gauge.
+        :param description: The help text of the gauge.
+        :param function: A function that takes no arguments and returns the current value.
+        """
+
+        with self.lock:
+            self.callbacks[name] = [description, function]
+
+    def snapshot(self):
+        """
+        Return every metric as a dictionary that can be serialized to JSON.
+        """
+
+        with self.lock:
+            counters = {name: flattenSeries(series) for name, series in self.counters.items()}
+            gauges = {name: flattenSeries(series) for name, series in self.gauges.items()}
+            histograms = {endpoint: {'buckets': dict(zip([str(bound) for bound in latencybuckets] + ['+Inf'], cumulate(histogram[0], histogram[2]))), 'sum': round(histogram[1], 6), 'count': histogram[2]} for endpoint, histogram in self.histograms.items()}
+            callbacks = list(self.callbacks.items())
+
+        # Read the gauges that are kept by something else outside of the lock.
+        for name, (description, function) in callbacks:
+            gauges[name] = function()
+
+        return {'timestamp': round(time(), 3), 'counters': counters, 'gauges': gauges, 'request_seconds': histograms}
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+
+        # Create an array to store the lines of the output.
+        lines = []
+
+        with self.lock:
+            for name, (kind, description) in descriptions.items():
+                lines.append('# HELP discord_scraper_{0} {1}'.format(name, description))
+                lines.append('# TYPE discord_scraper_{0} {1}'.format(name, kind))
+
+                if kind == 'histogram':
+                    for endpoint, histogram in sorted(self.histograms.items()):
+                        for bound, count in zip([str(bound) for bound in latencybuckets] + ['+Inf'], cumulate(histogram[0], histogram[2])):
+                            lines.append('discord_scraper_{0}_bucket{{endpoint="{1}",le="{2}"}} {3}'.format(name, endpoint, bound, count))
+
+                        lines.append('discord_scraper_{0}_sum{{endpoint="{1}"}} {2}'.format(name, endpoint, histogram[1]))
+                        lines.append('discord_scraper_{0}_count{{endpoint="{1}"}} {2}'.format(name, endpoint, histogram[2]))
+
+                    continue
+
+                series = (self.counters if kind == 'counter' else self.gauges).get(name, {})
+
+                for labels, value in sorted(series.items()):
+                    lines.append('discord_scraper_{0}{1} {2}'.format(name, formatLabels(labels, True), value))
+
+            callbacks = list(self.callbacks.items())
+
+        # Read the gauges that are kept by something else outside of the lock.
+        for name, (description, function) in callbacks:
+            lines.append('# HELP discord_scraper_{0} {1}'.format(name, description))
+            lines.append('# TYPE discord_scraper_{0} gauge'.format(name))
+            lines.append('discord_scraper_{0} {1}'.format(name, function()))
+
+        return '{0}\n'.format('\n'.join(lines))
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve the metrics in the Prometheus text format at http://host:port/metrics from a background thread.
+        :param port: The local port to listen on.
+        :param host: The address to listen on, this defaults to the loopback interface so the metrics aren't exposed to the network.
+        """
+
+        if self.server is not None:
+            return None
+
+        # Give the request handler a reference to this registry.
+        handler = type('MetricsHandler', (MetricsHandler, ), {'metrics': self})
+
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+        # The thread is a daemon so that it never keeps the script alive.
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def writeSnapshot(self, filename):
+        """
+        Write a JSON snapshot of every metric, the file is replaced in one atomic step.
+        :param filename: The full file path to the snapshot file.
+        """
+
+        with open('{0}.tmp'.format(filename), 'w') as snapshotstream:
+            snapshotstream.write(dumps(self.snapshot(), indent=4))
+
+        replace('{0}.tmp'.format(filename), filename)
+
+    def startSnapshots(self, filename, interval=15):
+        """
+        Write a JSON snapshot of every metric every so often from a background thread.
+        :param filename: The full file path to the snapshot file.
+        :param interval: The number of seconds between snapshots.
+        """
+
+        if self.snapshotter is not None:
+            return None
+
+        def work():
+            while not self.stopping.wait(interval):
+                self.writeSnapshot(filename)
+
+        # The thread is a daemon so that it never keeps the script alive.
+        self.snapshotter = Thread(target=work, daemon=True)
+        self.snapshotter.start()
+
+    def stop(self):
+        """
+        Stop the metrics endpoint and the snapshot writer.
+        """
+
+        self.stopping.set()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Answer the scrape requests of Prometheus, the metrics class variable is set by Metrics.serve.
+    """
+
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return None
+
+        body = self.metrics.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the scrape requests out of the progress output.
+        pass
+
+def formatLabels(labels, braces=False):
+    """
+    Turn a tuple of (label, value) pairs into the label string of a metric.
+    :param labels: A tuple of (label, value) pairs.
+    :param braces: Whether the labels are quoted and wrapped in braces for the Prometheus text format, an empty label set gives an empty string either way.
+    """
+
+    if not braces:
+        return ','.join('{0}={1}'.format(label, value) for label, value in labels)
+
+    text = ','.join('{0}="{1}"'.format(label, value) for label, value in labels)
+
+    return '{{{0}}}'.format(text) if text else text
+
+def flattenSeries(series):
+    """
+    Turn the values of a metric into something that reads well in JSON, a metric without labels is just its value.
+    :param series: A dictionary of label tuples and their values.
+    """
+
+    if list(series.keys()) == [()]:
+        return series[()]
+
+    return {formatLabels(labels): value for labels, value in series.items()}
+
+def cumulate(counts, total):
+    """
+    Turn the per-bucket counts of a histogram into the cumulative counts that Prometheus expects, ending with the +Inf bucket.
+    :param counts: The number of observations that landed in each bucket.
+    :param total: The total number of observations.
+    """
+
+    # Create an array to store the cumulative counts.
+    cumulative = []
+    running = 0
+
+    for count in counts:
+        running += count
+        cumulative.append(running)
+
+    return cumulative + [total]
+
+"""
+The process-wide metrics registry.
+"""
+metrics = Metrics()
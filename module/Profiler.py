@@ -0,0 +1,242 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+sys._current_frames: Used to grab the stack of every thread when the sampling profiler takes a sample.
+"""
+from sys import _current_frames
+
+"""
+threading.Lock:      Used to keep the spans and samples consistent when they're recorded from several threads.
+threading.Thread:    Used to run the sampling profiler in the background.
+threading.Event:     Used to stop the sampling profiler.
+threading.enumerate: Used to label every sampled stack with the name of its thread.
+threading.get_ident: Used to leave the sampling thread out of its own samples.
+"""
+from threading import Lock, Thread, Event, enumerate as threads, get_ident
+
+"""
+time.perf_counter: Used to time the spans and the sampling window.
+"""
+from time import perf_counter
+
+"""
+os.path: Used to shorten the file names in the sampled stacks and to combine file paths.
+"""
+from os import path
+
+"""
+json.dumps: Used to write the per-stage breakdown.
+"""
+from json import dumps
+
+class Span(object):
+    """
+    A timing span around one pipeline stage of a channel, used in a with statement.
+    """
+
+    __slots__ = ['profiler', 'stage', 'channel', 'started']
+
+    def __init__(self, profiler, stage, channel):
+        """
+        :param profiler: The profiler that the span is recorded in.
+        :param stage: The name of the pipeline stage.
+        :param channel: The ID for the channel that the work belongs to.
+        """
+        self.profiler = profiler
+        self.stage = stage
+        self.channel = channel
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.profiler.record(self.channel, self.stage, perf_counter() - self.started)
+        return False
+
+class NullSpan(object):
+    """
+    The span that is handed out while profiling is turned off, it does nothing so the pipeline pays next to nothing for its spans.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+"""
+The one span that is shared by every stage while profiling is turned off.
+"""
+nullspan = NullSpan()
+
+class Profiler(object):
+    """
+    An opt-in profiler that times the pipeline stages of every channel and samples the stacks of every thread, for the --profile mode.
+    """
+
+    def __init__(self):
+        """
+        The class constructor.
+        """
+
+        # Spans are only recorded once the profiler has been started.
+        self.enabled = False
+
+        # Create a dictionary that maps a channel ID to a dictionary of stage names and their [calls, seconds] lists.
+        self.stages = {}
+
+        # Create a dictionary that maps a collapsed stack to the number of samples that it showed up in.
+        self.samples = {}
+
+        # Create a lock to guard the class variables above.
+        self.lock = Lock()
+
+        # Create variables to store the sampling thread and the signal that stops it.
+        self.sampler = None
+        self.stopping = Event()
+
+        # Remember whether the report has been written so that it's only written once, and the file name that it's written under.
+        self.finished = False
+        self.name = 'profile'
+
+    def span(self, stage, channel):
+        """
+        Return a timing span for a pipeline stage of a channel, use it in a with statement.
+        :param stage: The name of the pipeline stage (search, cache, filter, enqueue, download or compress).
+        :param channel: The ID for the channel that the work belongs to.
+        """
+        return Span(self, stage, str(channel)) if self.enabled else nullspan
+
+    def record(self, channel, stage, seconds):
+        """
+        Add the time of a finished span to the breakdown of its channel.
+        :param channel: The ID for the channel that the work belongs to.
+        :param stage: The name of the pipeline stage.
+        :param seconds: The wall time that the span took.
+        """
+
+        with self.lock:
+            totals = self.stages.setdefault(channel, {}).setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def start(self, interval=0.01, window=0, name='profile'):
+        """
+        Start recording the spans and sampling the stacks of every thread.
+        :param interval: The number of seconds between samples.
+        :param window: The number of seconds to sample for, 0 samples until the report is written.
+        :param name: The file name of the report without the extension, every shard process writes a report of its own.
+        """
+
+        self.enabled = True
+        self.name = name
+
+        # The thread is a daemon so that it never keeps the script alive.
+        self.sampler = Thread(target=self.sample, args=(interval, window), daemon=True)
+        self.sampler.start()
+
+    def sample(self, interval, window):
+        """
+        The sampling loop, every sample adds one to the count of the current stack of every other thread.
+        :param interval: The number of seconds between samples.
+        :param window: The number of seconds to sample for, 0 samples until the profiler is stopped.
+        """
+
+        # Grab the ID of this thread so that it's left out of the samples.
+        ident = get_ident()
+        deadline = perf_counter() + window if window > 0 else None
+
+        while not self.stopping.wait(interval):
+
+            # Stop once the sampling window has passed.
+            if deadline is not None and perf_counter() > deadline:
+                break
+
+            # Grab the thread names before the frames so that every sampled thread has one.
+            names = {thread.ident: thread.name for thread in threads()}
+            stacks = []
+
+            for threadid, frame in _current_frames().items():
+                if threadid == ident:
+                    continue
+
+                # Walk the stack from the innermost frame out.
+                stack = []
+
+                while frame is not None:
+                    stack.append('{0}:{1}'.format(path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+
+                # The collapsed stack format lists the frames from the outermost one in, starting with the thread.
+                stack.append(names.get(threadid, 'thread-{0}'.format(threadid)))
+                stacks.append(';'.join(reversed(stack)))
+
+            with self.lock:
+                for stack in stacks:
+                    self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def stop(self):
+        """
+        Stop the sampling profiler and wait for it to finish its current sample.
+        """
+
+        self.stopping.set()
+
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+    def getBreakdown(self):
+        """
+        Return the per-stage time breakdown as a dictionary of channel IDs to dictionaries of stage names and their calls and seconds.
+        """
+
+        with self.lock:
+            return {channel: {stage: {'calls': totals[0], 'seconds': round(totals[1], 6)} for stage, totals in sorted(stages.items())} for channel, stages in sorted(self.stages.items())}
+
+    def writeReport(self, directory):
+        """
+        Stop the profiler and write the flamegraph-compatible collapsed stacks to <name>.collapsed and the per-stage breakdown to <name>.json, then print the breakdown.
+        :param directory: The folder to write the report to.
+        """
+
+        # Only write the report once, the script can end through more than one path.
+        with self.lock:
+            if self.finished or not self.enabled:
+                return None
+
+            self.finished = True
+
+        self.stop()
+
+        with self.lock:
+            samples = sorted(self.samples.items())
+
+        # Write one "frame;frame;frame count" line for every stack, this is the input that flamegraph.pl and speedscope take.
+        with open(path.join(directory, '{0}.collapsed'.format(self.name)), 'w') as collapsedstream:
+            for stack, count in samples:
+                collapsedstream.write('{0} {1}\n'.format(stack, count))
+
+        breakdown = self.getBreakdown()
+
+        with open(path.join(directory, '{0}.json'.format(self.name)), 'w') as breakdownstream:
+            breakdownstream.write(dumps(breakdown, indent=4))
+
+        # Print the breakdown for the user to read.
+        print('\n{0:<22} {1:<10} {2:>10} {3:>12}'.format('channel', 'stage', 'calls', 'seconds'))
+
+        for channel, stages in breakdown.items():
+            for stage, totals in stages.items():
+                print('{0:<22} {1:<10} {2:>10} {3:>12.3f}'.format(channel, stage, totals['calls'], totals['seconds']))
+
+        print('Wrote {0} sampled stacks to {1}.collapsed and the stage breakdown to {1}.json.'.format(sum(count for stack, count in samples), self.name))
+
+"""
+The process-wide profiler, it does nothing until it's started.
+"""
+profiler = Profiler()
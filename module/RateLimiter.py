@@ -0,0 +1,291 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+threading.Condition: Used to put requests to sleep until their bucket resets, and wake them up early when a response tells us more.
+"""
+from threading import Condition
+
+"""
+time.monotonic: Used to measure the reset times without being thrown off by changes to the system clock.
+"""
+from time import monotonic
+
+"""
+multiprocessing.managers.BaseManager: Used to host a single rate limiter in a process of its own that every shard process talks to.
+multiprocessing.get_context:          Used to start that process from scratch instead of forking a process full of threads.
+"""
+from multiprocessing.managers import BaseManager
+from multiprocessing import get_context
+
+class RateLimiter(object):
+    """
+    A shared scheduler that learns Discord's rate limit buckets from the response headers and paces requests before they are sent.
+    """
+
+    def __init__(self):
+        """
+        The class constructor.
+        """
+
+        # Create a dictionary that maps a route to the bucket hash that Discord told us it belongs to (None if it isn't rate limited).
+        self.routes = {}
+
+        # Create a dictionary that maps a (bucket hash, major parameter) pair to a [remaining requests, reset time, request limit, window length] list, Discord hands out the same hash for every channel but counts each channel on its own.
+        self.buckets = {}
+
+        # Create a set of routes that have a request in flight before we know which bucket they belong to.
+        self.pending = set()
+
+        # The monotonic time at which the global rate limit lifts.
+        self.globalreset = 0.0
+
+        # Create a condition variable to guard the class variables above and to put waiting requests to sleep.
+        self.condition = Condition()
+
+        # Create a variable to store the proxy of the rate limiter that is shared between processes, every call is handed over to it once it's set.
+        self.remote = None
+
+    def share(self, remote):
+        """
+        Hand every call over to a rate limiter that is shared with other processes, so that the processes never collectively go over Discord's rate limits.
+        :param remote: The proxy of the shared rate limiter (see startSharedLimiter).
+        """
+        self.remote = remote
+
+    @staticmethod
+    def getRoute(url):
+        """
+        Turn a URL into the route that Discord uses to pick a rate limit bucket, the major parameter (the guild or channel ID) is kept while other IDs are not.
+        :param url: The URL that we're sending the request to.
+        """
+
+        # Grab the URL path without the query string.
+        urlpath = url.split('?')[0].split('/')[3:]
+
+        # Drop the "api" and API version portions of the path.
+        if len(urlpath) > 1 and urlpath[0] == 'api':
+            urlpath = urlpath[2:]
+
+        # Create an array to store the route parts.
+        route = []
+
+        # Replace every ID with a placeholder unless it is the major parameter.
+        for index, part in enumerate(urlpath):
+            if part.isdigit() and not (index == 1 and urlpath[0] in ['channels', 'guilds']):
+                route.append('{id}')
+            else:
+                route.append(part)
+
+        # Join the route parts back together.
+        return '/'.join(route)
+
+    @staticmethod
+    def getMajor(route):
+        """
+        Return the major parameter of a route (such as "channels/111"), or an empty string if it doesn't have one.
+        :param route: The route that the request was sent to, see getRoute.
+        """
+
+        # Grab the first two parts of the route.
+        parts = route.split('/')[:2]
+
+        return '/'.join(parts) if len(parts) == 2 and parts[0] in ['channels', 'guilds'] and parts[1].isdigit() else ''
+
+    def getWait(self, route, now):
+        """
+        Return how many seconds a request for the route has to wait before it can be sent, this has to be called while holding the condition.
+        :param route: The route that we want to send a request to.
+        :param now: The current monotonic time.
+        """
+
+        # Wait for the global rate limit to lift.
+        if self.globalreset > now:
+            return self.globalreset - now
+
+        # Wait for the first request to this route to tell us its bucket.
+        if route not in self.routes:
+            return None if route in self.pending else 0.0
+
+        # Grab the bucket hash for this route.
+        bucket = self.routes[route]
+
+        # Don't wait at all if Discord didn't put this route in a bucket.
+        if bucket is None:
+            return 0.0
+
+        # Grab the state of the bucket for the major parameter of this route.
+        remaining, reset = self.buckets[(bucket, RateLimiter.getMajor(route))][:2]
+
+        # Wait for the bucket to reset if we've used it up.
+        if remaining <= 0 and reset > now:
+            return reset - now
+
+        return 0.0
+
+    def acquire(self, url):
+        """
+        Block until a request to the URL can be sent without going over its rate limit, then reserve a spot for it in its bucket.
+        :param url: The URL that we're sending the request to.
+        """
+
+        # Let the shared rate limiter decide if we have one.
+        if self.remote is not None:
+            return self.remote.acquire(url)
+
+        # Grab the route for the URL.
+        route = RateLimiter.getRoute(url)
+
+        with self.condition:
+            while True:
+
+                # Determine how long we have to wait.
+                now = monotonic()
+                wait = self.getWait(route, now)
+
+                # Send the request if we don't have to wait.
+                if wait is not None and wait <= 0:
+                    break
+
+                # Sleep until the bucket resets or until a response wakes us up.
+                self.condition.wait(wait)
+
+            # Mark the route as pending if we don't know its bucket yet.
+            if route not in self.routes:
+                self.pending.add(route)
+                return None
+
+            # Grab the bucket hash for this route.
+            bucket = self.routes[route]
+
+            # Skip the bookkeeping if Discord didn't put this route in a bucket.
+            if bucket is None:
+                return None
+
+            # Grab the state of the bucket for the major parameter of this route.
+            state = self.buckets[(bucket, RateLimiter.getMajor(route))]
+
+            # Refill the bucket if its reset time has passed, the response will correct us if we guessed wrong.
+            if state[1] <= now:
+                state[0] = state[2]
+                state[1] = now + state[3]
+
+            # Use up one request from the bucket.
+            state[0] -= 1
+
+    def update(self, url, response, retryafter=None, isglobal=False):
+        """
+        Learn the rate limit state from the headers of a response and wake up any requests that are waiting on it.
+        :param url: The URL that the request was sent to.
+        :param response: The response object whose headers we want to read.
+        :param retryafter: The number of seconds that a 429 response told us to wait.
+        :param isglobal: A true or false (boolean) value that determines if the 429 response was for the global rate limit.
+        """
+
+        # Grab the rate limit headers, a dictionary of them is all that needs to travel to a shared rate limiter.
+        headers = {name: response.getheader(name) for name in ['X-RateLimit-Bucket', 'X-RateLimit-Remaining', 'X-RateLimit-Reset-After', 'X-RateLimit-Limit', 'X-RateLimit-Global']}
+
+        # Let the shared rate limiter learn from the response if we have one.
+        if self.remote is not None:
+            return self.remote.updateHeaders(url, headers, retryafter, isglobal)
+
+        self.updateHeaders(url, headers, retryafter, isglobal)
+
+    def updateHeaders(self, url, headers, retryafter=None, isglobal=False):
+        """
+        Learn the rate limit state from the rate limit headers of a response and wake up any requests that are waiting on it.
+        :param url: The URL that the request was sent to.
+        :param headers: A dictionary of the X-RateLimit headers of the response, a missing header is None.
+        :param retryafter: The number of seconds that a 429 response told us to wait.
+        :param isglobal: A true or false (boolean) value that determines if the 429 response was for the global rate limit.
+        """
+
+        # Grab the route for the URL.
+        route = RateLimiter.getRoute(url)
+
+        # Grab the rate limit headers.
+        bucket = headers.get('X-RateLimit-Bucket')
+        remaining = headers.get('X-RateLimit-Remaining')
+        resetafter = headers.get('X-RateLimit-Reset-After')
+        limit = headers.get('X-RateLimit-Limit')
+
+        with self.condition:
+            now = monotonic()
+
+            # The route has now been answered, so it's no longer pending.
+            self.pending.discard(route)
+
+            # Put everything on hold if we hit the global rate limit.
+            if isglobal or headers.get('X-RateLimit-Global') is not None:
+                self.globalreset = max(self.globalreset, now + float(retryafter or resetafter or 1.0))
+
+            # Give the route a bucket of its own if Discord told us to back off without naming one.
+            if bucket is None and retryafter is not None:
+                bucket = self.routes.get(route) or route
+
+            # Store the state of the bucket if Discord gave it to us.
+            if bucket is not None:
+                self.routes[route] = bucket
+
+                # Determine how long until the bucket resets, a 429 tells us precisely how long to wait.
+                window = float(retryafter if retryafter is not None else (resetafter or 0.0))
+
+                # Determine the remaining number of requests in the bucket.
+                remaining = 0 if retryafter is not None else int(remaining or 0)
+
+                # Grab the state that we already have for the bucket, it is kept separately for every major parameter.
+                key = (bucket, RateLimiter.getMajor(route))
+                state = self.buckets.get(key)
+
+                # Keep our own count if it's lower and belongs to the same window, responses can arrive out of order while other requests are in flight.
+                if state is not None and abs(state[1] - (now + window)) < 0.5:
+                    remaining = min(remaining, state[0])
+
+                # Store the state of the bucket, a 429 doesn't tell us the usual window length so keep the one we already know.
+                self.buckets[key] = [remaining, now + window, int(limit or 1), state[3] if state is not None and retryafter is not None else window]
+
+            # Remember that the route isn't rate limited if it came back without a bucket.
+            elif route not in self.routes:
+                self.routes[route] = None
+
+            # Wake up every request that is waiting to see if it can go now.
+            self.condition.notify_all()
+
+    def release(self, url):
+        """
+        Forget about a pending route whose request failed without a response, so that the requests waiting on it can carry on.
+        :param url: The URL that the request was sent to.
+        """
+
+        # Let the shared rate limiter know if we have one.
+        if self.remote is not None:
+            return self.remote.release(url)
+
+        with self.condition:
+            self.pending.discard(RateLimiter.getRoute(url))
+            self.condition.notify_all()
+
+class LimiterManager(BaseManager):
+    """
+    The manager process that hosts the rate limiter shared by the shard processes, every shard thread that is waiting on a bucket blocks in a thread of its own in there.
+    """
+
+LimiterManager.register('RateLimiter', RateLimiter, exposed=['acquire', 'updateHeaders', 'release'])
+
+def startSharedLimiter():
+    """
+    Start the manager process and return it along with the proxy of the rate limiter that it hosts, pass the proxy to limiter.share in every shard process.
+    """
+
+    manager = LimiterManager(ctx=get_context('spawn'))
+    manager.start()
+
+    return manager, manager.RateLimiter()
+
+"""
+The process-wide rate limiter that is shared by every DiscordRequest object.
+"""
+limiter = RateLimiter()
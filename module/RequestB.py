@@ -5,9 +5,9 @@
 """
 # [ERROR] Unstructured of proxy problem
 """
-http.client.HTTPSConnection: Used to grab data from sites that use TLS or SSL encryption.
+http.client.HTTPException: Used to catch a pooled keep-alive connection that the server has already closed on us.
 """
-from http.client import HTTPSConnection
+from http.client import HTTPException
 # docs: https://docs.python.org/3/library/http.client.html
 '''
 >>> import http.client
@@ -19,8 +19,37 @@ from http.client import HTTPSConnection
 """
 os.makedirs: Used to create a folder with subfolders.
 os.path:     Used to combine and split file paths.
+os.remove:   Used to throw away a download that came back broken, and the sidecar of a finished one.
+os.replace:  Used to atomically give a finished download its real name.
+os.lseek:    Used to move to the offset of a chunk on systems without os.pwrite.
+os.write:    Used to write a chunk to a file descriptor.
+os.SEEK_SET: Used to seek from the start of the file.
 """
-from os import makedirs, path
+from os import makedirs, path, remove, replace, lseek, write, SEEK_SET
+
+"""
+os.pwrite: Used to write each chunk at its own offset without moving the shared file position, this doesn't exist on Windows.
+"""
+try:
+    from os import pwrite
+except ImportError:
+    pwrite = None
+
+"""
+concurrent.futures.ThreadPoolExecutor: Used to download the chunks of a file at the same time.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+threading.Lock:  Used to guard the file position and the progress counter while chunks are written from several threads.
+threading.local: Used to give every download thread its own reusable read buffer.
+"""
+from threading import Lock, local
+
+"""
+hashlib.sha256: Used to generate the checksum of a file while it downloads.
+"""
+from hashlib import sha256
 
 """
 sys.stderr: Used to write to the standard error filestream.
@@ -28,16 +57,37 @@ sys.stderr: Used to write to the standard error filestream.
 from sys import stderr
 
 """
-time.sleep: Used to pause the script for a set time.
+time.sleep:        Used to pause the script for a set time.
+time.perf_counter: Used to measure the request latencies and disk writes for the metrics.
 """
-from time import sleep
+from time import sleep, perf_counter
 
 """
+json.dumps: Used to convert a dictionary object into a serialized string.
 json.loads: Used to convert a serialized string into a dictionary object.
 """
-from json import loads
+from json import dumps, loads
 
-from globalVars import GlobalVars # to fix proxy problem
+"""
+module.ConnectionPool.pool: The process-wide keep-alive connection pool that every request borrows its connection from.
+"""
+from .ConnectionPool import pool
+
+"""
+module.FileSignatures.sniffMimetype: Used to recognize the real type of a file from its first bytes.
+module.FileSignatures.headersize:    The number of bytes that sniffMimetype needs.
+"""
+from .FileSignatures import sniffMimetype, headersize
+
+"""
+module.RateLimiter.limiter: The process-wide rate limit scheduler that paces every request to the Discord API.
+"""
+from .RateLimiter import limiter
+
+"""
+module.Metrics.metrics: The process-wide metrics registry that records the request counts, latencies, bytes and rate limits.
+"""
+from .Metrics import metrics
 
 def warn(message):
     """
@@ -54,10 +104,11 @@ class DiscordRequest(object):
     """
     def __init__(self): self.headers = {}
     def setHeaders(self, headers): self.headers = headers
-    def sendRequest(self, url):
+    def sendRequest(self, url, retries=3):
         """
         Send a request to the target URL and return the response data.
         :param url: The URL to the target that we're wanting to grab data from.
+        :param retries: The number of times that we retry the request after being rate limited.
         """
         # Split the URL into parts.
         urlparts = url.split('/')
@@ -67,199 +118,692 @@ class DiscordRequest(object):
         urlpath = '/{0}'.format('/'.join(urlparts[3:]))
         
         # Determine if the domain is safe or unsafe.
-        if domain.endswith('.discordapp.net') or domain.endswith('.discord.com') or domain in ['discordapp.net', 'discord.com']:
-            safedomain = True
-
-        # Create a reference to the HTTPSConnection class.
-        if GlobalVars.args.direct:
-            connection = HTTPSConnection(domain, 443)
-        else:
-            connection = HTTPSConnection('localhost', GlobalVars.args.port)
-            connection.set_tunnel(domain)
+        safedomain = domain.endswith('.discordapp.net') or domain.endswith('.discord.com') or domain in ['discordapp.net', 'discord.com']
 
         # Ensure that we're not sending authorization tokens to non-Domain domains.
         if safedomain:
             headers = self.headers
         else:
             headers = {'User-Agent': 'Mozilla/5.0', 'Referer': 'https://discord.com/'}
+
+        # Determine if the request goes to the rate limited Discord API.
+        ratelimited = domain == 'discord.com' and urlpath.startswith('/api/')
+
+        # Grab the endpoint class that the metrics of this request are recorded under.
+        endpoint = metrics.getEndpoint(url)
+        labels = (('endpoint', endpoint), )
+
+        # Wait for the rate limit scheduler to give us the go ahead.
+        if ratelimited:
+            started = perf_counter()
+            limiter.acquire(url)
+            metrics.increment('ratelimit_wait_seconds_total', labels, perf_counter() - started)
+
+        # Keep track of whether the rate limit scheduler has heard back about this request, a route that it never hears back about would hold up every later request to it.
+        answered = False
+
+        try:
+            # Start the clock on the request.
+            metrics.adjust('requests_in_flight', labels)
+            started = perf_counter()
+
+            try:
+                # Send the request over a pooled keep-alive connection.
+                response = self.getResponse(domain, urlpath, headers, labels)
+
+            except Exception:
+                metrics.adjust('requests_in_flight', labels, -1)
+                metrics.increment('requests_total', labels + (('status', 'error'), ))
+                raise
+
+            # Record the request and its latency.
+            metrics.adjust('requests_in_flight', labels, -1)
+            metrics.observe(endpoint, perf_counter() - started)
+            metrics.increment('requests_total', labels + (('status', str(response.status)), ))
+
+            # Count the bytes of the API responses here, the file downloads count theirs as they stream in.
+            if endpoint != 'cdn' and response.getheader('Content-Length'):
+                metrics.increment('bytes_total', labels, int(response.getheader('Content-Length')))
+
+            # Learn the rate limit state from the response headers (429 responses are handled further down).
+            if ratelimited and response.status != 429:
+                limiter.update(url, response)
+                answered = True
+
+            # Return the response if the connection was successful.
+            if 199 < response.status < 300:
+                return response
             
-        # Request the data from the connection.
-        connection.request('GET', urlpath, headers=headers)
+            # Recursively run this function if we hit a redirect page.
+            elif 299 < response.status < 400:
 
-        # Retrieve the response from the request.
-        response = connection.getresponse()
+                # Grab the URL that we're redirecting to.
+                url = response.getheader('Location')
 
-        # TODO: Remove this before releasing
-        for header in response.getheaders():
-            if header[0] == 'Retry-After':
-                print(header)
+                # Read the rest of the redirect page so that its connection goes back into the pool.
+                response.read()
 
-        # Return the response if the connection was successful.
-        if 199 < response.status < 300:
-            return response
-        
-        # Recursively run this function if we hit a redirect page.
-        elif 299 < response.status < 400:
+                # Follow the redirect
+                return self.sendRequest(url)
+            
+            # Otherwise throw a warning message to acknowledge a failed connection.
+            else: warn('HTTP {0} from {1}.'.format(response.status, url))
 
-            # Grab the URL that we're redirecting to.
-            url = response.getheader('Location')
+            # Read the error page so that its connection goes back into the pool.
+            body = response.read()
 
-            # Grab the domain name for the redirected location.
-            domain = url.split('/')[2].split(':')[0]
+            # Handle HTTP 429 Too Many Requests
+            if response.status == 429:
+                metrics.increment('ratelimited_total', labels)
+                retry_after, isglobal = DiscordRequest.getRetryAfter(response, body)
 
-            # Follow the redirect
-            self.sendRequest(url)
-        
-        # Otherwise throw a warning message to acknowledge a failed connection.
-        else: warn('HTTP {0} from {1}.'.format(response.status, url))
+                # Tell the rate limit scheduler how long to hold off, it will put the retry to sleep for us.
+                if ratelimited:
+                    limiter.update(url, response, retry_after, isglobal)
+                    answered = True
+
+                # Otherwise sleep for 1 extra second as buffer.
+                elif retry_after:
+                    sleep(1 + retry_after)
 
-        # Handle HTTP 429 Too Many Requests
-        if response.status == 429:
-            retry_after = loads(response.read()).get('retry_after', None)
+                if retry_after and retries > 0:
+                    metrics.increment('retries_total', labels)
+                    return self.sendRequest(url, retries - 1)
 
-            if retry_after:   
-                # Sleep for 1 extra second as buffer
-                sleep(1 + retry_after)
-                return sendRequest(self, url)
+        finally:
+            # Let the requests that are waiting on this route carry on if we never got to tell the scheduler about it.
+            if ratelimited and not answered:
+                limiter.release(url)
 
         # Return nothing to signify a failed request.
         return None
+
+    @staticmethod
+    def getRetryAfter(response, body):
+        """
+        Return the number of seconds that a 429 response told us to wait (None if it didn't say) and whether it was for the global rate limit.
+        The body is only JSON when Discord itself answered, a proxy or Cloudflare answers with an HTML page, so the Retry-After header is the fallback.
+        :param response: The 429 response.
+        :param body: The body of the response.
+        """
+
+        try:
+            data = loads(body)
+
+        except ValueError:
+            data = None
+
+        # Only trust a JSON object.
+        if not isinstance(data, dict):
+            data = {}
+
+        retry_after = data.get('retry_after')
+
+        # Fall back on the Retry-After header, which holds a number of seconds (an HTTP date is ignored).
+        if retry_after is None:
+            retry_after = response.getheader('Retry-After')
+
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+
+        except ValueError:
+            retry_after = None
+
+        return retry_after, bool(data.get('global', False))
+
+    def getResponse(self, domain, urlpath, headers, labels=()):
+        """
+        Send a GET request over a pooled connection and return the response, retrying once on a fresh connection if the pooled one went stale.
+        :param domain: The domain name that we're sending the request to.
+        :param urlpath: The path (and query) portion of the URL.
+        :param headers: The request headers that we want to send.
+        :param labels: The metric labels of the request, a retry on a fresh connection is counted under them.
+        """
+
+        # Try the pooled connection first and a brand new one second.
+        for attempt in range(2):
+
+            # Borrow a connection from the pool.
+            connection = pool.getConnection(domain, fresh=attempt > 0)
+
+            try:
+                # Request the data from the connection.
+                connection.request('GET', urlpath, headers=headers)
+
+                # Retrieve the response from the request.
+                response = connection.getresponse()
+
+            except (HTTPException, ConnectionError):
+                # The server closed the keep-alive connection while it sat idle, throw it away.
+                pool.discardConnection(domain, connection)
+
+                # Give up if a brand new connection failed as well.
+                if attempt > 0:
+                    raise
+
+                metrics.increment('retries_total', labels)
+                continue
+
+            except Exception:
+                # Throw away the connection since it's in an unknown state.
+                pool.discardConnection(domain, connection)
+                raise
+
+            # Tie the response to the connection so that the connection is reused once the response has been read.
+            pool.setResponse(domain, connection, response)
+            return response
     
-    def downloadFile(self, url, filename, buffer=0): # [ERROR] Unstructured of proxy problem
+    def downloadFile(self, url, filename, buffer=0, segments=1, checksum=False, validate=None): # [ERROR] Unstructured of proxy problem
+        """
+        Download the file to the correct location on our storage device, returning True once the file is finished (see transferFile), and record the outcome in the metrics.
+        :param url: The URL for the file that we're wanting to download.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        :param buffer: The buffer size in bytes that we want to use to download our file in chunks.
+        :param segments: The number of chunks that we download at the same time.
+        :param checksum: A true or false (boolean) value that determines if the SHA-256 checksum of the finished file is stored in self.checksum.
+        :param validate: A function that is given the mimetype sniffed from the first bytes of the file (None if it isn't recognized) and returns False to abort the download.
+        """
+
+        metrics.adjust('downloads_in_flight')
+
+        try:
+            finished = self.transferFile(url, filename, buffer, segments, checksum, validate)
+
+        except Exception:
+            metrics.increment('downloads_total', (('result', 'failed'), ))
+            raise
+
+        finally:
+            metrics.adjust('downloads_in_flight', (), -1)
+
+        # Record whether the file is finished, was turned away for its type, or is still waiting on the next attempt.
+        metrics.increment('downloads_total', (('result', 'finished' if finished else 'rejected' if self.rejected else 'incomplete'), ))
+
+        return finished
+
+    def transferFile(self, url, filename, buffer=0, segments=1, checksum=False, validate=None):
         """
         Download the file to the correct location on our storage device.
+        The file is downloaded to "<filename>.part" alongside a "<filename>.part.json" sidecar that records the progress, an interrupted download picks up from there with a Range request and the file only gets its real name once its length has been verified.
+        The caller decides if the file is needed, an existing file with the same name is replaced.
         :param url: The URL for the file that we're wanting to download.
         :param filename: The full file path to where we are wanting to store the downloaded file.
         :param buffer: The buffer size in bytes that we want to use to download our file in chunks.
+        :param segments: The number of chunks that we download at the same time.
+        :param checksum: A true or false (boolean) value that determines if the SHA-256 checksum of the finished file is stored in self.checksum.
+        :param validate: A function that is given the mimetype sniffed from the first bytes of the file (None if it isn't recognized) and returns False to abort the download.
         """
 
+        # Create a variable to store the checksum of the finished file.
+        self.checksum = None
+
+        # Create variables to store the sniffed mimetype of the file and whether the download was aborted because of it.
+        self.mimetype = None
+        self.rejected = False
+
+        # Create a variable to remember if the server answered a Range request with the whole file.
+        self.rangesignored = False
+
         # Grab the folder path from the full file name.
         filepath = path.split(filename)[0]
 
         # Determine if the file path exists, if not then create it.
         if not path.exists(filepath):
             makedirs(filepath)
-        
-        # Determine if the file already exists, if so then skip this function.
-        if path.isfile(filename):
+
+        # Generate the file names for the partial download and its sidecar.
+        partname = '{0}.part'.format(filename)
+        sidecar = '{0}.part.json'.format(filename)
+
+        # Load the progress of an interrupted download of this file.
+        state = DiscordRequest.loadSidecar(sidecar, url) if path.isfile(partname) else None
+
+        # Start a brand new download if there's nothing to resume.
+        if state is None:
+
+            # Ask for just the first chunk if the file may be fetched in chunks, a server that does ranges tells us the size of the whole file in its answer and the first chunk is already on its way then.
+            request = self
+
+            if buffer > 0:
+                request = DiscordRequest()
+                request.setHeaders(dict(self.headers, Range='bytes=0-{0}'.format(buffer - 1)))
+
+            # Request the response data from the URL.
+            response = request.sendRequest(url)
+
+            # Determine if the request data is not empty, if so then skip this function.
+            if response is None:
+                return None
+
+            try:
+                # Determine if the server answered with the first chunk instead of the whole file.
+                ranged = response.status == 206
+
+                # Get the file size in bytes, a partial response has the size of the whole file after the slash of its Content-Range header.
+                filesize = int(response.getheader('Content-Range').split('/')[-1]) if ranged else int(response.getheader('Content-Length'))
+
+                # Sniff the real type of the file from the first bytes of the response without consuming them, and hang up straight away if we don't want it.
+                if validate is not None:
+                    self.mimetype = sniffMimetype(response.peek(headersize)[:headersize])
+
+                    if not validate(self.mimetype):
+                        pool.discardResponse(response)
+                        self.rejected = True
+                        return None
+
+                # Determine if we grab the rest of the file in chunks, we can't if the server doesn't do ranges or if the file fits in the first chunk.
+                chunked = ranged and filesize > buffer
+
+                # Record the download in the sidecar before writing anything, the chunk size is kept so that a resume splits the file the same way.
+                state = {'url': url, 'size': filesize, 'ranges': ranged or response.getheader('Accept-Ranges') == 'bytes', 'chunked': chunked, 'buffer': buffer, 'chunks': []}
+                DiscordRequest.saveSidecar(sidecar, state)
+
+                with open(partname, 'wb') as filestream:
+
+                    # Stream the whole file into the partial download.
+                    if not chunked:
+
+                        # Print something out for the user to read.
+                        print('\rDownloading {0}...'.format(' ' * 7), end='')
+
+                        # Create the hash that the file is fed through as it streams in, so it never has to be read back.
+                        digest = sha256() if checksum else None
+
+                        # Stream the contents of the file straight to the disk instead of holding all of it in memory.
+                        streamResponse(response, filestream.fileno(), 0, digest)
+
+                    # Otherwise preallocate the partial download to the full file size so that every chunk can be written at its own offset, and write the first chunk where it belongs.
+                    else:
+                        filestream.truncate(filesize)
+                        written = streamResponse(response, filestream.fileno(), 0)
+
+            except Exception:
+
+                # Throw away the connection if anything went wrong before the response was read to the end, the pool would otherwise hand out a connection that is still holding the rest of it.
+                pool.discardResponse(response)
+                raise
+
+            # Give the file its real name once the whole of it has streamed in.
+            if not chunked:
+                return self.finishDownload(url, filename, state, digest, checksum)
+
+            # Record the first chunk if all of it came back, the rest of the chunks are fetched below.
+            if written == buffer:
+                state['chunks'].append(0)
+                DiscordRequest.saveSidecar(sidecar, state)
+
+        # Resume a whole file download from the end of the partial download.
+        elif not state['chunked']:
+
+            # Start over if the server can't pick up where we left off.
+            if not state['ranges']:
+                DiscordRequest.removeDownload(filename)
+                return self.transferFile(url, filename, buffer, segments, checksum, validate)
+
+            # Grab the number of bytes that we already have.
+            offset = path.getsize(partname)
+
+            # Create a variable to store the amount of bytes that we've already downloaded thus far.
+            self.downloaded = offset
+
+            # Sniff the first bytes that we already have before fetching the rest, the same check as a brand new download gets.
+            checked = validate is None
+
+            if not checked and offset >= min(headersize, state['size']):
+                if not self.checkPart(filename, validate):
+                    return None
+
+                checked = True
+
+            # Fetch the rest of the file if there's anything left.
+            if offset < state['size']:
+                with open(partname, 'r+b') as filestream:
+
+                    # Print something out for the user to read.
+                    print('\rResuming {0}...'.format(' ' * 7), end='')
+
+                    # Stream the rest of the file onto the end of the partial download.
+                    self.downloadChunk(url, filestream.fileno(), [offset, state['size'] - 1], state['size'])
+
+            # Start over with a single request if the server sent the whole file instead of the rest of it, it would never finish otherwise.
+            if self.rangesignored:
+                return self.restartDownload(url, filename, segments, checksum, validate)
+
+            # Sniff the first bytes now if the partial download was too short for it before.
+            if not checked and not self.checkPart(filename, validate):
+                return None
+
+            return self.finishDownload(url, filename, state, None, checksum)
+
+        # Get the file size and the chunk size in bytes.
+        filesize = state['size']
+        buffer = state['buffer']
+
+        # Generate the [start, end] byte positions for every chunk that we don't have yet, the end position is included.
+        chunks = [[start, min(start + buffer, filesize) - 1] for start in range(0, filesize, buffer) if start not in state['chunks']]
+
+        # Create a variable to store the amount of bytes that we've already downloaded thus far.
+        self.downloaded = filesize - sum(chunk[1] - chunk[0] + 1 for chunk in chunks)
+
+        # Sniff the first bytes before fetching the rest if we already have the first chunk, the same check as a brand new download gets.
+        checked = validate is None
+
+        if not checked and 0 in state['chunks']:
+            if not self.checkPart(filename, validate):
+                return None
+
+            checked = True
+
+        # Open the partial download for writing each chunk at its own offset.
+        with open(partname, 'r+b') as filestream:
+
+            # Fetch the chunks at the same time over pooled connections, and record each one in the sidecar as it finishes.
+            with ThreadPoolExecutor(max_workers=max(1, min(segments, len(chunks)))) as executor:
+                list(executor.map(lambda chunk: self.downloadChunk(url, filestream.fileno(), chunk, filesize, sidecar, state), chunks))
+
+        # Start over with a single request if the server sent the whole file instead of a chunk, it would never finish otherwise.
+        if self.rangesignored:
+            return self.restartDownload(url, filename, segments, checksum, validate)
+
+        # Sniff the first bytes now if the first chunk has only just come back.
+        if not checked and 0 in state['chunks'] and not self.checkPart(filename, validate):
             return None
 
-        # Request the response data from the URL.
-        response = self.sendRequest(url)
+        # Give the file its real name if every chunk came back.
+        return self.finishDownload(url, filename, state, None, checksum)
 
-        # Determine if the request data is not empty, if so then skip this function.
-        if response is None:
+    def restartDownload(self, url, filename, segments=1, checksum=False, validate=None):
+        """
+        Throw away the partial download of a file whose server doesn't honour Range requests and download the whole file again in a single request.
+        :param url: The URL for the file that we're wanting to download.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        :param segments: The number of chunks that we download at the same time.
+        :param checksum: A true or false (boolean) value that determines if the SHA-256 checksum of the finished file is stored in self.checksum.
+        :param validate: A function that is given the mimetype sniffed from the first bytes of the file (None if it isn't recognized) and returns False to abort the download.
+        """
+
+        warn('The server sent the whole of {0} instead of a range, downloading it again from the start.'.format(url))
+        DiscordRequest.removeDownload(filename)
+
+        # A buffer of 0 streams the whole file in one go, so this can't end up here again.
+        return self.transferFile(url, filename, 0, segments, checksum, validate)
+
+    def checkPart(self, filename, validate):
+        """
+        Sniff the real type of a partial download from its first bytes and throw the download away if we don't want it, returning False if it was thrown away.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        :param validate: A function that is given the mimetype sniffed from the first bytes of the file (None if it isn't recognized) and returns False to abort the download.
+        """
+
+        # Read the first bytes of the partial download.
+        with open('{0}.part'.format(filename), 'rb') as partstream:
+            self.mimetype = sniffMimetype(partstream.read(headersize))
+
+        # Remove the partial download and its sidecar if it isn't a type that we want.
+        if not validate(self.mimetype):
+            DiscordRequest.removeDownload(filename)
+            self.rejected = True
+            return False
+
+        return True
+
+    def finishDownload(self, url, filename, state, digest=None, checksum=False):
+        """
+        Verify the length of a partial download and atomically give it its real name, returning True if the file is finished.
+        :param url: The URL for the file that we're downloading.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        :param state: The progress dictionary that is stored in the sidecar.
+        :param digest: The hash that the whole file was fed through while it streamed in, if there is one.
+        :param checksum: A true or false (boolean) value that determines if the SHA-256 checksum of the finished file is stored in self.checksum.
+        """
+
+        # Grab the file names for the partial download and its sidecar.
+        partname = '{0}.part'.format(filename)
+        sidecar = '{0}.part.json'.format(filename)
+
+        # Determine if every chunk has come back, the partial download was preallocated so its length alone doesn't tell us.
+        if state['chunked'] and len(state['chunks']) < (state['size'] + state['buffer'] - 1) // state['buffer']:
+            warn('Incomplete download of {0}, it will be resumed on the next run.'.format(url))
             return None
-        
-        # Get the file size in bytes.
-        filesize = int(response.getheader('Content-Length'))
-        
-        # Create a variable to store the amount of bytes that we've already downloaded thus far.
-        downloaded = 0
 
-        # Determine how many chunks we can feasibly push with our filesize.
-        numchunks = int(filesize / buffer)
+        # Grab the number of bytes in the partial download.
+        filesize = path.getsize(partname)
 
-        # Determine how much of the last chunk is needed to finish the download.
-        lastchunk = filesize % buffer
+        # Keep a short download around so that the next run can resume it.
+        if filesize < state['size']:
+            warn('Incomplete download of {0} ({1} of {2} bytes), it will be resumed on the next run.'.format(url, filesize, state['size']))
+            return None
 
-        # Open the new file for appending bytes to.
-        with open(filename, 'a+b') as filestream:
+        # Throw away a download that came back longer than the server said it would, it can't be trusted.
+        if filesize > state['size']:
+            warn('Download of {0} is larger than expected ({1} of {2} bytes), discarding it.'.format(url, filesize, state['size']))
+            DiscordRequest.removeDownload(filename)
+            return None
 
-            # Determine if we can grab the file byte-by-byte or if our buffer is 0 or larger than our file size.
-            if response.getheader('Accept-Ranges') != 'bytes' or buffer <= 0 or numchunks < 1:
+        # Store the checksum of the file, ranged and resumed downloads arrive out of order so those are hashed in a single pass once they're finished.
+        if checksum:
+            self.checksum = (digest if digest is not None else hashFile(partname)).hexdigest()
 
-                # Print something out for the user to read.
-                print('\rDownloading {0}...'.format(' ' * 7), end='')
+        # Give the finished file its real name in one atomic step, then forget about its progress.
+        replace(partname, filename)
+        remove(sidecar)
 
-                # Just simply write the full contents of the file instead of streaming it in chunks.
-                filestream.write(response.read())
+        return True
 
-                # Close the file stream.
-                filestream.close()
+    @staticmethod
+    def removeDownload(filename):
+        """
+        Throw away the partial download of a file and its sidecar.
+        :param filename: The full file path to where we are wanting to store the downloaded file.
+        """
 
-                # Continue the script.
-                return None
-            
-            # Iterate through each chunk of the file until we hit the filesize limit.
-            for i in range(numchunks):
+        for leftover in ['{0}.part'.format(filename), '{0}.part.json'.format(filename)]:
+            if path.isfile(leftover):
+                remove(leftover)
 
-                # Generate another request class.
-                request = DiscordRequest()
+    @staticmethod
+    def loadSidecar(sidecar, url):
+        """
+        Load the progress of an interrupted download from its sidecar, or return None if there isn't one that we can trust.
+        :param sidecar: The full file path to the sidecar.
+        :param url: The URL for the file that we're downloading, a sidecar for a different URL is ignored.
+        """
 
-                # Grab the current request headers.
-                headers = self.headers
+        try:
+            with open(sidecar, 'r') as sidestream:
+                state = loads(sidestream.read())
 
-                # Create a variable to store the byte position for the end of the chunk.
-                chunk = downloaded + buffer - 1
+        except (OSError, ValueError):
+            return None
 
-                # Update the headers to include the chunk depending on how close we are to finishing the download.
-                headers.update({'Range': 'bytes={0}-{1}'.format(downloaded, chunk)})
+        # Ignore a sidecar that belongs to a different URL.
+        if not isinstance(state, dict) or state.get('url') != url:
+            return None
 
-                # Set the percentage to the current downloaded percent.
-                percentage = 100 * downloaded / filesize
-                
-                # Set the headers for the new Request object.
-                request.setHeaders(headers)
+        return state
 
-                # Grab the data response from the new Request object.
-                response = request.sendRequest(url)
+    @staticmethod
+    def saveSidecar(sidecar, state):
+        """
+        Store the progress of a download in its sidecar, the sidecar is replaced in one atomic step so a crash never leaves half of it behind.
+        :param sidecar: The full file path to the sidecar.
+        :param state: The progress dictionary that we want to store.
+        """
 
-                # If the response is empty then break free from this loop.
-                if response is None:
+        with open('{0}.tmp'.format(sidecar), 'w') as sidestream:
+            sidestream.write(dumps(state))
 
-                    # Close the file
-                    filestream.close()
+        replace('{0}.tmp'.format(sidecar), sidecar)
 
-                    # Break free
-                    return None
+    def downloadChunk(self, url, fileno, chunk, filesize, sidecar=None, state=None):
+        """
+        Download a single chunk of a file with a Range request and write it at its offset in the file, returning the number of bytes written.
+        :param url: The URL for the file that we're wanting to download.
+        :param fileno: The file descriptor of the preallocated file.
+        :param chunk: The [start, end] byte positions of the chunk, the end position is included.
+        :param filesize: The full size of the file in bytes.
+        :param sidecar: The full file path to the sidecar that the finished chunk is recorded in.
+        :param state: The progress dictionary that is stored in the sidecar.
+        """
 
-                # Print something out to the user.
-                print('\rDownloading {0:3.2f}%...'.format(percentage), end='')
-                
-                # Write the contents of the chunk to the file.
-                filestream.write(response.read())
+        # Generate another request class with its own copy of the headers, the Range header must not leak into other requests.
+        request = DiscordRequest()
+        request.setHeaders(dict(self.headers, Range='bytes={0}-{1}'.format(chunk[0], chunk[1])))
 
-                # Update the downloaded variable to reflect the current filesize.
-                downloaded += buffer
-            
-            if lastchunk > 0:
+        # Grab the data response from the new Request object.
+        response = request.sendRequest(url)
 
-                # Generate another request class.
-                request = DiscordRequest()
+        # If the response is empty then nothing was written.
+        if response is None:
+            return 0
 
-                # Grab the current request headers.
-                headers = self.headers
+        # Throw the chunk away if the server sent the whole file instead of the range, the download has to start over then.
+        if response.status == 200:
+            pool.discardResponse(response)
+            self.rangesignored = True
+            return 0
 
-                # Update the headers.
-                headers.update({'Range': 'bytes={0}-'.format(downloaded)})
+        # Throw the chunk away if the server didn't give us the range that we asked for.
+        if response.status != 206:
+            pool.discardResponse(response)
+            return 0
 
-                # Set the percentage to 100% at this point.
-                percentage = 100.0
+        # Stream the contents of the chunk straight to its offset in the file.
+        written = streamResponse(response, fileno, chunk[0])
 
-                # Set the headers for the new Request object.
-                request.setHeaders(headers)
+        # Throw the chunk away if it came back short.
+        if written != chunk[1] - chunk[0] + 1:
+            return 0
 
-                # Grab the data response from the new Request object.
-                response = request.sendRequest(url)
+        # Print something out to the user.
+        with writelock:
 
-                # If the response is empty then break free from this loop.
-                if response is None:
+            # Record the finished chunk so that an interrupted download doesn't fetch it again.
+            if state is not None:
+                state['chunks'].append(chunk[0])
+                DiscordRequest.saveSidecar(sidecar, state)
 
-                    # Close the file
-                    filestream.close()
+            self.downloaded += written
+            print('\rDownloading {0:3.2f}%...'.format(100.0 * self.downloaded / filesize), end='')
 
-                    # Break free
-                    return None
+        return written
 
-                # Print something out to the user.
-                print('\rDownloading {0:3.2f}%...'.format(percentage), end='')
-                
-                # Write the contents of the chunk to the file.
-                filestream.write(response.read())
-            
-            # Close the file stream.
-            filestream.close()
+"""
+A lock that guards the seek and write pair on systems without os.pwrite, and the progress counter of each download.
+"""
+writelock = Lock()
+
+"""
+The size of the buffer that every thread reads the response data into before it's written to the disk, this is all the memory that a download needs.
+"""
+streambuffersize = 65536
+
+"""
+The reusable read buffer of each thread.
+"""
+streambuffers = local()
+
+def streamResponse(response, fileno, offset, digest=None):
+    """
+    Stream a response body into a file at an offset through a reusable buffer and return the number of bytes written.
+    :param response: The response object that we're reading from.
+    :param fileno: The file descriptor to write to.
+    :param offset: The byte position in the file where the response body starts.
+    :param digest: A hash object that every piece of the body is fed through as it's written.
+    """
+
+    # Grab the read buffer of this thread.
+    view = getStreamBuffer()
+
+    # Create a variable to store the number of bytes written so far.
+    written = 0
+
+    try:
+        while True:
+
+            # Read the next piece of the body straight into the buffer.
+            length = response.readinto(view)
+
+            # Stop once the body has been read to the end.
+            if not length:
+                break
+
+            # Write the piece at its offset in the file, timing the write so that a slow disk shows up in the metrics.
+            started = perf_counter()
+            writeAt(fileno, view[:length], offset + written)
+            metrics.increment('write_seconds_total', (), perf_counter() - started)
+            metrics.increment('bytes_total', (('endpoint', 'cdn'), ), length)
+            written += length
+
+            # Feed the piece through the hash.
+            if digest is not None:
+                digest.update(view[:length])
+
+    except Exception:
+
+        # Throw away the connection if the stream broke off (a read timed out or the disk is full), the rest of the body is still waiting on it.
+        pool.discardResponse(response)
+        raise
+
+    return written
+
+def getStreamBuffer():
+    """
+    Return the reusable read buffer of this thread, creating it on the first call.
+    """
+
+    view = getattr(streambuffers, 'view', None)
+
+    if view is None:
+        view = streambuffers.view = memoryview(bytearray(streambuffersize))
+
+    return view
+
+def hashFile(filename):
+    """
+    Feed a file through a SHA-256 hash with the reusable buffer of this thread and return the hash object.
+    :param filename: The full file path to the file that we want to hash.
+    """
+
+    # Create the hash and grab the read buffer of this thread.
+    digest = sha256()
+    view = getStreamBuffer()
+
+    with open(filename, 'rb') as filestream:
+        while True:
+
+            # Read the next piece of the file straight into the buffer.
+            length = filestream.readinto(view)
+
+            # Stop once the file has been read to the end.
+            if not length:
+                break
+
+            digest.update(view[:length])
+
+    return digest
+
+def writeAt(fileno, data, offset):
+    """
+    Write data at an offset in a file without disturbing the other threads that are writing to the same file.
+    :param fileno: The file descriptor to write to.
+    :param data: The bytes that we want to write.
+    :param offset: The byte position in the file to write at.
+    """
+
+    # Create a view of the data so that partial writes don't copy it.
+    view = memoryview(data).cast('B')
+
+    # Use os.pwrite where it's available since it doesn't move the shared file position.
+    if pwrite is not None:
+        while len(view) > 0:
+            written = pwrite(fileno, view, offset)
+            view = view[written:]
+            offset += written
+        return None
 
-            # Reset the downloaded variable.
-            del self.headers['Range']
+    # Otherwise seek and write while holding the lock (Windows doesn't have os.pwrite).
+    with writelock:
+        lseek(fileno, offset, SEEK_SET)
+        while len(view) > 0:
+            view = view[write(fileno, view):]
@@ -0,0 +1,116 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+module.Checkpoint.Checkpoint: Used to step over the snowflake ranges that a previous run already fetched.
+"""
+from .Checkpoint import Checkpoint
+
+class SearchPlanner(object):
+    """
+    Plan the snowflake windows for the search walk of a channel, starting with large windows that shrink when they hold too many results and grow again over quiet stretches.
+    """
+
+    # The number of results that the search endpoint returns for each page.
+    pagesize = 25
+
+    # The largest number of results that we're willing to page through for a single window, Discord refuses offsets past 5000.
+    pagecap = 5000
+
+    # The window length that we start with, 30 days worth of snowflakes.
+    initialspan = (30 * 86400 * 1000) << 22
+
+    # The smallest window length that we'll shrink to, a single second worth of snowflakes.
+    minimumspan = 1000 << 22
+
+    def __init__(self, minsnow, maxsnow, span=None, completed=None):
+        """
+        :param minsnow: The oldest snowflake that we want to search, this should be the channel ID since no message can be older than its channel.
+        :param maxsnow: The newest snowflake that we want to search, usually the ID of the last message in the channel.
+        :param span: The window length (in snowflake units) that we want to start with.
+        :param completed: The [oldest, newest] snowflake ranges that a previous run already fetched (newest first), the walk steps over these.
+        """
+        if span is None: span = SearchPlanner.initialspan
+        if completed is None: completed = []
+
+        # Store the bounds of the walk, windows are inclusive on both ends.
+        self.minsnow = int(minsnow)
+        self.maxsnow = int(maxsnow)
+
+        # Store the current window length.
+        self.span = span
+
+        # Store the ranges that we can step over.
+        self.completed = completed
+
+        # Step over the ranges that were already fetched.
+        self.maxsnow = Checkpoint.skipCompleted(self.completed, self.maxsnow)
+
+        # The number of windows that we've finished so far.
+        self.windows = 0
+
+    def finished(self):
+        """
+        Determine if we've walked all the way back to the oldest snowflake.
+        """
+        return self.maxsnow < self.minsnow
+
+    def nextWindow(self):
+        """
+        Return the [oldest, newest] snowflakes for the window that we should search next.
+        """
+
+        # Grab the oldest snowflake of the window.
+        minsnow = max(self.maxsnow - self.span + 1, self.minsnow)
+
+        # Stop the window right above the newest range below it that was already fetched.
+        for completed in self.completed:
+            if completed[1] < self.maxsnow:
+                minsnow = max(minsnow, completed[1] + 1)
+                break
+
+        return [minsnow, self.maxsnow]
+
+    def report(self, window, total):
+        """
+        Report the number of search results for a window, this returns True if the window should be paged through and False if it was split and should be searched again.
+        :param window: The [oldest, newest] snowflakes for the window that we searched.
+        :param total: The total_results value that the search returned for the window.
+        """
+
+        # Split the window in half if it holds more results than we can page through.
+        if total > SearchPlanner.pagecap and self.span > SearchPlanner.minimumspan:
+            self.span = max(self.span // 2, SearchPlanner.minimumspan)
+            return False
+
+        # Move on to the window right before this one.
+        self.maxsnow = Checkpoint.skipCompleted(self.completed, window[0] - 1)
+        self.windows += 1
+
+        # Grow the window over quiet stretches so that empty months cost a single request between them.
+        if total == 0:
+            self.span *= 4
+        elif total < SearchPlanner.pagecap // 4:
+            self.span *= 2
+
+        return True
+
+    def skip(self, window):
+        """
+        Move on from a window that failed without changing the window length.
+        :param window: The [oldest, newest] snowflakes for the window that we're skipping.
+        """
+        self.maxsnow = Checkpoint.skipCompleted(self.completed, window[0] - 1)
+
+    @staticmethod
+    def getPageCount(total):
+        """
+        Return the number of search pages that we need to fetch for the total number of results.
+        :param total: The total_results value that the search returned.
+        """
+
+        # Round up to the nearest page.
+        return (min(total, SearchPlanner.pagecap) + SearchPlanner.pagesize - 1) // SearchPlanner.pagesize
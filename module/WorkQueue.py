@@ -0,0 +1,234 @@
+"""
+@author:  Dracovian
+@date:    2021-02-10
+@license: WTFPL
+"""
+
+"""
+sqlite3.connect: Used to open the work queue, an SQLite file on storage that every host can reach.
+"""
+from sqlite3 import connect
+
+"""
+threading.Lock:   Used to share a single database connection between the scraper and its heartbeat thread.
+threading.Thread: Used to renew a lease in the background while its unit is being scraped.
+threading.Event:  Used to stop the heartbeat once the unit is finished.
+"""
+from threading import Lock, Thread, Event
+
+"""
+time.time: Used to timestamp the leases, every host compares them against its own clock so the clocks of the hosts have to be kept in sync (NTP).
+"""
+from time import time
+
+"""
+sys.stderr: Used to write to the standard error filestream.
+"""
+from sys import stderr
+
+def warn(message):
+    """
+    Throw a warning message without halting the script.
+    :param message: A string that will be printed out to STDERR.
+    """
+
+    # Append our message with a newline character.
+    stderr.write('[WARN] {0}\n'.format(message))
+
+class WorkQueue(object):
+    """
+    A queue of (guild, channel, snowflake range) units in an SQLite file that workers on several hosts lease, renew and mark done, a lease that isn't renewed in time goes back to the queue.
+    Only one unit of a channel is leased at a time, so the workers spread over the channels rather than over the units of a single channel.
+    """
+
+    def __init__(self, filename, leaseseconds=300, maxattempts=5):
+        """
+        :param filename: The full file path to the SQLite file that stores the queue.
+        :param leaseseconds: The number of seconds that a lease lasts unless its worker renews it.
+        :param maxattempts: The number of leases that a unit gets before it's marked as failed.
+        """
+
+        # Store the settings.
+        self.leaseseconds = leaseseconds
+        self.maxattempts = maxattempts
+
+        # Open the database in autocommit mode so that we decide where every transaction starts, the connection is shared between threads so we guard it ourselves.
+        self.connection = connect(filename, timeout=60, isolation_level=None, check_same_thread=False)
+
+        # Create a lock to guard the connection.
+        self.lock = Lock()
+
+        with self.lock:
+            # Stay on the rollback journal, write ahead logging needs shared memory and doesn't work on network file systems.
+            self.connection.execute('PRAGMA journal_mode = DELETE')
+
+            # Create the table of units, a unit is queued, leased, done or failed.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY, guild TEXT NOT NULL, channel TEXT NOT NULL, minsnow INTEGER NOT NULL, maxsnow INTEGER NOT NULL, state TEXT NOT NULL DEFAULT \'queued\', owner TEXT, expires REAL, attempts INTEGER NOT NULL DEFAULT 0, finished REAL, UNIQUE (channel, minsnow, maxsnow))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS units_state ON units (state, expires)')
+
+    def enqueue(self, guild, channel, minsnow, maxsnow):
+        """
+        Add a unit to the queue, returning True if anything was added. The part of the unit that earlier units starting inside it already cover is left out, so queueing a channel again only adds the messages posted since.
+        :param guild: The ID for the guild.
+        :param channel: The ID for the channel.
+        :param minsnow: The oldest snowflake of the unit.
+        :param maxsnow: The newest snowflake of the unit.
+        """
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                # Grab the newest snowflake of the units that start inside this one, these are earlier versions of it that ended at an older last message.
+                covered = self.connection.execute('SELECT MAX(maxsnow) FROM units WHERE channel = ? AND minsnow >= ? AND minsnow <= ?', (str(channel), minsnow, maxsnow)).fetchone()[0]
+
+                if covered is not None:
+                    minsnow = max(minsnow, covered + 1)
+
+                # Add what is left of the unit.
+                added = minsnow <= maxsnow and self.connection.execute('INSERT OR IGNORE INTO units (guild, channel, minsnow, maxsnow) VALUES (?, ?, ?, ?)', (str(guild), str(channel), minsnow, maxsnow)).rowcount == 1
+                self.connection.execute('COMMIT')
+
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+        return added
+
+    def lease(self, owner):
+        """
+        Lease the next unit that is queued or whose lease has run out, returning it as a [id, guild, channel, minsnow, maxsnow] list or None if there's nothing to lease right now.
+        :param owner: The name of the worker, unique across the hosts (the host name and process ID).
+        """
+
+        with self.lock:
+            now = time()
+
+            # Take the write lock straight away so that two workers can never lease the same unit.
+            self.connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                # Give up on the units that keep failing or timing out.
+                self.connection.execute('UPDATE units SET state = \'failed\', owner = NULL WHERE state = \'leased\' AND expires < ? AND attempts >= ?', (now, self.maxattempts))
+
+                # Grab the oldest unit that is queued or whose lease ran out, leaving out the channels that another worker holds a live lease on since the message log, manifest and checksums of a channel can only have one writer at a time.
+                row = self.connection.execute('SELECT id, guild, channel, minsnow, maxsnow FROM units WHERE (state = \'queued\' OR (state = \'leased\' AND expires < ?)) AND channel NOT IN (SELECT channel FROM units WHERE state = \'leased\' AND expires >= ?) ORDER BY id LIMIT 1', (now, now)).fetchone()
+
+                if row is not None:
+                    self.connection.execute('UPDATE units SET state = \'leased\', owner = ?, expires = ?, attempts = attempts + 1 WHERE id = ?', (owner, now + self.leaseseconds, row[0]))
+
+                self.connection.execute('COMMIT')
+
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+        return list(row) if row is not None else None
+
+    def renew(self, unit, owner):
+        """
+        Extend the lease on a unit, returning False if the lease was lost (it ran out and another worker took the unit over).
+        :param unit: The ID of the unit.
+        :param owner: The name of the worker that holds the lease.
+        """
+
+        with self.lock:
+            return self.connection.execute('UPDATE units SET expires = ? WHERE id = ? AND owner = ? AND state = \'leased\'', (time() + self.leaseseconds, unit, owner)).rowcount == 1
+
+    def complete(self, unit, owner):
+        """
+        Mark a leased unit as done.
+        :param unit: The ID of the unit.
+        :param owner: The name of the worker that holds the lease.
+        """
+
+        with self.lock:
+            return self.connection.execute('UPDATE units SET state = \'done\', expires = NULL, finished = ? WHERE id = ? AND owner = ? AND state = \'leased\'', (time(), unit, owner)).rowcount == 1
+
+    def release(self, unit, owner):
+        """
+        Hand a leased unit back to the queue after it failed, it's marked as failed once it has used up its attempts.
+        :param unit: The ID of the unit.
+        :param owner: The name of the worker that holds the lease.
+        """
+
+        with self.lock:
+            self.connection.execute('UPDATE units SET state = CASE WHEN attempts >= ? THEN \'failed\' ELSE \'queued\' END, owner = NULL, expires = NULL WHERE id = ? AND owner = ? AND state = \'leased\'', (self.maxattempts, unit, owner))
+
+    def startHeartbeat(self, unit, owner):
+        """
+        Renew the lease on a unit from a background thread a few times per lease period, returning the event that stops it.
+        :param unit: The ID of the unit.
+        :param owner: The name of the worker that holds the lease.
+        """
+
+        # Create the event that stops the heartbeat.
+        stopping = Event()
+
+        def work():
+            while not stopping.wait(self.leaseseconds / 3.0):
+                try:
+                    if not self.renew(unit, owner):
+                        warn('Lost the lease on unit {0}, another worker may be scraping it as well.'.format(unit))
+                        return None
+
+                except Exception as ex:
+                    warn('Unable to renew the lease on unit {0}: {1}'.format(unit, ex))
+
+        # The thread is a daemon so that it never keeps the script alive.
+        Thread(target=work, daemon=True).start()
+
+        return stopping
+
+    def hasPending(self):
+        """
+        Determine if any unit is still queued or leased, a worker that can't lease anything waits for these in case their leases run out.
+        """
+
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM units WHERE state IN (\'queued\', \'leased\')').fetchone()[0] > 0
+
+    def getStatus(self):
+        """
+        Return the number of units in each state, the number of units that each worker finished, and the units finished per hour over the last hour.
+        """
+
+        with self.lock:
+            states = dict(self.connection.execute('SELECT state, COUNT(*) FROM units GROUP BY state').fetchall())
+            owners = dict(self.connection.execute('SELECT owner, COUNT(*) FROM units WHERE state = \'done\' GROUP BY owner').fetchall())
+            recent = self.connection.execute('SELECT COUNT(*) FROM units WHERE finished > ?', (time() - 3600, )).fetchone()[0]
+
+        return {'states': states, 'owners': owners, 'lasthour': recent}
+
+    @staticmethod
+    def splitRange(minsnow, maxsnow, days=30):
+        """
+        Split a snowflake range into [oldest, newest] units, newest first. The unit boundaries fall on fixed multiples of a number of days counted from the Discord epoch, so splitting the same channel again later gives the same units apart from the newest one.
+        :param minsnow: The oldest snowflake of the range.
+        :param maxsnow: The newest snowflake of the range.
+        :param days: The number of days that every unit covers.
+        """
+
+        # Grab the number of snowflakes in a unit, the timestamp portion of a snowflake starts 22 bits in.
+        step = int(days * 86400000) << 22
+
+        # Create an array to store the units.
+        units = []
+
+        while maxsnow >= minsnow:
+
+            # Start the unit on the boundary at or below its newest snowflake.
+            start = maxsnow - maxsnow % step
+
+            units.append([max(minsnow, start), maxsnow])
+            maxsnow = start - 1
+
+        return units
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+
+        with self.lock:
+            self.connection.close()